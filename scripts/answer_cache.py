@@ -0,0 +1,115 @@
+import argparse
+import os
+import pickle
+import hashlib
+import sqlite3
+import time
+
+
+class AnswerCache:
+    # An on-disk prompt -> answer cache shared by all runs, in one SQLite file.
+    # An answer is keyed by the model (id, revision, precision and answer scoring, see QA.answer_cache_model_key) and
+    # the hash of the prompt, so a byte-identical prompt is answered once per model, whatever task or run it belongs to.
+    # With max_size_mb, the least recently used answers are evicted once the cached answers grow past that size.
+    def __init__(self, db_fp, model_key, max_size_mb=None):
+        self.db_fp = db_fp
+        self.model_key = model_key
+        self.max_size_bytes = max_size_mb * 1024 * 1024 if max_size_mb is not None else None
+        self.connection = None
+        self.connection_pid = None
+        self.uncommitted = 0
+        self.used = [] # prompt hashes that were hit since the last commit, their last_used is updated in bulk
+
+        self.hits = 0
+        self.duplicates = 0
+        self.misses = 0
+
+    def connect(self):
+        # One connection per process: a --workers child must not use the connection it inherited from the parent
+        if self.connection is None or self.connection_pid != os.getpid():
+            db_dir = os.path.dirname(self.db_fp)
+            if db_dir and not os.path.exists(db_dir):
+                os.makedirs(db_dir)
+            # With --pipeline 1 the answers are put by the writer thread, QA serializes all use of the cache
+            self.connection = sqlite3.connect(self.db_fp, timeout=60, check_same_thread=False)
+            self.connection.execute('PRAGMA journal_mode=WAL') # the workers of one run read and write at the same time
+            self.connection.execute('CREATE TABLE IF NOT EXISTS answers (model TEXT, prompt_hash TEXT, answer BLOB, size INTEGER, last_used REAL, PRIMARY KEY (model, prompt_hash))')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)')
+            self.connection_pid = os.getpid()
+            self.uncommitted = 0
+            self.used = []
+        return self.connection
+
+    @staticmethod
+    def prompt_hash(prompt):
+        return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+    def get(self, prompt):
+        prompt_hash = self.prompt_hash(prompt)
+        row = self.connect().execute('SELECT answer FROM answers WHERE model = ? AND prompt_hash = ?', (self.model_key, prompt_hash)).fetchone()
+        if row is None:
+            return None
+        self.used.append(prompt_hash)
+        return pickle.loads(row[0])
+
+    def put(self, prompt, instance_output):
+        answer = pickle.dumps(instance_output, protocol=pickle.HIGHEST_PROTOCOL)
+        self.connect().execute('INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?)', (self.model_key, self.prompt_hash(prompt), answer, len(answer), time.time()))
+        self.uncommitted += 1
+        if self.uncommitted >= 100:
+            self.commit()
+
+    def commit(self):
+        if self.connection is None or self.connection_pid != os.getpid():
+            return
+        if self.used:
+            self.connection.executemany('UPDATE answers SET last_used = ? WHERE model = ? AND prompt_hash = ?', [(time.time(), self.model_key, prompt_hash) for prompt_hash in self.used])
+            self.used = []
+        self.connection.commit()
+        self.uncommitted = 0
+        if self.max_size_bytes is not None:
+            self.evict()
+
+    def evict(self):
+        # Drop the least recently used answers (of every model) until the cache is 10% below its size limit
+        total_size = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM answers').fetchone()[0]
+        if total_size <= self.max_size_bytes:
+            return
+        target_size = self.max_size_bytes * 0.9
+        evicted = 0
+        for model, prompt_hash, size in self.connection.execute('SELECT model, prompt_hash, size FROM answers ORDER BY last_used').fetchall():
+            if total_size <= target_size:
+                break
+            self.connection.execute('DELETE FROM answers WHERE model = ? AND prompt_hash = ?', (model, prompt_hash))
+            total_size -= size
+            evicted += 1
+        self.connection.commit()
+        print('Answer cache: evicted {} answers, {:.1f} MB left.'.format(evicted, total_size / 1024 / 1024))
+
+    def report(self):
+        looked_up = self.hits + self.duplicates + self.misses
+        if looked_up == 0:
+            return
+        print('Answer cache: {} questions, {} cache hits, {} duplicate prompts within the run, {} computed. Hit rate {:.1%}.'.format(
+            looked_up, self.hits, self.duplicates, self.misses, (self.hits + self.duplicates) / looked_up))
+
+    def close(self):
+        self.commit()
+        if self.connection is not None and self.connection_pid == os.getpid():
+            self.connection.close()
+        self.connection = None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Show or shrink the answer cache.')
+    parser.add_argument('--db', type=str, default='data/answer_cache.sqlite', help='The cache file. Default is data/answer_cache.sqlite.')
+    parser.add_argument('--max_size_mb', type=float, default=None, help='Evict the least recently used answers until the cache is below this size.')
+    args = parser.parse_args()
+
+    cache = AnswerCache(args.db, model_key=None, max_size_mb=args.max_size_mb)
+    connection = cache.connect()
+    for model, count, size in connection.execute('SELECT model, COUNT(*), SUM(size) FROM answers GROUP BY model ORDER BY model'):
+        print('{}: {} answers, {:.1f} MB'.format(model, count, size / 1024 / 1024))
+    if args.max_size_mb is not None:
+        cache.evict()
+    cache.close()
@@ -0,0 +1,80 @@
+import argparse
+import os
+import json
+import hashlib
+
+
+def tokenizer_fingerprint(tokenizer):
+    # Two tokenizers with the same class and the same vocabulary map the same ids to the same strings
+    vocab = sorted(tokenizer.get_vocab().items(), key=lambda item: item[1])
+    content = json.dumps([type(tokenizer).__name__, vocab], ensure_ascii=False)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()[:16]
+
+
+def normalize_token(text):
+    # SentencePiece marks a leading space with '▁' and byte-level BPE with 'Ġ', decode usually turns both into ' '
+    return text.replace('▁', ' ').replace('Ġ', ' ').strip()
+
+
+class AnswerTokenIndex:
+    # Every vocabulary id whose normalized form is one of the positive or negative answer tokens of DiSQ_Config,
+    # e.g. 'Yes', '▁Yes' and ' Yes' all count as 'Yes'.
+    # Building it decodes the whole vocabulary once, so the result is cached on disk per tokenizer.
+    def __init__(self, tokenizer, positive_tokens, negative_tokens, cache_dir):
+        self.positive_tokens = positive_tokens
+        self.negative_tokens = negative_tokens
+
+        answers = json.dumps([positive_tokens, negative_tokens])
+        answers_hash = hashlib.sha1(answers.encode('utf-8')).hexdigest()[:8]
+        self.fp = os.path.join(cache_dir, '{}_{}.json'.format(tokenizer_fingerprint(tokenizer), answers_hash))
+
+        if os.path.exists(self.fp):
+            with open(self.fp, 'r') as f:
+                index = json.load(f)
+        else:
+            index = self.build(tokenizer)
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            with open(self.fp, 'w') as f:
+                json.dump(index, f, indent=4)
+            print('Answer token index saved to:', self.fp)
+
+        self.positive_ids = index['positive_ids']
+        self.negative_ids = index['negative_ids']
+        print('Answer token index: {} positive and {} negative token ids.'.format(len(self.positive_ids), len(self.negative_ids)))
+
+    def build(self, tokenizer):
+        positive = set(self.positive_tokens)
+        negative = set(self.negative_tokens)
+        index = {'positive_ids': [], 'negative_ids': [], 'positive_tokens': [], 'negative_tokens': []}
+        for token_id in range(len(tokenizer)):
+            for text in [tokenizer.decode([token_id]), tokenizer.convert_ids_to_tokens(token_id)]:
+                if text is None:
+                    continue
+                text = normalize_token(text)
+                if text in positive:
+                    index['positive_ids'].append(token_id)
+                    index['positive_tokens'].append(tokenizer.convert_ids_to_tokens(token_id))
+                    break
+                if text in negative:
+                    index['negative_ids'].append(token_id)
+                    index['negative_tokens'].append(tokenizer.convert_ids_to_tokens(token_id))
+                    break
+        return index
+
+
+if __name__ == '__main__':
+    from transformers import AutoTokenizer
+    from disq_config import DiSQ_Config
+
+    parser = argparse.ArgumentParser(description='Build (or show) the answer token index of a tokenizer.')
+    parser.add_argument('--modelname', type=str, default='13bchat', help='Model name: 13bchat, 13b, 7bchat, 7b, vicuna-13b')
+    parser.add_argument('--modelurl', type=str, default=None, help='The model path in the hugging face model hub, overwrites modelname.')
+    parser.add_argument('--hfpath', type=str, default='YOUR_PATH', help='The cache_dir for the Hugging Face model.')
+    args = parser.parse_args()
+
+    config = DiSQ_Config(dataset='pdtb', modelname=args.modelname, modelurl=args.modelurl, version='v1', paraphrase=None, feature=None, hfpath=args.hfpath, device_number=None)
+    tokenizer = AutoTokenizer.from_pretrained(config.model, cache_dir=config.hfpath)
+    index = AnswerTokenIndex(tokenizer, config.positive_tokens, config.negative_tokens, config.answer_token_index_dir)
+    print('Positive:', tokenizer.convert_ids_to_tokens(index.positive_ids))
+    print('Negative:', tokenizer.convert_ids_to_tokens(index.negative_ids))
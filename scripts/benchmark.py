@@ -0,0 +1,382 @@
+import argparse
+import os
+import sys
+import json
+import time
+import pickle
+import shutil
+import string
+import platform
+import contextlib
+from datetime import datetime
+
+import numpy as np
+import torch
+
+from disq_config import DiSQ_Config
+from question_generation import QG
+from question_answering import QA
+from eval import Eval
+from result_store import convert_pickle_dir
+
+
+# The QA settings that are timed, by name
+QA_MODES = {
+    'single': {'batch_size': 1},
+    'batched': {'batch_size': 8, 'scoring_path': 'forward'},
+    'prefix': {'batch_size': 8, 'prefix_cache': True},
+    'pipeline': {'batch_size': 8, 'scoring_path': 'forward', 'pipeline': True},
+}
+
+
+class Benchmark:
+    # Times QG, QA and Eval fully offline on a CPU, with a tiny randomly initialized Llama model and a tokenizer
+    # trained on the dataset itself, both built locally under {work_dir}/tiny-llama.
+    # Everything (questions, results, scores) is written under work_dir, data/questions and data/results are not touched.
+    def __init__(self, work_dir, dataset='pdtb', version='v1', num_instances=20, repeats=3, seed=0):
+        self.work_dir = work_dir
+        self.dataset = dataset
+        self.version = version
+        self.num_instances = num_instances
+        self.repeats = repeats
+        self.seed = seed
+        self.model_dir = os.path.join(self.work_dir, 'tiny-llama')
+        self.log_fp = os.path.join(self.work_dir, 'benchmark.log')
+        if not os.path.exists(self.work_dir):
+            os.makedirs(self.work_dir)
+
+    def make_config(self):
+        config = DiSQ_Config(dataset=self.dataset, modelname=None, modelurl=self.model_dir, version=self.version, paraphrase=None, feature=None, hfpath=None, device_number=None)
+        # A modelurl names the model after its second path part, which for a local work_dir path means nothing
+        config.modelname = os.path.basename(self.model_dir)
+        config.question_dir = os.path.join(self.work_dir, 'questions')
+        config.result_dir = os.path.join(self.work_dir, 'results', 'real')
+        config.leaderboard_fp = os.path.join(self.work_dir, 'leaderboard.sqlite')
+        config.disq_score_fp = os.path.join(self.work_dir, 'disq_score.json')
+        config.disq_score_csv_fp = os.path.join(self.work_dir, 'disq_score.csv')
+        config.disq_score_best_csv_fp = os.path.join(self.work_dir, 'disq_score_best.csv')
+        config.disq_score_ci_csv_fp = os.path.join(self.work_dir, 'disq_score_ci.csv')
+        config.load_stats_fp = os.path.join(self.work_dir, 'model_load_stats.jsonl')
+        config.qg_metrics_fp = os.path.join(self.work_dir, 'qg_metrics.json')
+        config.answer_token_index_dir = os.path.join(self.work_dir, 'answer_token_index')
+        config.token_cache_dir = os.path.join(self.work_dir, 'token_cache')
+        return config
+
+    @contextlib.contextmanager
+    def quiet(self):
+        # The scripts print a line per question, it goes to the log file instead of the terminal
+        with open(self.log_fp, 'a') as f, contextlib.redirect_stdout(f):
+            yield
+
+    def build_model(self, vocab_size=2000):
+        # A Llama-architecture model small enough to answer a question in milliseconds, and a sentencepiece-style BPE
+        # tokenizer trained on the dataset, so prompts have realistic token lengths. Built once, the same seed gives the same weights.
+        if os.path.exists(os.path.join(self.model_dir, 'config.json')):
+            return
+        from tokenizers import Tokenizer, models, trainers, pre_tokenizers, decoders
+        from transformers import LlamaConfig, LlamaForCausalLM, LlamaTokenizerFast
+
+        config = self.make_config()
+        texts = []
+        for instance in config.data_dict.values():
+            texts += [instance['arg1'], instance['arg2'], instance.get('context') or '']
+            texts += [' '.join(event_pair) for event_pair in instance['events']]
+        # The answer tokens must be whole tokens of the vocabulary, as they are for Llama, or Eval finds no answer at all
+        texts += [' '.join(config.positive_tokens + config.negative_tokens)] * 100
+
+        tokenizer = Tokenizer(models.BPE(unk_token='<unk>'))
+        tokenizer.pre_tokenizer = pre_tokenizers.Metaspace()
+        tokenizer.decoder = decoders.Metaspace()
+        # Every printable character is in the vocabulary, the prompt templates have some (e.g. the newlines) that the dataset does not
+        trainer = trainers.BpeTrainer(vocab_size=vocab_size, special_tokens=['<unk>', '<s>', '</s>'], initial_alphabet=list(string.printable), show_progress=False)
+        tokenizer.train_from_iterator(texts, trainer=trainer)
+        tokenizer = LlamaTokenizerFast(tokenizer_object=tokenizer, unk_token='<unk>', bos_token='<s>', eos_token='</s>')
+
+        torch.manual_seed(self.seed)
+        model_config = LlamaConfig(vocab_size=len(tokenizer), hidden_size=64, intermediate_size=172, num_hidden_layers=2, num_attention_heads=4,
+            max_position_embeddings=2048, bos_token_id=tokenizer.bos_token_id, eos_token_id=tokenizer.eos_token_id)
+        model = LlamaForCausalLM(model_config)
+        with torch.no_grad():
+            # Larger LM head rows for the answer tokens, so that they often make the top 30 and the scores are not all 0.
+            # Larger weights inside the decoder would amplify the rounding differences between the QA settings instead.
+            answer_ids = sorted(set(tokenizer.convert_tokens_to_ids(['\u2581' + token for token in config.positive_tokens + config.negative_tokens])) - {tokenizer.unk_token_id})
+            model.lm_head.weight[answer_ids] *= 4
+        model.save_pretrained(self.model_dir)
+        tokenizer.save_pretrained(self.model_dir)
+        print('Built a tiny Llama model ({} parameters, vocabulary of {}) in {}'.format(sum(p.numel() for p in model.parameters()), len(tokenizer), self.model_dir))
+
+    def time_repeats(self, function):
+        # The best of self.repeats runs, the least disturbed by the rest of the host
+        seconds = []
+        for _ in range(self.repeats):
+            start = time.perf_counter()
+            function()
+            seconds.append(time.perf_counter() - start)
+        return min(seconds), seconds
+
+    def bench_qg(self):
+        config = self.make_config()
+        config.data_dict # parse the dataset outside of the timed part
+
+        def run():
+            with self.quiet():
+                QG(self.dataset, None, self.version, None, None, config).loop_through()
+
+        best, seconds = self.time_repeats(run)
+        num_instances = len(config.data_dict)
+        print('QG: {} instances in {:.3f} s'.format(num_instances, best))
+        return {'instances': num_instances, 'seconds': round(best, 4), 'all_seconds': [round(s, 4) for s in seconds], 'instances_per_second': round(num_instances / best, 1)}
+
+    def bench_qa(self, mode):
+        config = self.make_config()
+        config.result_dir = os.path.join(self.work_dir, 'results', mode)
+        shutil.rmtree(config.result_dir, ignore_errors=True)
+        with self.quiet():
+            qa = QA(config, device='cpu', subset=self.num_instances, **QA_MODES[mode])
+
+        # Per-question latency: the time between two finished batches, split over the questions of the batch
+        batch_ends = []
+        save_outputs = qa.save_outputs
+        def timed_save_outputs(logits, filenames):
+            save_outputs(logits, filenames)
+            batch_ends.append((time.perf_counter(), len(filenames)))
+        qa.save_outputs = timed_save_outputs
+
+        def run():
+            # Every repeat answers all questions again into an empty result directory
+            shutil.rmtree(config.result_dir, ignore_errors=True)
+            config.make_dir(config.result_dir)
+            del batch_ends[:]
+            self.qa_start = time.perf_counter()
+            with self.quiet():
+                qa.loop_through()
+
+        best, seconds = self.time_repeats(run)
+        latencies = []
+        previous = self.qa_start
+        for end, num_questions in batch_ends:
+            latencies += [(end - previous) / num_questions] * num_questions
+            previous = end
+        latencies = np.array(latencies) * 1000 # of the last repeat
+        num_questions = len(latencies)
+        print('QA {}: {} questions in {:.3f} s, {:.1f} questions/s'.format(mode, num_questions, best, num_questions / best))
+        return {
+            'settings': dict(QA_MODES[mode]),
+            'questions': num_questions,
+            'seconds': round(best, 4),
+            'all_seconds': [round(s, 4) for s in seconds],
+            'questions_per_second': round(num_questions / best, 2),
+            'latency_ms_mean': round(float(latencies.mean()), 3),
+            'latency_ms_p50': round(float(np.percentile(latencies, 50)), 3),
+            'latency_ms_p95': round(float(np.percentile(latencies, 95)), 3),
+        }
+
+    def load_results(self, result_dir):
+        # filename -> {token: probability} of every answer of a QA run, summed over token ids that decode to the same string as in Eval
+        results = {}
+        for fn in os.listdir(result_dir):
+            if fn.endswith('.pk'):
+                with open(os.path.join(result_dir, fn), 'rb') as f:
+                    tokens, probabilities = pickle.load(f)
+                results[fn] = {}
+                for token, prob in zip(tokens, probabilities):
+                    results[fn][token] = results[fn].get(token, 0.0) + prob
+        return results
+
+    def answer_probs(self, results):
+        # filename -> [p(positive), p(negative)] of every answer, the sums Eval compares, kept to check the answers against a baseline
+        config = self.make_config()
+        return {fn: [round(sum(prob for token, prob in token2prob.items() if token in config.positive_tokens), 6),
+            round(sum(prob for token, prob in token2prob.items() if token in config.negative_tokens), 6)] for fn, token2prob in sorted(results.items())}
+
+    def flip_answer(self, answer):
+        # The same answer with its positive and negative tokens swapped, so that Eval reads the opposite answer
+        config = self.make_config()
+        swap = {token: config.negative_tokens[0] for token in config.positive_tokens}
+        swap.update({token: config.positive_tokens[0] for token in config.negative_tokens})
+        tokens, probabilities = answer
+        return [[swap.get(token, token) for token in tokens], probabilities]
+
+    def max_prob_diff(self, results, reference):
+        # The largest probability difference of a token both runs have in the top 30 of the same question.
+        # Batching and padding change the floating point rounding, so the answers are equal up to about 1e-6.
+        if set(results) != set(reference):
+            return None
+        diff = 0.0
+        for fn, token2prob in results.items():
+            for token, prob in token2prob.items():
+                if token in reference[fn]:
+                    diff = max(diff, abs(prob - reference[fn][token]))
+        return diff
+
+    def make_scaled_results(self, num_instances):
+        # A synthetic result set for the first num_instances instances of the question file: every question gets the
+        # answer of a real question of the same type, round robin, so Eval does the same work as on a full run.
+        # The tiny model gives almost every question the same answer, so a seeded half of them get the opposite one:
+        # the scores are then far from 0 and 1, and a change in the scoring shows up in the comparison with a baseline.
+        config = self.make_config()
+        rng = np.random.default_rng(self.seed)
+        real_dir = os.path.join(self.work_dir, 'results', 'single')
+        real = {}
+        for fn in sorted(os.listdir(real_dir)):
+            if fn.endswith('.pk'):
+                with open(os.path.join(real_dir, fn), 'rb') as f:
+                    real.setdefault(fn.split('-')[4], []).append(pickle.load(f))
+
+        result_dir = os.path.join(self.work_dir, 'results', 'scaled_{}'.format(num_instances))
+        shutil.rmtree(result_dir, ignore_errors=True)
+        os.makedirs(result_dir)
+        with open(os.path.join(config.question_dir, '{}.json'.format(config.taskname)), 'r') as f:
+            question_dict = json.load(f)
+        count = 0
+        for instance_key in list(question_dict)[:num_instances]:
+            for pair_idx, questions in question_dict[instance_key].items():
+                for qtype, field in [('TQ', 'targeted_question'), ('CQ', 'counterfactual_question'), ('CTQ', 'converse_targeted_question'), ('CCQ', 'converse_counterfactual_question')]:
+                    for qidx in range(len(questions[field])):
+                        answer = real[qtype][count % len(real[qtype])]
+                        if rng.random() < 0.5:
+                            answer = self.flip_answer(answer)
+                        with open(os.path.join(result_dir, 'D-{}-e-{}-{}-{}.pk'.format(instance_key, pair_idx, qtype, qidx)), 'wb') as f:
+                            pickle.dump(answer, f)
+                        count += 1
+        return result_dir, {key: question_dict[key] for key in list(question_dict)[:num_instances]}
+
+    def bench_eval(self, name, result_dir, question_dict):
+        config = self.make_config()
+        config.result_dir = result_dir
+
+        def run():
+            with self.quiet():
+                evaluation = Eval(config, verbalize=0)
+                evaluation.question_dict = question_dict
+                evaluation.loop_through(desired_DR=None)
+                evaluation.eval_all_level2_relations()
+                evaluation.save_results()
+            self.last_scores = evaluation.current_disq_score_dict
+
+        best, seconds = self.time_repeats(run)
+        num_questions = sum(len(questions[field]) for instance in question_dict.values() for questions in instance.values()
+            for field in ['targeted_question', 'counterfactual_question', 'converse_targeted_question', 'converse_counterfactual_question'])
+        print('Eval {}: {} questions in {:.3f} s'.format(name, num_questions, best))
+        scores = {key: value for key, value in self.last_scores.items() if key not in ['modelname', 'version', 'paraphrase', 'feature']}
+        return {'questions': num_questions, 'seconds': round(best, 4), 'all_seconds': [round(s, 4) for s in seconds],
+            'questions_per_second': round(num_questions / best, 1), 'scores': scores}
+
+    def run(self, qa_modes, eval_sizes):
+        self.build_model()
+        results = {
+            'meta': {
+                'time': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'torch': torch.__version__,
+                'torch_threads': torch.get_num_threads(),
+                'cpu_count': os.cpu_count(),
+                'dataset': self.dataset,
+                'version': self.version,
+                'num_instances': self.num_instances,
+                'repeats': self.repeats,
+            },
+            'qg': self.bench_qg(),
+            'qa': {},
+            'eval': {},
+        }
+        # The single mode is the reference answer set for the other modes and for the scaled Eval sets
+        for mode in ['single'] + [mode for mode in qa_modes if mode != 'single']:
+            results['qa'][mode] = self.bench_qa(mode)
+        reference = self.load_results(os.path.join(self.work_dir, 'results', 'single'))
+        for mode in results['qa']:
+            results['qa'][mode]['max_prob_diff'] = self.max_prob_diff(self.load_results(os.path.join(self.work_dir, 'results', mode)), reference)
+        results['qa']['single']['answers'] = self.answer_probs(reference)
+
+        config = self.make_config()
+        real_dir = os.path.join(self.work_dir, 'results', 'single')
+        with open(os.path.join(config.question_dir, '{}.json'.format(config.taskname)), 'r') as f:
+            full_question_dict = json.load(f)
+        real_keys = set(fn.split('-')[1] for fn in os.listdir(real_dir) if fn.endswith('.pk'))
+        results['eval']['real'] = self.bench_eval('real', real_dir, {key: value for key, value in full_question_dict.items() if key in real_keys})
+        for size in eval_sizes:
+            num_instances = len(full_question_dict) if size == 'all' else min(int(size), len(full_question_dict))
+            result_dir, question_dict = self.make_scaled_results(num_instances)
+            results['eval']['pickle_{}'.format(num_instances)] = self.bench_eval('pickle_{}'.format(num_instances), result_dir, question_dict)
+            with self.quiet():
+                convert_pickle_dir(result_dir, remove_pickles=True)
+            results['eval']['store_{}'.format(num_instances)] = self.bench_eval('store_{}'.format(num_instances), result_dir, question_dict)
+        return results
+
+
+def compare(results, baseline, tolerance, max_prob_diff=1e-4):
+    # Every timing that got slower than the baseline by more than tolerance, and every answer or score that changed.
+    # Returns the list of problems, empty if the run is as fast and as correct as the baseline.
+    problems = []
+    rows = [('qg', None, results['qg'], baseline.get('qg'))]
+    rows += [('qa', mode, value, baseline.get('qa', {}).get(mode)) for mode, value in results['qa'].items()]
+    rows += [('eval', name, value, baseline.get('eval', {}).get(name)) for name, value in results['eval'].items()]
+
+    print('{:<28} {:>10} {:>10} {:>8}'.format('stage', 'baseline s', 'now s', 'ratio'))
+    for stage, name, current, reference in rows:
+        label = stage if name is None else '{} {}'.format(stage, name)
+        if reference is None:
+            print('{:<28} {:>10} {:>10.4f} {:>8}'.format(label, '-', current['seconds'], 'new'))
+            continue
+        ratio = current['seconds'] / reference['seconds'] if reference['seconds'] > 0 else float('inf')
+        print('{:<28} {:>10.4f} {:>10.4f} {:>8.2f}'.format(label, reference['seconds'], current['seconds'], ratio))
+        if ratio > 1 + tolerance:
+            problems.append('{} is {:.0%} slower than the baseline'.format(label, ratio - 1))
+        if 'scores' in reference and current['scores'] != reference['scores']:
+            problems.append('{} scores differ from the baseline'.format(label))
+
+    # The answers must match the baseline question by question, the scores of the tiny model alone are too uniform to show it
+    reference_answers = baseline.get('qa', {}).get('single', {}).get('answers')
+    if reference_answers is not None:
+        answers = results['qa']['single']['answers']
+        diff = None
+        if set(answers) == set(reference_answers):
+            diff = max([abs(prob - reference_prob) for fn in answers for prob, reference_prob in zip(answers[fn], reference_answers[fn])], default=0.0)
+        if diff is None or diff > max_prob_diff:
+            problems.append('qa single answers differ from the baseline (max probability difference {})'.format(diff))
+
+    # All QA settings must give the same answers as one question at a time
+    for mode, value in results['qa'].items():
+        if value['max_prob_diff'] is None or value['max_prob_diff'] > max_prob_diff:
+            problems.append('qa {} answers differ from qa single (max probability difference {})'.format(mode, value['max_prob_diff']))
+    return problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark QG, QA and Eval offline on the CPU with a tiny, randomly initialized Llama model.')
+    parser.add_argument('--work_dir', type=str, default='data/benchmark', help='Where the tiny model, the questions and the results are kept. Default is data/benchmark.')
+    parser.add_argument('--dataset', type=str, default='pdtb', help='pdtb, ted, or the path of a dataset file, e.g. a synthetic one from dataset_scaler.py.')
+    parser.add_argument('--version', type=str, default='v1', help='v1, v2, v3, or v4?')
+    parser.add_argument('--num_instances', type=int, default=20, help='Number of discourse instances answered by QA, evenly spaced over the dataset. Default is 20.')
+    parser.add_argument('--qa_modes', type=str, default=','.join(QA_MODES), help='Comma-separated QA settings to time, out of: {}. single is always timed.'.format(', '.join(QA_MODES)))
+    parser.add_argument('--eval_sizes', type=str, default='all', help='Comma-separated sizes (in instances, or all) of the synthetic result sets Eval is timed on, as pickles and as a result store. Default is all.')
+    parser.add_argument('--repeats', type=int, default=3, help='QG and Eval are timed this many times, the best time is kept. Default is 3.')
+    parser.add_argument('--threads', type=int, default=None, help='Number of torch threads. Default is the torch default.')
+    parser.add_argument('--output', type=str, default=None, help='The JSON file for the results. Default is {work_dir}/benchmark.json.')
+    parser.add_argument('--baseline', type=str, default=None, help='A JSON file of an earlier run: report the speed ratio of every stage, and fail on regressions or changed answers.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Only with --baseline: a stage more than this fraction slower than the baseline is a regression. Default is 0.2.')
+    p = parser.parse_args()
+
+    if p.threads is not None:
+        torch.set_num_threads(p.threads)
+    for mode in p.qa_modes.split(','):
+        if mode not in QA_MODES:
+            raise ValueError('Unknown QA mode {}, options: {}'.format(mode, ', '.join(QA_MODES)))
+
+    benchmark = Benchmark(p.work_dir, dataset=p.dataset, version=p.version, num_instances=p.num_instances, repeats=p.repeats)
+    results = benchmark.run(p.qa_modes.split(','), p.eval_sizes.split(','))
+
+    output_fp = p.output if p.output is not None else os.path.join(p.work_dir, 'benchmark.json')
+    with open(output_fp, 'w') as f:
+        json.dump(results, f, indent=4)
+    print('Results saved to:', output_fp)
+
+    if p.baseline is not None:
+        with open(p.baseline, 'r') as f:
+            baseline = json.load(f)
+        problems = compare(results, baseline, p.tolerance)
+        for problem in problems:
+            print('REGRESSION:', problem)
+        if len(problems) > 0:
+            sys.exit(1)
+        print('No regressions against', p.baseline)
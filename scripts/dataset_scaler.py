@@ -0,0 +1,107 @@
+import argparse
+import os
+import json
+from collections import Counter
+
+import numpy as np
+
+
+class DatasetScaler:
+    # Builds synthetic datasets of any size from a bundled one, to load-test QG -> QA -> Eval beyond 1018 PDTB / 448 TED instances.
+    # Every synthetic instance has the schema of the source (arg1, arg2, DR, Conn, events, and context / disctype if the source
+    # has them) and the DRs keep the exact proportions of the source. An instance takes its DR, Conn, context and number of
+    # event pairs from one source instance, arg1 and the first events from it, arg2 and the second events from another source
+    # instance of the same DR, so the prompts have realistic lengths but are (mostly) not copies of each other.
+    REQUIRED_KEYS = ['arg1', 'arg2', 'DR', 'Conn', 'events']
+    OPTIONAL_KEYS = ['context', 'disctype']
+
+    def __init__(self, source_fp, seed=0):
+        self.source_fp = source_fp
+        with open(self.source_fp, 'r') as f:
+            self.source = list(json.load(f).values())
+        self.rng = np.random.default_rng(seed)
+        self.keys = self.REQUIRED_KEYS + [key for key in self.OPTIONAL_KEYS if all(key in instance for instance in self.source)]
+
+        # DR -> indices of its source instances
+        self.DR_instances = {}
+        for idx, instance in enumerate(self.source):
+            self.DR_instances.setdefault(instance['DR'], []).append(idx)
+
+    def DR_counts(self, num_instances):
+        # The number of instances per DR, proportional to the source (largest remainder, so they add up to num_instances)
+        DRs = sorted(self.DR_instances)
+        quotas = np.array([len(self.DR_instances[DR]) for DR in DRs], dtype=np.float64) * num_instances / len(self.source)
+        counts = np.floor(quotas).astype(np.int64)
+        for idx in np.argsort(-(quotas - counts), kind='stable')[:num_instances - counts.sum()]:
+            counts[idx] += 1
+        return dict(zip(DRs, counts.tolist()))
+
+    def generate(self, num_instances):
+        # The DR of every synthetic instance in a random order, then a (first, second) source instance for each
+        DRs = []
+        for DR, count in self.DR_counts(num_instances).items():
+            DRs += [DR] * count
+        DRs = [DRs[idx] for idx in self.rng.permutation(len(DRs))]
+
+        dataset = {}
+        for Didx, DR in enumerate(DRs):
+            pool = self.DR_instances[DR]
+            first = self.source[pool[self.rng.integers(len(pool))]]
+            second = self.source[pool[self.rng.integers(len(pool))]]
+            events = []
+            for pair_idx, event_pair in enumerate(first['events']):
+                other_pair = second['events'][pair_idx % len(second['events'])]
+                events.append([event_pair[0], other_pair[1]])
+
+            instance = {'Didx': Didx, 'arg1': first['arg1'], 'arg2': second['arg2'], 'DR': DR, 'Conn': first['Conn'], 'events': events}
+            for key in self.keys[len(self.REQUIRED_KEYS):]:
+                instance[key] = first[key]
+            dataset[str(Didx)] = instance
+        return dataset
+
+    def check_schema(self, dataset):
+        # Raise on any instance QG could not read
+        for key, instance in dataset.items():
+            for field in self.keys:
+                if field not in instance:
+                    raise ValueError('Instance {} has no {}'.format(key, field))
+            if len(instance['events']) == 0 or any(len(event_pair) != 2 for event_pair in instance['events']):
+                raise ValueError('Instance {} needs one or more event pairs of two events'.format(key))
+
+    def report(self, dataset):
+        source_DRs = Counter(instance['DR'] for instance in self.source)
+        DRs = Counter(instance['DR'] for instance in dataset.values())
+        max_share_diff = max(abs(DRs[DR] / len(dataset) - source_DRs[DR] / len(self.source)) for DR in source_DRs)
+        num_pairs = sum(len(instance['events']) for instance in dataset.values())
+        num_distinct = len(set((instance['arg1'], instance['arg2']) for instance in dataset.values()))
+        print('{} instances with {} event pairs ({} distinct arg1/arg2 combinations), from {} instances with {} event pairs.'.format(
+            len(dataset), num_pairs, num_distinct, len(self.source), sum(len(instance['events']) for instance in self.source)))
+        print('{} DRs, largest difference of a DR share to the source: {:.4%}'.format(len(DRs), max_share_diff))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic dataset with the schema and DR distribution of a bundled one, at any size.')
+    parser.add_argument('--dataset', type=str, default='pdtb', help='The source: pdtb, ted, or the path of a dataset file.')
+    parser.add_argument('--scale', type=float, default=10, help='The size as a multiple of the source, e.g. 10, 100 or 1000. Default is 10.')
+    parser.add_argument('--num_instances', type=int, default=None, help='The size in instances, overwrites --scale.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed. Default is 0.')
+    parser.add_argument('--output', type=str, default=None, help='The output file. Default is data/datasets/dataset_{dataset}_x{scale}.json.')
+    args = parser.parse_args()
+
+    source_fps = {'pdtb': 'data/datasets/dataset_pdtb.json', 'ted': 'data/datasets/dataset_TED.json'}
+    source_fp = source_fps.get(args.dataset, args.dataset)
+    scaler = DatasetScaler(source_fp, seed=args.seed)
+    num_instances = args.num_instances if args.num_instances is not None else int(round(len(scaler.source) * args.scale))
+
+    dataset = scaler.generate(num_instances)
+    scaler.check_schema(dataset)
+    scaler.report(dataset)
+
+    output_fp = args.output
+    if output_fp is None:
+        name = args.dataset if args.dataset in source_fps else os.path.splitext(os.path.basename(source_fp))[0].replace('dataset_', '', 1)
+        suffix = 'x{:g}'.format(args.scale) if args.num_instances is None else 'n{}'.format(num_instances)
+        output_fp = os.path.join('data/datasets', 'dataset_{}_{}.json'.format(name, suffix))
+    with open(output_fp, 'w') as f:
+        json.dump(dataset, f)
+    print('Dataset saved to: {}, use it with --dataset {}'.format(output_fp, output_fp))
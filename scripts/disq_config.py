@@ -1,9 +1,45 @@
 import os
 import json
+import pickle
+import hashlib
+
+from qa_utils import ParaphraseRegistry
+
+
+# Parsed datasets of this process, by file hash, shared by every DiSQ_Config
+loaded_datasets = {}
+
+
+def load_dataset(fp, cache_dir='data/cache'):
+    # Parse a dataset JSON file once: the parsed dict is kept as a pickle in cache_dir, keyed by the hash of the file,
+    # so it is only parsed again when the file changes
+    with open(fp, 'rb') as f:
+        content = f.read()
+    file_hash = hashlib.sha1(content).hexdigest()[:16]
+    if file_hash in loaded_datasets:
+        return loaded_datasets[file_hash]
+
+    cache_fp = os.path.join(cache_dir, '{}_{}.pkl'.format(os.path.splitext(os.path.basename(fp))[0], file_hash))
+    if os.path.exists(cache_fp):
+        with open(cache_fp, 'rb') as f:
+            data_dict = pickle.load(f)
+    else:
+        data_dict = json.loads(content)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        # write to a temporary file first, two processes may build the same cache at once
+        tmp_fp = '{}.tmp{}'.format(cache_fp, os.getpid())
+        with open(tmp_fp, 'wb') as f:
+            pickle.dump(data_dict, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_fp, cache_fp)
+    loaded_datasets[file_hash] = data_dict
+    return data_dict
 
 
 class DiSQ_Config:
-    def __init__(self, dataset, modelname, modelurl, version, paraphrase, feature, hfpath, device_number):
+    # Building a config only sets names and paths. The dataset, the question templates and the output
+    # directories are loaded or created on first use (data_dict, QAUtils, make_dir).
+    def __init__(self, dataset, modelname, modelurl, version, paraphrase, feature, hfpath, device_number, precision=None):
         self.dataset = dataset
         self.modelname = modelname
         self.modelurl = modelurl
@@ -13,49 +49,42 @@ class DiSQ_Config:
         self.hfpath = hfpath
         self.modelname = modelname
         self.device_number = device_number
+        self.precision = precision
 
         if self.modelurl is not None: 
             # replace the modelname with the modelurl's 2nd part after '/'
             # for example, "meta-llama/Meta-Llama-3.1-8B" -> "Meta-Llama-3.1-8B"
             self.modelname = self.modelurl.split('/')[1]
         
-        if self.paraphrase is None:
-            from qa_utils import QAUtils
-            self.QAUtils = QAUtils()
-        elif self.paraphrase == 'p1':
-            from qa_utils_p1 import QAUtils_P1
-            self.QAUtils = QAUtils_P1()
-        elif self.paraphrase == 'p2':
-            from qa_utils_p2 import QAUtils_P2
-            self.QAUtils = QAUtils_P2()
+        # The question templates of every paraphrase set live in data/paraphrases, see qa_utils.py
+        self.paraphrase_registry = ParaphraseRegistry()
         
         if self.dataset == 'pdtb':
-            fp = 'data/datasets/dataset_pdtb.json'
+            self.dataset_fp = 'data/datasets/dataset_pdtb.json'
         elif self.dataset == 'ted':
-            fp = 'data/datasets/dataset_TED.json'
-        with open(fp, 'r') as f:
-            self.data_dict = json.load(f)
+            self.dataset_fp = 'data/datasets/dataset_TED.json'
+        elif self.dataset.endswith('.json'):
+            # A dataset file, e.g. a synthetic one from dataset_scaler.py. The file name names the task and the score files:
+            # data/datasets/dataset_pdtb_x10.json -> pdtb_x10, so its questions go to dataset_pdtb_x10_prompt_v1.json
+            self.dataset_fp = self.dataset
+            self.dataset = os.path.splitext(os.path.basename(self.dataset_fp))[0].replace('dataset_', '', 1)
+        else:
+            raise ValueError('Unknown dataset {}, options: pdtb, ted, or the path of a dataset file'.format(self.dataset))
+        self.dataset_cache_dir = 'data/cache'
+        self.loaded_data_dict = None
         
         self.NUM_LEVEL2_RELATION = 11
 
         self.question_dir = 'data/questions'
-        # Check if the directory exists, if not create it
-        if not os.path.exists(self.question_dir):
-            os.makedirs(self.question_dir)
         
-        # In the format dataset_{}_prompt_{}
-        self.taskname = 'dataset_{}_prompt_{}'.format(self.dataset, self.version)
-        # If self.feature is None, then we append it to the end of the taskname
-        if self.feature in ['conn', 'context']:
-            self.taskname += '_{}'.format(self.feature)
-        # If self.paraphrase is not None, then we append it to the end of the taskname
-        if self.paraphrase is not None:
-            self.taskname += '_{}'.format(self.paraphrase)
-        if self.feature == 'history':
-            self.taskname += '_{}_{}'.format(self.modelname, 'history')
+        self.taskname = self.get_taskname(self.paraphrase)
         
         self.positive_tokens = ['Yes', 'yes', 'YES', 'True', 'true', 'TRUE', 'correct', 'Correct', 'CORRECT', 'positive', 'Positive', 'POSITIVE']
         self.negative_tokens = ['No', 'no', 'NO', 'False', 'false', 'FALSE', 'incorrect', 'Incorrect', 'INCORRECT', 'negative', 'Negative', 'NEGATIVE', 'IN', 'in']
+        # Cached per tokenizer: the vocabulary ids of the positive and negative tokens (see answer_tokens.py)
+        self.answer_token_index_dir = 'data/answer_token_index'
+        # Pre-tokenized question files, per tokenizer and question file (see token_cache.py)
+        self.token_cache_dir = 'data/token_cache'
         
         if self.modelname == '13bchat':
             self.model = "meta-llama/Llama-2-13b-chat-hf"
@@ -78,28 +107,66 @@ class DiSQ_Config:
             self.model = self.modelurl
         
         self.result_dir = 'data/results/{}_{}'.format(self.modelname, self.taskname)
-        # When self.modelname is not none, check if the directory exists, if not create it
-        if self.modelname is not None and not os.path.exists(self.result_dir):
-            os.makedirs(self.result_dir)
-            print('Directory {} created.'.format(self.result_dir))
+        # Reduced-precision runs (bf16, int8) get their own result directory, next to the full-precision one
+        if self.precision in ['bf16', 'int8']:
+            self.result_dir += '_{}'.format(self.precision)
         
-        # Create a json file for disq_score.json
+        # The DiSQ scores of all runs and datasets (leaderboard.py), disq_score_{dataset}.json/.csv and the best csv are exported from it
+        self.leaderboard_fp = 'data/results/leaderboard.sqlite'
+        # A json file for disq_score.json, imported into the leaderboard if the leaderboard has no runs of the dataset yet
         self.disq_score_fp = 'data/results/disq_score_{}.json'.format(self.dataset)
 
-        # check if 'data/results' exists, if not create it
-        if not os.path.exists('data/results'):
-            os.makedirs('data/results')
-
-        # check if the file exists, if not create it and initialize it with an empty dictionary
-        if not os.path.exists(self.disq_score_fp):
-            with open(self.disq_score_fp, 'w') as f:
-                json.dump({}, f)
-
         self.disq_score_csv_fp = 'data/results/disq_score_{}.csv'.format(self.dataset)
+        # The run metrics of QG (see run_metrics.py), QA and Eval write theirs next to the result directory (metrics_fp)
+        self.qg_metrics_fp = 'data/results/{}_qg_metrics.json'.format(self.taskname)
+        # One line per QA startup with the model loading time and peak RSS
+        self.load_stats_fp = 'data/results/model_load_stats.jsonl'
         self.disq_score_best_csv_fp = 'data/results/disq_score_{}_best.csv'.format(self.dataset)
+        # The bootstrap confidence intervals of the runs evaluated with --bootstrap, one line per run and score
+        self.disq_score_ci_csv_fp = 'data/results/disq_score_{}_ci.csv'.format(self.dataset)
 
-        # create a verbalization directory
+        # a verbalization directory
         self.verbalization_dir = 'data/verbalizations'
-        # check if the directory exists, if not create it
-        if not os.path.exists(self.verbalization_dir):
-            os.makedirs(self.verbalization_dir)
+
+    @property
+    def data_dict(self):
+        if self.loaded_data_dict is None:
+            self.loaded_data_dict = load_dataset(self.dataset_fp, self.dataset_cache_dir)
+        return self.loaded_data_dict
+
+    @property
+    def QAUtils(self):
+        return self.paraphrase_registry.get(self.paraphrase)
+
+    def make_dir(self, path):
+        # Create an output directory right before something is written to it
+        if not os.path.exists(path):
+            os.makedirs(path)
+            print('Directory {} created.'.format(path))
+        return path
+
+    def metrics_fp(self, step, kind='metrics'):
+        # The run metrics of QA and Eval (see run_metrics.py) and the QA profiler trace are kept next to the result directory,
+        # e.g. data/results/13bchat_dataset_pdtb_prompt_v1_qa_metrics.json
+        return '{}_{}_{}.json'.format(self.result_dir.rstrip('/'), step, kind)
+
+    def level2_DR(self, DR):
+        # The level-2 relation a DR is scored under, e.g. Comparison.Concession.Arg1-as-denier -> Comparison.Concession
+        if DR == 'Contingency.Cause.Result':
+            return 'Contingency.Result'
+        if DR == 'Contingency.Cause.Reason':
+            return 'Contingency.Reason'
+        return '.'.join(DR.split('.')[:2])
+
+    def get_taskname(self, paraphrase):
+        # In the format dataset_{}_prompt_{}
+        taskname = 'dataset_{}_prompt_{}'.format(self.dataset, self.version)
+        # If self.feature is None, then we append it to the end of the taskname
+        if self.feature in ['conn', 'context']:
+            taskname += '_{}'.format(self.feature)
+        # If the paraphrase is not None, then we append it to the end of the taskname
+        if paraphrase is not None:
+            taskname += '_{}'.format(paraphrase)
+        if self.feature == 'history':
+            taskname += '_{}_{}'.format(self.modelname, 'history')
+        return taskname
@@ -2,39 +2,52 @@ import argparse
 import os
 import pickle
 import json
-from datetime import datetime
-from collections import defaultdict
-import pandas as pd
-import csv
-
-import torch
-import torch.nn.functional as F
-from transformers import AutoTokenizer, AutoModelForCausalLM
+import time
+import numpy as np
 
 from disq_config import DiSQ_Config
-from sklearn.metrics import accuracy_score
+from scoring import token_answer, store_answers, group_scores, bootstrap_scores
+from result_store import ResultStore
+from run_metrics import RunMetrics
+from leaderboard import Leaderboard
+
+
+# Parsed question files and their question layouts (see Eval.question_layout) of this process, shared by the runs of
+# an eval sweep (eval_sweep.py) that use the same questions
+loaded_questions = {}
+question_layouts = {}
+
+
+def load_questions(fp):
+    if fp not in loaded_questions:
+        with open(fp, 'r') as f:
+            loaded_questions[fp] = json.load(f)
+    return loaded_questions[fp]
 
 
 class Eval:
     def __init__(self, config, verbalize):
         self.config = config
         self.verbalize = verbalize
+        # Stage timers and per-DR reading time, written to config.metrics_fp('eval') by the main script
+        self.metrics = RunMetrics('Eval')
+        load_start = time.perf_counter()
         
         # Load the questions
         self.taskname = self.config.taskname
         self.question_dir = self.config.question_dir
         self.question_fp = os.path.join(self.question_dir, f'{self.taskname}.json')
-        with open(self.question_fp, 'r') as f:
-            self.question_dict = json.load(f)
+        self.question_dict = load_questions(self.question_fp)
 
         # Load results
         self.modelname = self.config.modelname
+        if self.config.precision in ['bf16', 'int8']:
+            # Keep reduced-precision runs apart from the full-precision ones in disq_score_*.json and the best csv
+            self.modelname = '{}-{}'.format(self.modelname, self.config.precision)
         self.result_dir = self.config.result_dir
         self.data_dict = self.config.data_dict
         self.disq_score_fp = self.config.disq_score_fp
-
-        with open(self.disq_score_fp, 'r') as f:
-            self.disq_score_dict = json.load(f)
+        self.result_store = ResultStore(self.result_dir) if ResultStore.exists(self.result_dir) else None
 
         self.init_dataset_stats()
 
@@ -43,20 +56,16 @@ class Eval:
         self.current_disq_score_dict['version'] = self.config.version
         self.current_disq_score_dict['paraphrase'] = self.config.paraphrase
         self.current_disq_score_dict['feature'] = self.config.feature
+        # Bootstrap confidence intervals of the scores above, if bootstrap() is run: {'confidence', 'resamples', 'intervals': {score: [low, high]}}
+        self.current_disq_score_ci = None
+        self.metrics.add_time('load', time.perf_counter() - load_start)
     
     def init_dataset_stats(self):
         # Loop through the data_dict and initialize the stats
         # To do so, we get the mapping between keys and the DR field
         self.id2DR = {}
         for key in self.data_dict:
-            DR = self.data_dict[key]['DR']
-            DR = '.'.join(DR.split('.')[:2])
-            if self.data_dict[key]['DR'] == 'Contingency.Cause.Result':
-                DR = 'Contingency.Result'
-            if self.data_dict[key]['DR'] == 'Contingency.Cause.Reason':
-                DR = 'Contingency.Reason'
-            
-            self.id2DR[int(key)] = DR
+            self.id2DR[int(key)] = self.config.level2_DR(self.data_dict[key]['DR'])
         # Get the DR2id, which is a dict of list
         self.DR2id = {}
         for key in self.id2DR:
@@ -72,219 +81,198 @@ class Eval:
 
         self.level2_relation = ['Comparison.Concession', 'Comparison.Contrast', 'Contingency.Reason', 'Contingency.Result', 'Expansion.Conjunction', 'Expansion.Equivalence', 'Expansion.Instantiation', 'Expansion.Level-of-detail', 'Expansion.Substitution', 'Temporal.Asynchronous', 'Temporal.Synchronous']
 
-    def process_prob(self, fp):
-        with open(fp, 'rb') as f:
+    def load_output(self, filename):
+        # Read the answer of one question, from the result store if the run has one, otherwise from its pickle file
+        if self.result_store is not None:
+            return self.result_store.get(filename)
+        result_fp = os.path.join(self.result_dir, f'{filename}.pk')
+        with open(result_fp, 'rb') as f:
             instance_output = pickle.load(f)
-        tokens = instance_output[0]
-        probabilities = instance_output[1]
-        token2prob = defaultdict(float)
-        for idx, token in enumerate(tokens):
-            token2prob[token] += probabilities[idx]
-        # Get the positive probability by looping through the positive tokens
-        positive_prob = 0
-        for token in self.config.positive_tokens:
-            positive_prob += token2prob[token]
-        # Get the negative probability by looping through the negative tokens
-        negative_prob = 0
-        for token in self.config.negative_tokens:
-            negative_prob += token2prob[token]
-        # If the positive probability is greater than the negative probability, then return 1, else return 0
-        if positive_prob > negative_prob:
-            return 1
-        else:
-            return 0
+        return instance_output
 
-    def eval_all_level2_relations(self):
-        for level2_relation in self.level2_relation:
-            print('Evaluating level2_relation:', level2_relation)
-            self.loop_through(desired_DR=level2_relation)
+    def process_prob(self, filename):
+        instance_output = self.load_output(filename)
+        return token_answer(instance_output[0], instance_output[1], self.config.positive_tokens, self.config.negative_tokens)
 
-    
-    def loop_through(self, desired_DR):
-        TQ_is_YES_GT_list = []
-        TQ_is_YES_list = []
-        CQ_is_YES_GT_list = []
-        CQ_is_YES_list = []
-        CTQ_is_YES_GT_list = []
-        CTQ_is_YES_list = []
-        CCQ_is_YES_GT_list = []
-        CCQ_is_YES_list = []
-        TQ_consistency_count, TQ_consistency_total = 0, 0
-        CQ_consistency_count, CQ_consistency_total = 0, 0
-
-        results_consolidated = dict()
-
-        index_for_desired_DR = []
-        if desired_DR is not None:
-            index_for_desired_DR = self.DR2id[desired_DR]
-            # convert them to integer
-            index_for_desired_DR = [int(idx) for idx in index_for_desired_DR]
-        else:
-            # the whole set
-            index_for_desired_DR = self.data_dict.keys()
-            # convert them to integer
-            index_for_desired_DR = [int(idx) for idx in index_for_desired_DR]
+    def process_store(self, filenames):
+        return store_answers(self.result_store, filenames, self.config.positive_tokens, self.config.negative_tokens)
 
+    def question_layout(self):
+        # The result file names of every question type, the DR index of each question and the order of the original loop.
+        # It only depends on the question file and the dataset, so it is built once per process for all runs that share them.
+        # Runs whose question_dict was replaced by a subset (parity_report.py, benchmark.py) build their own.
+        layout_key = (self.question_fp, self.config.dataset_fp)
+        shared = loaded_questions.get(self.question_fp) is self.question_dict
+        if shared and layout_key in question_layouts:
+            return question_layouts[layout_key]
+
+        DR_names = list(self.DR2id.keys())
+        DR_index = {DR: idx for idx, DR in enumerate(DR_names)}
+
+        filenames = {qtype: [] for qtype in ['TQ', 'CQ', 'CTQ', 'CCQ']}
+        DR_of_question = {qtype: [] for qtype in ['TQ', 'CQ', 'CTQ', 'CCQ']}
+        instance_of_question = {qtype: [] for qtype in ['TQ', 'CQ', 'CTQ', 'CCQ']} # for the bootstrap, see bootstrap()
+        instance_DRs = []
+        ordered_filenames = [] # the order of the original loop, for results_consolidated.json
         for instance_key, instance_value in self.question_dict.items():
-            desired_Q = 'contributed to the same situation'
-            if int(instance_key) not in index_for_desired_DR:
+            if int(instance_key) not in self.id2DR:
                 continue
+            instance_DR = DR_index[self.id2DR[int(instance_key)]]
+            instance_DRs.append(instance_DR)
             for pair_idx, questions in instance_value.items():
-                targeted_question = questions['targeted_question'] # list of size 1
-                counterfactual_question = questions['counterfactual_question'] # list of size 5
-                converse_targeted_question = questions['converse_targeted_question'] # list of size 1
-                converse_counterfactual_question = questions['converse_counterfactual_question'] # list of size 5
-
-                current_TQ = []
-                current_CQ = []
-                current_CTQ = []
-                current_CCQ = []
-
-                for qidx, question in enumerate(targeted_question):
-                    filename = 'D-{}-e-{}-TQ-{}'.format(instance_key, pair_idx, qidx)
-                    result_fp = os.path.join(self.result_dir, f'{filename}.pk')
-                    answer = self.process_prob(result_fp)
-                    results_consolidated[filename] = answer
-                    TQ_is_YES_GT_list.append(1)
-                    TQ_is_YES_list.append(answer)
-                    current_TQ.append(answer)
-
-                for qidx, question in enumerate(counterfactual_question):
-                    filename = 'D-{}-e-{}-CQ-{}'.format(instance_key, pair_idx, qidx)
-                    result_fp = os.path.join(self.result_dir, f'{filename}.pk')
-                    answer = self.process_prob(result_fp)
-                    results_consolidated[filename] = answer
-                    CQ_is_YES_GT_list.append(0)
-                    CQ_is_YES_list.append(answer)
-                    current_CQ.append(answer)
-                
-                for qidx, question in enumerate(converse_targeted_question):
-                    filename = 'D-{}-e-{}-CTQ-{}'.format(instance_key, pair_idx, qidx)
-                    result_fp = os.path.join(self.result_dir, f'{filename}.pk')
-                    answer = self.process_prob(result_fp)
-                    results_consolidated[filename] = answer
-                    CTQ_is_YES_GT_list.append(1)
-                    CTQ_is_YES_list.append(answer)
-                    current_CTQ.append(answer)
-                
-                for qidx, question in enumerate(converse_counterfactual_question):
-                    filename = 'D-{}-e-{}-CCQ-{}'.format(instance_key, pair_idx, qidx)
-                    result_fp = os.path.join(self.result_dir, f'{filename}.pk')
-                    answer = self.process_prob(result_fp)
-                    results_consolidated[filename] = answer
-                    CCQ_is_YES_GT_list.append(0)
-                    CCQ_is_YES_list.append(answer)
-                    current_CCQ.append(answer)
-                
-                # Check the consistency of the current_TQ against the current_CTQ
-                for idx in range(len(current_TQ)):
-                    if current_TQ[idx] == current_CTQ[idx]:
-                        TQ_consistency_count += 1
-                    TQ_consistency_total += 1
-                # Check the consistency of the current_CQ against the current_CCQ
-                for idx in range(len(current_CQ)):
-                    if current_CQ[idx] == current_CCQ[idx]:
-                        CQ_consistency_count += 1
-                    CQ_consistency_total += 1
-        
-        # Let's summarize the results
-        # targeted score is the accuracy of the targeted questions
-        TQ_accuracy = accuracy_score(TQ_is_YES_GT_list, TQ_is_YES_list)
-        CTQ_accuracy = accuracy_score(CTQ_is_YES_GT_list, CTQ_is_YES_list)
-        targeted_score = accuracy_score(TQ_is_YES_GT_list + CTQ_is_YES_GT_list, TQ_is_YES_list + CTQ_is_YES_list)
-        # counterfactual score is the accuracy of the counterfactual questions
-        CQ_accuracy = accuracy_score(CQ_is_YES_GT_list, CQ_is_YES_list)
-        CCQ_accuracy = accuracy_score(CCQ_is_YES_GT_list, CCQ_is_YES_list)
-        counterfactual_score = accuracy_score(CQ_is_YES_GT_list + CCQ_is_YES_GT_list, CQ_is_YES_list + CCQ_is_YES_list)
-        # consistency is the portion of TQ_consistency_count over TQ_consistency_total and CQ_consistency_count over CQ_consistency_total
-        TQ_consistency = TQ_consistency_count / TQ_consistency_total
-        CQ_consistency = CQ_consistency_count / CQ_consistency_total
-        TQ_percent = TQ_consistency_total / (TQ_consistency_total + CQ_consistency_total)
-        CQ_percent = CQ_consistency_total / (TQ_consistency_total + CQ_consistency_total)
-        overall_consistency = TQ_consistency * TQ_percent + CQ_consistency * CQ_percent
-
-        disq_score = targeted_score * counterfactual_score * overall_consistency
+                for qtype, field in [('TQ', 'targeted_question'), ('CQ', 'counterfactual_question'), ('CTQ', 'converse_targeted_question'), ('CCQ', 'converse_counterfactual_question')]:
+                    for qidx, question in enumerate(questions[field]):
+                        filenames[qtype].append('D-{}-e-{}-{}-{}'.format(instance_key, pair_idx, qtype, qidx))
+                        ordered_filenames.append(filenames[qtype][-1])
+                        DR_of_question[qtype].append(instance_DR)
+                        instance_of_question[qtype].append(len(instance_DRs) - 1)
+                # The consistency checks compare TQ with CTQ and CQ with CCQ question by question
+                assert len(questions['targeted_question']) == len(questions['converse_targeted_question'])
+                assert len(questions['counterfactual_question']) == len(questions['converse_counterfactual_question'])
+
+        layout = (DR_names, filenames, DR_of_question, instance_of_question, instance_DRs, ordered_filenames)
+        if shared:
+            question_layouts[layout_key] = layout
+        return layout
+
+    def collect_answers(self):
+        # Read every answer exactly once and keep them in NumPy arrays, one entry per question, tagged with
+        # the question type (TQ, CQ, CTQ, CCQ) and the level-2 DR of its discourse instance.
+        # All scores, overall and per DR, are then group-bys over these arrays.
+        if hasattr(self, 'answers'):
+            return
+
+        self.DR_names, filenames, DR_of_question, instance_of_question, instance_DRs, ordered_filenames = self.question_layout()
+        self.answers = {}
+        self.answer_DR = {}
+        self.answer_instance = {qtype: np.array(instance_of_question[qtype], dtype=np.int64) for qtype in instance_of_question}
+        self.instance_DR = np.array(instance_DRs, dtype=np.int64)
+        answer_by_filename = {}
+        read_start = time.perf_counter()
+        for qtype in ['TQ', 'CQ', 'CTQ', 'CCQ']:
+            if self.result_store is not None:
+                start = time.perf_counter()
+                answers = self.process_store(filenames[qtype])
+                self.metrics.add_DR_time([self.DR_names[DR] for DR in DR_of_question[qtype]], time.perf_counter() - start)
+            else:
+                answers = np.zeros(len(filenames[qtype]), dtype=np.int64)
+                for idx, filename in enumerate(filenames[qtype]):
+                    start = time.perf_counter()
+                    answers[idx] = self.process_prob(filename)
+                    self.metrics.add_DR_time([self.DR_names[DR_of_question[qtype][idx]]], time.perf_counter() - start)
+            self.metrics.done += len(answers)
+            self.answers[qtype] = answers
+            self.answer_DR[qtype] = np.array(DR_of_question[qtype], dtype=np.int64)
+            answer_by_filename.update(zip(filenames[qtype], answers.tolist()))
+        self.results_consolidated = {filename: answer_by_filename[filename] for filename in ordered_filenames}
+        self.metrics.add_time('read', time.perf_counter() - read_start)
+
+    def compute_scores(self, groups, num_groups):
+        with self.metrics.stage('score'):
+            return self.compute_group_scores(groups, num_groups)
+
+    def compute_group_scores(self, groups, num_groups):
+        # groups[qtype] gives the group id of every question of that type, e.g. its DR index
+        return group_scores(self.answers, groups, num_groups)
+
+    def record_scores(self, scores, group, desired_DR):
+        # Print and keep the scores of one group, the same way for the whole set and for a single DR
+        if scores['num_TQ'][group] == 0:
+            print('No questions found for {}, skipped.'.format(desired_DR))
+            return
 
         # Let's round the numbers to 3 decimal points
-        TQ_accuracy = round(TQ_accuracy, 3)
-        CQ_accuracy = round(CQ_accuracy, 3)
-        TQ_consistency = round(TQ_consistency, 3)
-        CQ_consistency = round(CQ_consistency, 3)
-        targeted_score = round(targeted_score, 3)
-        counterfactual_score = round(counterfactual_score, 3)
-        overall_consistency = round(overall_consistency, 3)
-        disq_score = round(disq_score, 3)
-
-        # print the number of TQ, CQ, CTQ and CCQ
-        print('TQ:', len(TQ_is_YES_GT_list))
-        # print('CQ:', len(CQ_is_YES_GT_list))
-        # print('CTQ:', len(CTQ_is_YES_GT_list))
-        # print('CCQ:', len(CCQ_is_YES_GT_list))
+        rounded = {key: round(float(value[group]), 3) for key, value in scores.items() if key != 'num_TQ'}
+
+        # print the number of TQ
+        print('TQ:', int(scores['num_TQ'][group]))
 
         # Let's print
-        print('TQ_accuracy:', TQ_accuracy)
-        print('CTQ_accuracy:', CTQ_accuracy)
-        print('targeted_score:', targeted_score)
-        print('conterfactual_score:', counterfactual_score)
-        print('overall_consistency:', overall_consistency)
-        print('disq_score:', disq_score)
+        print('TQ_accuracy:', rounded['TQ_accuracy'])
+        print('CTQ_accuracy:', float(scores['CTQ_accuracy'][group]))
+        print('targeted_score:', rounded['targeted_score'])
+        print('conterfactual_score:', rounded['counterfactual_score'])
+        print('overall_consistency:', rounded['overall_consistency'])
+        print('disq_score:', rounded['disq_score'])
+
+        if desired_DR is None:
+            self.current_disq_score_dict['Overall'] = rounded['disq_score']
+            self.current_disq_score_dict['Targeted'] = rounded['targeted_score']
+            self.current_disq_score_dict['Counterfactual'] = rounded['counterfactual_score']
+            self.current_disq_score_dict['Consistency'] = rounded['overall_consistency']
+        else:
+            self.current_disq_score_dict[desired_DR] = rounded['disq_score']
+
+    def eval_all_level2_relations(self):
+        # One group-by over all DRs instead of one pass over the results per DR
+        self.collect_answers()
+        scores = self.compute_scores(self.answer_DR, len(self.DR_names))
+        for level2_relation in self.level2_relation:
+            print('Evaluating level2_relation:', level2_relation)
+            if level2_relation not in self.DR_names:
+                print('No questions found for {}, skipped.'.format(level2_relation))
+                continue
+            self.record_scores(scores, self.DR_names.index(level2_relation), level2_relation)
+
+    def bootstrap(self, num_resamples=10000, confidence=0.95, seed=0):
+        # Confidence intervals of Overall, Targeted, Counterfactual, Consistency and the DiSQ Score of every DR scored so far,
+        # from num_resamples resamples of the discourse instances (see scoring.bootstrap_scores)
+        self.collect_answers()
+        with self.metrics.stage('bootstrap'):
+            overall, per_DR = bootstrap_scores(self.answers, self.answer_instance, self.instance_DR, len(self.DR_names), num_resamples, confidence, seed)
+
+        intervals = {}
+        for name, score in [('Overall', 'disq_score'), ('Targeted', 'targeted_score'), ('Counterfactual', 'counterfactual_score'), ('Consistency', 'overall_consistency')]:
+            if name in self.current_disq_score_dict:
+                intervals[name] = [round(overall[score][0], 3), round(overall[score][1], 3)]
+        for level2_relation in self.level2_relation:
+            if level2_relation in self.current_disq_score_dict:
+                DR = self.DR_names.index(level2_relation)
+                intervals[level2_relation] = [round(float(per_DR['disq_score'][0][DR]), 3), round(float(per_DR['disq_score'][1][DR]), 3)]
+        self.current_disq_score_ci = {'confidence': confidence, 'resamples': num_resamples, 'intervals': intervals}
+
+        print('{:.0%} bootstrap confidence intervals from {} resamples of {} discourse instances:'.format(confidence, num_resamples, len(self.instance_DR)))
+        for name, (low, high) in intervals.items():
+            print('{}: {} [{}, {}]'.format(name, self.current_disq_score_dict[name], low, high))
+
+    def loop_through(self, desired_DR):
+        self.collect_answers()
 
         if desired_DR is None:
-            self.current_disq_score_dict['Overall'] = disq_score
-            self.current_disq_score_dict['Targeted'] = targeted_score
-            self.current_disq_score_dict['Counterfactual'] = counterfactual_score
-            self.current_disq_score_dict['Consistency'] = overall_consistency
+            # the whole set is a single group
+            groups = {qtype: np.zeros_like(DR_of_question) for qtype, DR_of_question in self.answer_DR.items()}
+            scores = self.compute_scores(groups, 1)
+            self.record_scores(scores, 0, desired_DR)
         else:
-            self.current_disq_score_dict[desired_DR] = disq_score
+            scores = self.compute_scores(self.answer_DR, len(self.DR_names))
+            self.record_scores(scores, self.DR_names.index(desired_DR), desired_DR)
         
         # Let's save results_consolidated if the desired_DR is None
         if desired_DR is None:
             fp = os.path.join(self.result_dir, 'results_consolidated.json')
-            with open(fp, 'w') as f:
-                json.dump(results_consolidated, f, indent=4)
+            with self.metrics.stage('write'), open(fp, 'w') as f:
+                json.dump(self.results_consolidated, f, indent=4)
             print('Results saved to:', fp)
     
-    def save_results(self):
-        # Save the results
-        self.disq_score_dict['{}_{}'.format(self.taskname, self.modelname)] = self.current_disq_score_dict
-        with open(self.disq_score_fp, 'w') as f:
-            json.dump(self.disq_score_dict, f, indent=4)
-        print('Results saved to:', self.disq_score_fp)
-
-        # Dump self.disq_score_dict to a csv file
-        df = pd.DataFrame(self.disq_score_dict)
-        df = df.T
-        # Give the first column a name as "taskcode"
-        df.index.name = 'taskcode'
-        df.to_csv(self.config.disq_score_csv_fp)
-        print('Results saved to:', self.config.disq_score_csv_fp)
-
-        # Let's also save the best results
-        # It only works for the scenario where self.feature is None and self.paraphrase is None, we first check, otherwise, we skip
-        if self.config.feature is not None or self.config.paraphrase is not None:
-            return
-        # we load the csv file
-        df = pd.read_csv(self.config.disq_score_csv_fp)
-        # we get all unique modelname
-        modelnames = df['modelname'].unique()
-        # create a new df, which takes the same columns as the original one
-        df_best = pd.DataFrame(columns=df.columns)
-
-        # for each modelname, we get the rows were paraprase is None and feature is None
-        for modelname in modelnames:
-            df_model = df[df['modelname'] == modelname]
-            df_model = df_model[df_model['feature'].isnull()]
-            df_model = df_model[df_model['paraphrase'].isnull()]
-            # we get the best score
-            best_score = df_model['Overall'].max()
-            # we get the row where the Overall is equal to the best_score
-            best_row = df_model[df_model['Overall'] == best_score]
-            # we append the best_row to df_best
-            df_best = df_best._append(best_row)
-        # we save the df_best to the csv file, ignore the index
-        df_best.to_csv(self.config.disq_score_best_csv_fp, index=False)
+    def save_results(self, export=True):
+        with self.metrics.stage('write'):
+            self.save_score_files(export)
+
+    def save_score_files(self, export=True):
+        # Upsert this run into the leaderboard (leaderboard.py), then export disq_score_{dataset}.json/.csv and the best csv from it
+        leaderboard = Leaderboard(self.config.leaderboard_fp)
+        if not leaderboard.has_dataset(self.config.dataset) and os.path.exists(self.disq_score_fp):
+            # The first run with a leaderboard keeps the scores of the existing json file
+            leaderboard.import_json(self.config.dataset, self.disq_score_fp)
+        leaderboard.upsert(self.config.dataset, '{}_{}'.format(self.taskname, self.modelname), self.current_disq_score_dict, self.current_disq_score_ci)
+        print('Results saved to:', self.config.leaderboard_fp)
+        if export:
+            leaderboard.export(self.config.dataset, self.disq_score_fp, self.config.disq_score_csv_fp, self.config.disq_score_best_csv_fp, self.config.disq_score_ci_csv_fp)
+        leaderboard.close()
     
     def verbose(self):
+        import pandas as pd
+
         # read the best csv file
         df = pd.read_csv(self.config.disq_score_best_csv_fp)
 
@@ -313,7 +301,7 @@ class Eval:
         verbalization += '=== End of the results for model: {} ===\n'.format(self.modelname)
 
         # write the verbalization to a file, the file name is the modelname, and the dir is self.config.verbalization_dir
-        fp = os.path.join(self.config.verbalization_dir, '{}.txt'.format(self.modelname))
+        fp = os.path.join(self.config.make_dir(self.config.verbalization_dir), '{}.txt'.format(self.modelname))
 
         # if fp does not exist, then create it
         if not os.path.exists(fp):
@@ -333,7 +321,7 @@ class Eval:
     
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Evaluation.')
-    parser.add_argument('--dataset', type=str, default='pdtb', help='Dataset: pdtb or ted')
+    parser.add_argument('--dataset', type=str, default='pdtb', help='Dataset: pdtb, ted, or the path of a dataset file, e.g. a synthetic one from dataset_scaler.py')
     parser.add_argument('--modelname', type=str, default='13bchat', help='Model name: 13bchat, 13b, 7bchat, 7b, vicuna-13b')
     parser.add_argument('--modelurl', type=str, default=None, help='modelurl specific the models path in the hugging face model hub (for example, "meta-llama/Meta-Llama-3.1-8B"). modelurl has the right to overwrite modelname. If modelurl is provided, modelname will be ignored. It is used for new models that has not been specified in the config file.')
     parser.add_argument('--version', type=str, default='v1', help='Version of the dataset')
@@ -341,15 +329,21 @@ if __name__ == '__main__':
     parser.add_argument('--feature', type=str, default=None, help='Feature: None, or any feature')
     parser.add_argument('--hfpath', type=str, default='/mnt/data/yisong/hf-path', help='Huggingface path')
     parser.add_argument('--device_number', type=int, default=0, help='Device number')
+    parser.add_argument('--precision', type=str, default=None, help='The --precision of the QA run to evaluate: bf16 or int8. Default is the full-precision run.')
     parser.add_argument('--verbalize', type=int, default=0, help='Whether to verbalize the results')
+    parser.add_argument('--bootstrap', type=int, default=0, help='Number of bootstrap resamples for confidence intervals of the scores, e.g. 10000. Default is 0, no intervals.')
+    parser.add_argument('--confidence', type=float, default=0.95, help='Only with --bootstrap: the confidence level of the intervals. Default is 0.95.')
     args = parser.parse_args()
     
-    config = DiSQ_Config(args.dataset, args.modelname, args.modelurl, args.version, args.paraphrase, args.feature, args.hfpath, args.device_number)
+    config = DiSQ_Config(args.dataset, args.modelname, args.modelurl, args.version, args.paraphrase, args.feature, args.hfpath, args.device_number, precision=args.precision)
     NewEval = Eval(config, args.verbalize)
     NewEval.loop_through(desired_DR=None)
     NewEval.eval_all_level2_relations()
+    if args.bootstrap > 0:
+        NewEval.bootstrap(args.bootstrap, args.confidence)
     NewEval.save_results()
 
     if args.verbalize == 1:
         NewEval.verbose()
+    NewEval.metrics.write(config.metrics_fp('eval'))
     
\ No newline at end of file
@@ -0,0 +1,163 @@
+import argparse
+import os
+import io
+import sys
+import time
+import itertools
+import contextlib
+import multiprocessing
+
+from disq_config import DiSQ_Config
+from eval import Eval, load_questions
+from leaderboard import Leaderboard
+
+
+# The sweep whose runs the pool workers score, they are forked after it is set
+current_sweep = None
+
+
+class EvalSweep:
+    # Scores a grid of runs (datasets x models x versions x paraphrases x features) in one process tree, instead of one
+    # eval.py process per run as in eval.sh. The datasets, question files and question layouts are loaded once here and
+    # the pool workers are forked from this process, so they share them copy-on-write. The scores of all runs are written
+    # to the leaderboard in one transaction at the end, then disq_score_{dataset}.json/.csv are exported once per dataset.
+    def __init__(self, datasets, modelnames, versions, paraphrases, features, hfpath, precision=None, num_workers=None, num_resamples=0, confidence=0.95):
+        self.configs = []
+        for dataset, modelname, version, paraphrase, feature in itertools.product(datasets, modelnames, versions, paraphrases, features):
+            # a model given as a Hugging Face path is passed as the modelurl, as --modelurl of eval.py
+            modelurl = modelname if '/' in modelname else None
+            self.configs.append(DiSQ_Config(dataset, modelname, modelurl, version, paraphrase, feature, hfpath, 0, precision=precision))
+        self.num_workers = num_workers if num_workers else os.cpu_count()
+        # bootstrap confidence intervals of every run (Eval.bootstrap), none with 0 resamples
+        self.num_resamples = num_resamples
+        self.confidence = confidence
+        self.runs = []
+        self.skipped = []
+
+    def question_fp(self, config):
+        return os.path.join(config.question_dir, '{}.json'.format(config.taskname))
+
+    def load(self):
+        # Keep the runs that have questions and results, and load what they share before the workers are forked
+        data_dicts = {}
+        for config in self.configs:
+            if not os.path.exists(self.question_fp(config)):
+                self.skipped.append((config, 'no question file {}'.format(self.question_fp(config))))
+                continue
+            if not os.path.isdir(config.result_dir):
+                self.skipped.append((config, 'no results in {}'.format(config.result_dir)))
+                continue
+            if config.dataset_fp not in data_dicts:
+                data_dicts[config.dataset_fp] = config.data_dict
+            config.loaded_data_dict = data_dicts[config.dataset_fp]
+            self.runs.append(config)
+
+        # One question layout per question file and dataset (Eval.question_layout)
+        layout_keys = set()
+        for config in self.runs:
+            if (self.question_fp(config), config.dataset_fp) in layout_keys:
+                continue
+            load_questions(self.question_fp(config))
+            with contextlib.redirect_stdout(io.StringIO()):
+                Eval(config, verbalize=0).question_layout()
+            layout_keys.add((self.question_fp(config), config.dataset_fp))
+        print('{} runs to score, {} skipped, {} question files loaded.'.format(len(self.runs), len(self.skipped), len(layout_keys)))
+        for config, reason in self.skipped:
+            print('Skipped {} {}: {}'.format(config.modelname, config.taskname, reason))
+
+    def run(self):
+        global current_sweep
+        start = time.perf_counter()
+        self.load()
+
+        rows = []
+        failed = []
+        current_sweep = self
+        if self.num_workers > 1 and len(self.runs) > 1:
+            context = multiprocessing.get_context('fork')
+            with context.Pool(min(self.num_workers, len(self.runs))) as pool:
+                outcomes = list(self.report(pool.imap_unordered(score_run, range(len(self.runs)))))
+        else:
+            outcomes = list(self.report(map(score_run, range(len(self.runs)))))
+        # Rows in the order of the grid, as eval.sh would add them, whichever worker finished first
+        for run_idx, row, error in sorted(outcomes, key=lambda outcome: outcome[0]):
+            if row is not None:
+                rows.append(row)
+            else:
+                failed.append((self.runs[run_idx], error))
+
+        self.save(rows)
+        print('Scored {} runs in {:.1f} s with {} workers, {} skipped, {} failed.'.format(len(rows), time.perf_counter() - start, self.num_workers, len(self.skipped), len(failed)))
+        for config, error in failed:
+            print('Failed {} {}: {}'.format(config.modelname, config.taskname, error))
+        return failed
+
+    def report(self, outcomes):
+        # One line per finished run, in the order they finish
+        for done, (run_idx, row, error) in enumerate(outcomes, start=1):
+            config = self.runs[run_idx]
+            if row is not None:
+                print('[{}/{}] {} {}: Overall {}'.format(done, len(self.runs), row[2]['modelname'], config.taskname, row[2].get('Overall')))
+            else:
+                print('[{}/{}] {} {}: failed, {}'.format(done, len(self.runs), config.modelname, config.taskname, error))
+            yield run_idx, row, error
+
+    def save(self, rows):
+        if len(rows) == 0:
+            return
+        # Every run of the sweep uses the same leaderboard, and each dataset has its own exported files
+        dataset_configs = {}
+        for config in self.runs:
+            dataset_configs.setdefault(config.dataset, config)
+        leaderboard = Leaderboard(self.runs[0].leaderboard_fp)
+        for dataset, config in dataset_configs.items():
+            if not leaderboard.has_dataset(dataset) and os.path.exists(config.disq_score_fp):
+                leaderboard.import_json(dataset, config.disq_score_fp)
+        leaderboard.upsert_many(rows)
+        print('{} runs saved to: {}'.format(len(rows), leaderboard.db_fp))
+        for dataset in sorted(set(row[0] for row in rows)):
+            config = dataset_configs[dataset]
+            leaderboard.export(dataset, config.disq_score_fp, config.disq_score_csv_fp, config.disq_score_best_csv_fp, config.disq_score_ci_csv_fp)
+        leaderboard.close()
+
+
+def score_run(run_idx):
+    # Runs in a pool worker (or in the sweep process with one worker): score one run as eval.py does, without saving,
+    # and return its leaderboard row. The per-question output of Eval is dropped, the sweep prints one line per run.
+    config = current_sweep.runs[run_idx]
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            evaluation = Eval(config, verbalize=0)
+            evaluation.loop_through(desired_DR=None)
+            evaluation.eval_all_level2_relations()
+            if current_sweep.num_resamples > 0:
+                evaluation.bootstrap(current_sweep.num_resamples, current_sweep.confidence)
+            evaluation.metrics.write(config.metrics_fp('eval'))
+    except Exception as e:
+        return run_idx, None, '{}: {}'.format(type(e).__name__, e)
+    taskcode = '{}_{}'.format(evaluation.taskname, evaluation.modelname)
+    return run_idx, (config.dataset, taskcode, evaluation.current_disq_score_dict, evaluation.current_disq_score_ci), None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluate a grid of runs in one process pool, e.g. every model and version of eval.sh.')
+    parser.add_argument('--datasets', type=str, nargs='+', default=['pdtb', 'ted'], help='pdtb, ted, or paths of dataset files. Default is pdtb ted.')
+    parser.add_argument('--modelnames', type=str, nargs='+', default=['7b', '7bchat', '13b', '13bchat', 'vicuna-13b'], help='Model names, or Hugging Face paths as --modelurl of eval.py. Default is the models of eval.sh.')
+    parser.add_argument('--versions', type=str, nargs='+', default=['v1', 'v2', 'v3', 'v4'], help='Default is v1 v2 v3 v4.')
+    parser.add_argument('--paraphrases', type=str, nargs='+', default=['None'], help='None, p1 or p2. Default is None.')
+    parser.add_argument('--features', type=str, nargs='+', default=['None'], help='None, conn, context or history. Default is None.')
+    parser.add_argument('--hfpath', type=str, default='/mnt/data/yisong/hf-path', help='Huggingface path')
+    parser.add_argument('--precision', type=str, default=None, help='The --precision of the QA runs to evaluate: bf16 or int8. Default is the full-precision runs.')
+    parser.add_argument('--workers', type=int, default=0, help='Number of worker processes. Default is 0, one per CPU core.')
+    parser.add_argument('--bootstrap', type=int, default=0, help='Number of bootstrap resamples for confidence intervals of every run, e.g. 10000. Default is 0, no intervals.')
+    parser.add_argument('--confidence', type=float, default=0.95, help='Only with --bootstrap: the confidence level of the intervals. Default is 0.95.')
+    args = parser.parse_args()
+
+    def optional(values):
+        return [None if value == 'None' else value for value in values]
+
+    sweep = EvalSweep(args.datasets, args.modelnames, args.versions, optional(args.paraphrases), optional(args.features), args.hfpath, precision=args.precision,
+        num_workers=args.workers, num_resamples=args.bootstrap, confidence=args.confidence)
+    failed = sweep.run()
+    if len(failed) > 0:
+        sys.exit(1)
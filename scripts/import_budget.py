@@ -0,0 +1,75 @@
+import argparse
+import os
+import sys
+import json
+import subprocess
+
+import numpy as np
+
+
+# Imports that belong to the inference path (QG/QA) only, the scoring entry points must not load them
+HEAVY_MODULES = ['torch', 'transformers', 'pandas', 'sklearn']
+
+# Runs in a fresh interpreter: import one module and report the import time, the peak RSS and the loaded modules
+PROBE = '''
+import sys, time, json, resource
+sys.path.insert(0, {scripts_dir!r})
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+# ru_maxrss is in kilobytes on Linux
+print(json.dumps({{'seconds': seconds, 'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 'modules': sorted(sys.modules)}}))
+'''
+
+
+def measure_import(module, scripts_dir, repeats=3):
+    # The median import time and peak RSS over cold imports, each in a new interpreter
+    measurements = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', PROBE.format(scripts_dir=scripts_dir, module=module)],
+            capture_output=True, text=True, check=True).stdout
+        measurements.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        'seconds': float(np.median([measurement['seconds'] for measurement in measurements])),
+        'rss_mb': float(np.median([measurement['rss_mb'] for measurement in measurements])),
+        'heavy_modules': sorted(set(name.split('.')[0] for name in measurements[0]['modules']) & set(HEAVY_MODULES)),
+    }
+
+
+def check_budget(modules, scripts_dir, max_seconds, max_rss_mb, repeats=3):
+    # Returns the measurements and one message per module that goes over the budget or loads a heavy module
+    measurements = {}
+    violations = []
+    for module in modules:
+        measurement = measure_import(module, scripts_dir, repeats)
+        measurements[module] = measurement
+        print('{}: {:.3f} s, {:.0f} MB peak RSS{}'.format(module, measurement['seconds'], measurement['rss_mb'],
+            ', imports ' + ', '.join(measurement['heavy_modules']) if measurement['heavy_modules'] else ''))
+        if measurement['seconds'] > max_seconds:
+            violations.append('{} takes {:.3f} s to import, the budget is {} s'.format(module, measurement['seconds'], max_seconds))
+        if measurement['rss_mb'] > max_rss_mb:
+            violations.append('{} reaches {:.0f} MB RSS on import, the budget is {} MB'.format(module, measurement['rss_mb'], max_rss_mb))
+        if measurement['heavy_modules']:
+            violations.append('{} imports {}'.format(module, ', '.join(measurement['heavy_modules'])))
+    return measurements, violations
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that the scoring entry points import without torch, transformers or pandas, within a time and memory budget.')
+    parser.add_argument('--modules', type=str, nargs='+', default=['scoring', 'eval', 'eval_sweep', 'leaderboard'], help='The modules in scripts/ to import. Default is scoring eval eval_sweep leaderboard.')
+    parser.add_argument('--max_seconds', type=float, default=0.5, help='The import time budget per module, median of --repeats cold imports. Default is 0.5.')
+    parser.add_argument('--max_rss_mb', type=float, default=100, help='The peak RSS budget per module in MB. Default is 100.')
+    parser.add_argument('--repeats', type=int, default=3, help='Cold imports per module. Default is 3.')
+    parser.add_argument('--output', type=str, default=None, help='Also save the measurements as JSON to this file.')
+    args = parser.parse_args()
+
+    measurements, violations = check_budget(args.modules, os.path.dirname(os.path.abspath(__file__)), args.max_seconds, args.max_rss_mb, args.repeats)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'budget': {'max_seconds': args.max_seconds, 'max_rss_mb': args.max_rss_mb}, 'modules': measurements, 'violations': violations}, f, indent=4)
+        print('Measurements saved to:', args.output)
+    for violation in violations:
+        print('Over budget:', violation)
+    if len(violations) > 0:
+        sys.exit(1)
+    print('All {} modules are within the budget.'.format(len(args.modules)))
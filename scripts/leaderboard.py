@@ -0,0 +1,216 @@
+import argparse
+import os
+import csv
+import json
+import time
+import sqlite3
+
+
+# The columns of a run in the order of disq_score_{dataset}.json, the DR scores follow
+RUN_FIELDS = ['modelname', 'version', 'paraphrase', 'feature', 'Overall', 'Targeted', 'Counterfactual', 'Consistency']
+
+
+class Leaderboard:
+    # All DiSQ scores in one SQLite file, the source of truth for disq_score_{dataset}.json/.csv and the best csv,
+    # which are exported from it. A run is upserted by (dataset, taskcode, modelname), so evals that finish at the
+    # same time no longer overwrite each other's entries.
+    #   runs       one row per run: the overall, targeted, counterfactual and consistency scores
+    #   DR_scores  one row per run and level-2 DR
+    #   score_CIs  one row per run and score with its bootstrap confidence interval, for runs evaluated with --bootstrap
+    def __init__(self, db_fp):
+        self.db_fp = db_fp
+        self.connection = None
+        self.connection_pid = None
+
+    def connect(self):
+        # One connection per process, as in AnswerCache
+        if self.connection is None or self.connection_pid != os.getpid():
+            db_dir = os.path.dirname(self.db_fp)
+            if db_dir and not os.path.exists(db_dir):
+                os.makedirs(db_dir)
+            self.connection = sqlite3.connect(self.db_fp, timeout=60, isolation_level=None) # transactions are explicit, see upsert_many
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS runs (dataset TEXT, taskcode TEXT, modelname TEXT, version TEXT, paraphrase TEXT, feature TEXT, '
+                'overall REAL, targeted REAL, counterfactual REAL, consistency REAL, updated REAL, PRIMARY KEY (dataset, taskcode, modelname))')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS DR_scores (dataset TEXT, taskcode TEXT, modelname TEXT, DR TEXT, position INTEGER, score REAL, '
+                'PRIMARY KEY (dataset, taskcode, modelname, DR))')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS score_CIs (dataset TEXT, taskcode TEXT, modelname TEXT, name TEXT, position INTEGER, '
+                'low REAL, high REAL, confidence REAL, resamples INTEGER, PRIMARY KEY (dataset, taskcode, modelname, name))')
+            # best per model: the original-question runs (no paraphrase, no feature) of a dataset by model and score
+            self.connection.execute('CREATE INDEX IF NOT EXISTS runs_best ON runs (dataset, paraphrase, feature, modelname, overall)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS DR_scores_by_DR ON DR_scores (dataset, DR, score)')
+            self.connection_pid = os.getpid()
+        return self.connection
+
+    def upsert(self, dataset, taskcode, scores, CI=None):
+        self.upsert_many([(dataset, taskcode, scores, CI)])
+
+    def upsert_many(self, rows):
+        # rows are (dataset, taskcode, scores) or (dataset, taskcode, scores, CI), scores as Eval.current_disq_score_dict and
+        # CI as Eval.current_disq_score_ci. All rows go in one transaction, BEGIN IMMEDIATE takes the write lock up front,
+        # so concurrent writers wait (up to the 60 s timeout) instead of failing.
+        connection = self.connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            for row in rows:
+                dataset, taskcode, scores = row[:3]
+                CI = row[3] if len(row) > 3 else None
+                modelname = scores['modelname']
+                # ON CONFLICT keeps the rowid, so a re-evaluated run keeps its place in the exports
+                connection.execute('INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (dataset, taskcode, modelname) DO UPDATE SET '
+                    'version = excluded.version, paraphrase = excluded.paraphrase, feature = excluded.feature, overall = excluded.overall, '
+                    'targeted = excluded.targeted, counterfactual = excluded.counterfactual, consistency = excluded.consistency, updated = excluded.updated',
+                    (dataset, taskcode, modelname, scores['version'], scores['paraphrase'], scores['feature'], scores.get('Overall'),
+                    scores.get('Targeted'), scores.get('Counterfactual'), scores.get('Consistency'), time.time()))
+                connection.execute('DELETE FROM DR_scores WHERE dataset = ? AND taskcode = ? AND modelname = ?', (dataset, taskcode, modelname))
+                DR_rows = [(dataset, taskcode, modelname, DR, position, score) for position, (DR, score) in enumerate(
+                    (key, value) for key, value in scores.items() if key not in RUN_FIELDS)]
+                connection.executemany('INSERT INTO DR_scores VALUES (?, ?, ?, ?, ?, ?)', DR_rows)
+                # the intervals of an earlier evaluation do not belong to the new scores
+                connection.execute('DELETE FROM score_CIs WHERE dataset = ? AND taskcode = ? AND modelname = ?', (dataset, taskcode, modelname))
+                if CI is not None:
+                    CI_rows = [(dataset, taskcode, modelname, name, position, low, high, CI['confidence'], CI['resamples'])
+                        for position, (name, (low, high)) in enumerate(CI['intervals'].items())]
+                    connection.executemany('INSERT INTO score_CIs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', CI_rows)
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def has_dataset(self, dataset):
+        return self.connect().execute('SELECT 1 FROM runs WHERE dataset = ? LIMIT 1', (dataset,)).fetchone() is not None
+
+    def import_json(self, dataset, json_fp):
+        # Load the runs of an existing disq_score_{dataset}.json, e.g. written before there was a leaderboard
+        with open(json_fp, 'r') as f:
+            disq_score_dict = json.load(f)
+        self.upsert_many([(dataset, taskcode, scores) for taskcode, scores in disq_score_dict.items()])
+        print('Imported {} runs from {}'.format(len(disq_score_dict), json_fp))
+
+    def rows_to_scores(self, dataset, runs):
+        # runs are (taskcode, modelname, version, paraphrase, feature, overall, targeted, counterfactual, consistency) rows
+        # -> {taskcode: scores}, the layout of disq_score_{dataset}.json
+        connection = self.connect()
+        disq_score_dict = {}
+        for taskcode, modelname, version, paraphrase, feature, overall, targeted, counterfactual, consistency in runs:
+            scores = dict(zip(RUN_FIELDS, [modelname, version, paraphrase, feature, overall, targeted, counterfactual, consistency]))
+            for DR, score in connection.execute('SELECT DR, score FROM DR_scores WHERE dataset = ? AND taskcode = ? AND modelname = ? ORDER BY position', (dataset, taskcode, modelname)):
+                scores[DR] = score
+            disq_score_dict[taskcode] = scores
+        return disq_score_dict
+
+    def scores(self, dataset):
+        runs = self.connect().execute('SELECT taskcode, modelname, version, paraphrase, feature, overall, targeted, counterfactual, consistency '
+            'FROM runs WHERE dataset = ? ORDER BY rowid', (dataset,)).fetchall()
+        return self.rows_to_scores(dataset, runs)
+
+    def best(self, dataset, modelname=None):
+        # Per model, the runs with the best overall score on the original questions (no paraphrase, no feature)
+        query = ('SELECT r.taskcode, r.modelname, r.version, r.paraphrase, r.feature, r.overall, r.targeted, r.counterfactual, r.consistency FROM runs r '
+            'JOIN (SELECT modelname, MAX(overall) AS best FROM runs WHERE dataset = ? AND paraphrase IS NULL AND feature IS NULL GROUP BY modelname) b '
+            'ON r.modelname = b.modelname AND r.overall = b.best '
+            'WHERE r.dataset = ? AND r.paraphrase IS NULL AND r.feature IS NULL')
+        parameters = [dataset, dataset]
+        if modelname is not None:
+            query += ' AND r.modelname = ?'
+            parameters.append(modelname)
+        runs = self.connect().execute(query + ' ORDER BY r.rowid', parameters).fetchall()
+        return self.rows_to_scores(dataset, runs)
+
+    def intervals(self, dataset):
+        # {taskcode: CI} of the runs with confidence intervals, CI as Eval.current_disq_score_ci
+        CIs = {}
+        for taskcode, name, low, high, confidence, resamples in self.connect().execute('SELECT c.taskcode, c.name, c.low, c.high, c.confidence, c.resamples '
+                'FROM score_CIs c JOIN runs r ON c.dataset = r.dataset AND c.taskcode = r.taskcode AND c.modelname = r.modelname '
+                'WHERE c.dataset = ? ORDER BY r.rowid, c.position', (dataset,)):
+            CI = CIs.setdefault(taskcode, {'confidence': confidence, 'resamples': resamples, 'intervals': {}})
+            CI['intervals'][name] = [low, high]
+        return CIs
+
+    def DR_ranking(self, dataset, DR):
+        # (taskcode, modelname, score) of every run, best first
+        return self.connect().execute('SELECT taskcode, modelname, score FROM DR_scores WHERE dataset = ? AND DR = ? ORDER BY score DESC', (dataset, DR)).fetchall()
+
+    def export(self, dataset, json_fp, csv_fp, best_csv_fp=None, ci_csv_fp=None):
+        # Write disq_score_{dataset}.json and .csv (and the best csv) in their original layout, and the confidence intervals
+        # in a csv of their own (one line per run and score) if there are any. Each file is replaced atomically.
+        import pandas as pd
+
+        # One read transaction, so the best rows are taken from the same runs even while other evals write
+        connection = self.connect()
+        connection.execute('BEGIN')
+        try:
+            disq_score_dict = self.scores(dataset)
+            best = list(self.best(dataset))
+            CIs = self.intervals(dataset)
+        finally:
+            connection.execute('COMMIT')
+
+        def write_json(fp):
+            with open(fp, 'w') as f:
+                json.dump(disq_score_dict, f, indent=4)
+        write_atomic(json_fp, write_json)
+        df = pd.DataFrame(disq_score_dict).T
+        # Give the first column a name as "taskcode"
+        df.index.name = 'taskcode'
+        write_atomic(csv_fp, df.to_csv)
+        print('Results saved to: {} and {}'.format(json_fp, csv_fp))
+        if best_csv_fp is not None:
+            # The best rows of the full table, grouped by model in the order the models first appear
+            order = {modelname: idx for idx, modelname in enumerate(df['modelname'].unique())}
+            best.sort(key=lambda taskcode: order[disq_score_dict[taskcode]['modelname']])
+            write_atomic(best_csv_fp, lambda fp: df.loc[best].reset_index().to_csv(fp, index=False))
+        if ci_csv_fp is not None and len(CIs) > 0:
+            def write_CIs(fp):
+                with open(fp, 'w', newline='') as f:
+                    writer = csv.writer(f)
+                    writer.writerow(['taskcode', 'modelname', 'score', 'value', 'low', 'high', 'confidence', 'resamples'])
+                    for taskcode, CI in CIs.items():
+                        for name, (low, high) in CI['intervals'].items():
+                            writer.writerow([taskcode, disq_score_dict[taskcode]['modelname'], name, disq_score_dict[taskcode].get(name), low, high, CI['confidence'], CI['resamples']])
+            write_atomic(ci_csv_fp, write_CIs)
+            print('Confidence intervals saved to:', ci_csv_fp)
+        elif ci_csv_fp is not None and os.path.exists(ci_csv_fp):
+            # every run was evaluated again without intervals
+            os.remove(ci_csv_fp)
+
+    def close(self):
+        if self.connection is not None and self.connection_pid == os.getpid():
+            self.connection.close()
+        self.connection = None
+
+
+def write_atomic(fp, write):
+    # write(tmp_fp) writes the file, which then replaces fp in one step
+    tmp_fp = '{}.tmp{}'.format(fp, os.getpid())
+    write(tmp_fp)
+    os.replace(tmp_fp, fp)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query and export the leaderboard.')
+    parser.add_argument('command', type=str, help='export (write disq_score_{dataset}.json/.csv and the best csv), best (print the best run per model), DR (rank the runs on one DR), or import (load an existing disq_score_{dataset}.json).')
+    parser.add_argument('--dataset', type=str, default='pdtb', help='pdtb, ted, or the name of a synthetic dataset, e.g. pdtb_x100.')
+    parser.add_argument('--DR', type=str, default=None, help='Only for DR: the level-2 relation, e.g. Comparison.Concession.')
+    parser.add_argument('--db', type=str, default='data/results/leaderboard.sqlite', help='The leaderboard file. Default is data/results/leaderboard.sqlite.')
+    args = parser.parse_args()
+
+    leaderboard = Leaderboard(args.db)
+    json_fp = 'data/results/disq_score_{}.json'.format(args.dataset)
+    if args.command == 'export':
+        leaderboard.export(args.dataset, json_fp, 'data/results/disq_score_{}.csv'.format(args.dataset), 'data/results/disq_score_{}_best.csv'.format(args.dataset),
+            'data/results/disq_score_{}_ci.csv'.format(args.dataset))
+    elif args.command == 'best':
+        CIs = leaderboard.intervals(args.dataset)
+        for taskcode, scores in leaderboard.best(args.dataset).items():
+            intervals = CIs[taskcode]['intervals'] if taskcode in CIs else {}
+            print('{}: {}'.format(taskcode, ', '.join('{} {}{}'.format(name, scores[name], ' [{}, {}]'.format(*intervals[name]) if name in intervals else '')
+                for name in ['Overall', 'Targeted', 'Counterfactual', 'Consistency'])))
+    elif args.command == 'DR':
+        for taskcode, modelname, score in leaderboard.DR_ranking(args.dataset, args.DR):
+            print('{}\t{}\t{}'.format(score, modelname, taskcode))
+    elif args.command == 'import':
+        leaderboard.import_json(args.dataset, json_fp)
+    else:
+        raise ValueError('Unknown command {}, options: export, best, DR, import'.format(args.command))
+    leaderboard.close()
@@ -0,0 +1,297 @@
+import argparse
+import os
+import sys
+import json
+import time
+import pickle
+
+import numpy as np
+
+from disq_config import DiSQ_Config
+from eval import Eval
+from scoring import token_answer, scores_from_counts
+
+
+class StoreTail:
+    # Follows a result store that QA is still appending to. The index line of a question is written after its data,
+    # so every complete index line points at data that is already on disk.
+    def __init__(self, store_dir):
+        self.tokens_fp = os.path.join(store_dir, 'tokens.i32')
+        self.probs_fp = os.path.join(store_dir, 'probs.f16')
+        self.vocab_fp = os.path.join(store_dir, 'vocab.jsonl')
+        self.index_fp = os.path.join(store_dir, 'index.jsonl')
+        self.reset()
+
+    def reset(self):
+        # Read the index and the vocabulary from the start again
+        self.index_bytes = 0
+        self.index_last_line = b''
+        self.vocab_bytes = 0
+        self.vocab_last_line = b''
+        self.vocab = []
+
+    def read_lines(self, fp, start, last_line):
+        # The complete lines after byte start, the byte after the last of them, and that last line
+        if not os.path.exists(fp):
+            return [], start, last_line
+        with open(fp, 'rb') as f:
+            f.seek(start)
+            content = f.read()
+        end = content.rfind(b'\n') + 1
+        lines = content[:end].splitlines(keepends=True)
+        return lines, start + end, lines[-1] if len(lines) > 0 else last_line
+
+    def appended_only(self, fp, read_bytes, last_line):
+        # True if fp still ends its first read_bytes bytes with the line read last, i.e. it was only appended to since
+        if read_bytes == 0:
+            return True
+        if not os.path.exists(fp) or os.path.getsize(fp) < read_bytes:
+            return False
+        with open(fp, 'rb') as f:
+            f.seek(read_bytes - len(last_line))
+            return f.read(len(last_line)) == last_line
+
+    def poll(self):
+        # The (key, tokens, probabilities) of the questions indexed since the last poll
+        if not self.appended_only(self.index_fp, self.index_bytes, self.index_last_line) or not self.appended_only(self.vocab_fp, self.vocab_bytes, self.vocab_last_line):
+            # The store was rewritten, e.g. QA reopened it after a crash and dropped the records past the end of the data,
+            # or it was made anew. Token ids are only valid with the vocabulary they were written with, so both are read
+            # again from the start, known keys are skipped by the caller.
+            self.reset()
+        lines, self.index_bytes, self.index_last_line = self.read_lines(self.index_fp, self.index_bytes, self.index_last_line)
+        if len(lines) == 0:
+            return []
+        records = [json.loads(line) for line in lines]
+        # The vocabulary line of a new token is written before the index line that uses it
+        vocab_lines, self.vocab_bytes, self.vocab_last_line = self.read_lines(self.vocab_fp, self.vocab_bytes, self.vocab_last_line)
+        self.vocab += [json.loads(line) for line in vocab_lines]
+
+        # one read of the span of the new records in each data file
+        first = min(record['offset'] for record in records)
+        last = max(record['offset'] + record['length'] for record in records)
+        tokens = np.fromfile(self.tokens_fp, dtype=np.int32, count=last - first, offset=first * 4)
+        probs = np.fromfile(self.probs_fp, dtype=np.float16, count=last - first, offset=first * 2).astype(np.float64) # as Eval.process_store
+        outputs = []
+        for record in records:
+            start = record['offset'] - first
+            token_ids = tokens[start:start + record['length']]
+            outputs.append((record['key'], [self.vocab[idx] for idx in token_ids], probs[start:start + record['length']].tolist()))
+        return outputs
+
+
+class PickleTail:
+    # Follows a result directory with one pickle file per question. A file that does not load yet is still being
+    # written and is read again at the next poll.
+    def __init__(self, result_dir):
+        self.result_dir = result_dir
+        self.seen = set()
+
+    def poll(self):
+        outputs = []
+        if not os.path.exists(self.result_dir):
+            return outputs
+        for entry in os.scandir(self.result_dir):
+            if not entry.name.endswith('.pk') or entry.name in self.seen:
+                continue
+            try:
+                with open(entry.path, 'rb') as f:
+                    instance_output = pickle.load(f)
+            except Exception:
+                continue
+            self.seen.add(entry.name)
+            outputs.append((entry.name[:-len('.pk')], instance_output[0], instance_output[1]))
+        return outputs
+
+
+class LiveEval:
+    # Scores a QA run while it is still answering. The answers that land in the result directory (pickle files, the result
+    # store, or the per-worker stores of QA --workers) update running counts per DR: the answered questions, the TQ, CTQ,
+    # CQ and CCQ accuracies and the TQ/CTQ and CQ/CCQ consistency. A question pair (TQ with its CTQ, CQ with its CCQ) is
+    # counted once both of its answers are in, so the partial scores use the formulas of Eval, and once every question is
+    # answered they are the scores eval.py gives. Every report_every seconds the partial scores and the coverage are printed
+    # and written to config.metrics_fp('eval', 'live').
+    def __init__(self, config, report_every=60):
+        self.config = config
+        self.report_every = report_every
+        self.live_fp = config.metrics_fp('eval', 'live')
+        self.start_time = time.perf_counter()
+
+        evaluation = Eval(config, verbalize=0)
+        self.modelname = evaluation.modelname
+        self.level2_relation = evaluation.level2_relation
+        self.DR_names, filenames, DR_of_question, _, _, _ = evaluation.question_layout()
+        self.num_DRs = len(self.DR_names)
+        self.position = {}
+        self.answers = {}
+        self.DR_of_question = {}
+        for qtype in ['TQ', 'CQ', 'CTQ', 'CCQ']:
+            for idx, filename in enumerate(filenames[qtype]):
+                self.position[filename] = (qtype, idx)
+            self.answers[qtype] = np.full(len(filenames[qtype]), -1, dtype=np.int64) # -1: not answered yet
+            self.DR_of_question[qtype] = np.array(DR_of_question[qtype], dtype=np.int64)
+        self.num_questions = len(self.position)
+        self.num_answered = 0
+        self.DR_questions = sum(np.bincount(self.DR_of_question[qtype], minlength=self.num_DRs) for qtype in self.answers)
+        self.DR_answered = np.zeros(self.num_DRs, dtype=np.int64)
+
+        # The running counts of scoring.answer_counts, per DR, over the question pairs that are complete
+        self.counts = {name: np.zeros(self.num_DRs) for name in ['num_TQ', 'num_CQ', 'num_CTQ', 'num_CCQ', 'TQ_yes', 'CTQ_yes', 'CQ_no', 'CCQ_no', 'TQ_consistency_count', 'CQ_consistency_count']}
+        self.pair_counted = {'TQ': np.zeros(len(self.answers['TQ']), dtype=bool), 'CQ': np.zeros(len(self.answers['CQ']), dtype=bool)}
+
+        self.tails = {}
+        self.pickle_tail = PickleTail(config.result_dir)
+
+    def find_tails(self):
+        # The run's store and the stores of its QA workers, which may appear (and disappear, merged into the run's store) later
+        store_dirs = [os.path.join(self.config.result_dir, 'store')]
+        workers_dir = os.path.join(self.config.result_dir, 'workers')
+        if os.path.isdir(workers_dir):
+            store_dirs += [os.path.join(workers_dir, name, 'store') for name in sorted(os.listdir(workers_dir))]
+        for store_dir in store_dirs:
+            if store_dir not in self.tails and os.path.exists(os.path.join(store_dir, 'index.jsonl')):
+                self.tails[store_dir] = StoreTail(store_dir)
+
+    def poll(self):
+        # Read the answers that landed since the last poll and update the counts, returns how many were new
+        self.find_tails()
+        outputs = self.pickle_tail.poll()
+        for store_dir, tail in list(self.tails.items()):
+            try:
+                outputs += tail.poll()
+            except FileNotFoundError:
+                # a worker store that QA merged and removed, its answers are in the run's store
+                del self.tails[store_dir]
+
+        new = {qtype: [] for qtype in self.answers}
+        for key, tokens, probabilities in outputs:
+            if key not in self.position:
+                continue
+            qtype, idx = self.position[key]
+            if self.answers[qtype][idx] != -1:
+                continue
+            self.answers[qtype][idx] = token_answer(tokens, probabilities, self.config.positive_tokens, self.config.negative_tokens)
+            new[qtype].append(idx)
+        num_new = sum(len(positions) for positions in new.values())
+        self.num_answered += num_new
+        for qtype, positions in new.items():
+            self.DR_answered += np.bincount(self.DR_of_question[qtype][positions], minlength=self.num_DRs)
+
+        self.count_pairs('TQ', 'CTQ', np.array(new['TQ'] + new['CTQ'], dtype=np.int64))
+        self.count_pairs('CQ', 'CCQ', np.array(new['CQ'] + new['CCQ'], dtype=np.int64))
+        return num_new
+
+    def count_pairs(self, qtype, converse, positions):
+        # Add the pairs among positions whose two answers are now both in
+        positions = np.unique(positions)
+        positions = positions[(self.answers[qtype][positions] != -1) & (self.answers[converse][positions] != -1) & ~self.pair_counted[qtype][positions]]
+        if len(positions) == 0:
+            return
+        self.pair_counted[qtype][positions] = True
+        DRs = self.DR_of_question[qtype][positions]
+        answers, converse_answers = self.answers[qtype][positions], self.answers[converse][positions]
+        # targeted questions should be answered yes, counterfactual ones no
+        expected = 1 if qtype == 'TQ' else 0
+        suffix = 'yes' if qtype == 'TQ' else 'no'
+        for name, values in [('num_' + qtype, None), ('num_' + converse, None), ('{}_{}'.format(qtype, suffix), answers == expected),
+                ('{}_{}'.format(converse, suffix), converse_answers == expected), ('{}_consistency_count'.format(qtype), answers == converse_answers)]:
+            self.counts[name] += np.bincount(DRs, weights=values, minlength=self.num_DRs)
+
+    def snapshot(self):
+        # The partial scores, overall and per DR, with their coverage
+        overall = scores_from_counts({name: values.sum() for name, values in self.counts.items()})
+        per_DR = scores_from_counts(self.counts)
+        elapsed = time.perf_counter() - self.start_time
+
+        def rounded(value):
+            return None if np.isnan(value) else round(float(value), 3)
+
+        snapshot = {
+            'modelname': self.modelname,
+            'taskname': self.config.taskname,
+            'elapsed_seconds': round(elapsed, 1),
+            'answered': self.num_answered,
+            'questions': self.num_questions,
+            'coverage': round(self.num_answered / self.num_questions, 4) if self.num_questions > 0 else 0.0,
+            'complete_pairs': int(self.counts['num_TQ'].sum() + self.counts['num_CQ'].sum()),
+            'Overall': rounded(overall['disq_score']),
+            'Targeted': rounded(overall['targeted_score']),
+            'Counterfactual': rounded(overall['counterfactual_score']),
+            'Consistency': rounded(overall['overall_consistency']),
+            'DRs': {},
+        }
+        for level2_relation in self.level2_relation:
+            if level2_relation not in self.DR_names or self.DR_questions[self.DR_names.index(level2_relation)] == 0:
+                continue
+            DR = self.DR_names.index(level2_relation)
+            snapshot['DRs'][level2_relation] = {'score': rounded(per_DR['disq_score'][DR]), 'coverage': round(float(self.DR_answered[DR] / self.DR_questions[DR]), 4)}
+        return snapshot
+
+    def publish(self):
+        snapshot = self.snapshot()
+        print('{:.0f} s: {} of {} questions ({:.1%}), Overall {}, Targeted {}, Counterfactual {}, Consistency {}'.format(snapshot['elapsed_seconds'],
+            snapshot['answered'], snapshot['questions'], snapshot['coverage'], snapshot['Overall'], snapshot['Targeted'], snapshot['Counterfactual'], snapshot['Consistency']))
+        tmp_fp = '{}.tmp{}'.format(self.live_fp, os.getpid())
+        with open(tmp_fp, 'w') as f:
+            json.dump(snapshot, f, indent=4)
+        os.replace(tmp_fp, self.live_fp)
+        return snapshot
+
+    def follow(self, poll_every=5, stop_below=None, min_coverage=0.1, idle_timeout=None):
+        # Poll until every question is answered. Returns the last snapshot, and whether the run was flagged: with stop_below,
+        # a run whose Overall is below it once min_coverage of the questions are answered is flagged and following stops.
+        # With idle_timeout, following also stops when no answer arrived for that many seconds (e.g. QA crashed).
+        last_report = None
+        last_answer = time.perf_counter()
+        while True:
+            if self.poll() > 0:
+                last_answer = time.perf_counter()
+            now = time.perf_counter()
+            done = self.num_answered == self.num_questions
+            idle = idle_timeout is not None and now - last_answer > idle_timeout
+            if done or idle or last_report is None or now - last_report >= self.report_every:
+                snapshot = self.publish()
+                last_report = now
+                if stop_below is not None and snapshot['coverage'] >= min_coverage and snapshot['Overall'] is not None and snapshot['Overall'] < stop_below:
+                    print('Overall {} is below {} at {:.1%} coverage, the run can be stopped.'.format(snapshot['Overall'], stop_below, snapshot['coverage']))
+                    return snapshot, True
+            if done:
+                print('All questions answered, run eval.py to save the final scores.')
+                return snapshot, False
+            if idle:
+                print('No new answers for {} s, stopped following.'.format(idle_timeout))
+                return snapshot, False
+            time.sleep(poll_every)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score a QA run while it is still answering: partial DiSQ scores and coverage, updated as the answers land.')
+    parser.add_argument('--dataset', type=str, default='pdtb', help='pdtb, ted, or the path of a dataset file, e.g. a synthetic one from dataset_scaler.py.')
+    parser.add_argument('--modelname', type=str, default='13bchat', help='Model name: 13bchat, 13b, 7bchat, 7b, vicuna-13b')
+    parser.add_argument('--modelurl', type=str, default=None, help='The model path in the hugging face model hub, overwrites modelname.')
+    parser.add_argument('--version', type=str, default='v1', help='v1, v2, v3, or v4?')
+    parser.add_argument('--paraphrase', type=str, default=None, help='Options: None (default), p1, or p2')
+    parser.add_argument('--feature', type=str, default=None, help='Options: conn, context, or history.')
+    parser.add_argument('--hfpath', type=str, default='/mnt/data/yisong/hf-path', help='Huggingface path')
+    parser.add_argument('--precision', type=str, default=None, help='The --precision of the QA run: bf16 or int8. Default is the full-precision run.')
+    parser.add_argument('--result_dir', type=str, default=None, help='Follow this result directory instead of the one given by the model and the task.')
+    parser.add_argument('--poll_every', type=float, default=5, help='Seconds between two looks at the result directory. Default is 5.')
+    parser.add_argument('--report_every', type=float, default=60, help='Seconds between two published snapshots. Default is 60.')
+    parser.add_argument('--follow', type=int, default=1, help='1 (default): keep following until every question is answered. 0: score what is there once and exit.')
+    parser.add_argument('--idle_timeout', type=float, default=None, help='Stop following when no answer arrived for this many seconds. Default is to wait forever.')
+    parser.add_argument('--stop_below', type=float, default=None, help='Flag the run (exit status 2) when its Overall is below this once --min_coverage of the questions are answered.')
+    parser.add_argument('--min_coverage', type=float, default=0.1, help='Only with --stop_below: the share of answered questions before a run can be flagged. Default is 0.1.')
+    args = parser.parse_args()
+
+    config = DiSQ_Config(args.dataset, args.modelname, args.modelurl, args.version, args.paraphrase, args.feature, args.hfpath, 0, precision=args.precision)
+    if args.result_dir is not None:
+        config.result_dir = args.result_dir
+    live = LiveEval(config, report_every=args.report_every)
+    if args.follow == 1:
+        snapshot, flagged = live.follow(args.poll_every, args.stop_below, args.min_coverage, args.idle_timeout)
+    else:
+        live.poll()
+        snapshot = live.publish()
+        flagged = args.stop_below is not None and snapshot['coverage'] >= args.min_coverage and snapshot['Overall'] is not None and snapshot['Overall'] < args.stop_below
+    print('Snapshot saved to:', live.live_fp)
+    if flagged:
+        sys.exit(2)
@@ -17,18 +17,40 @@ modelurl=$1
 # We first call the question generation bash (scripts/question_generation.py) script to generate the questions
 bash scripts/question_generation.sh
 
+# Answer all PDTB and TED tasks with one scoring server, so the model is loaded only once.
+# batch_size 1 keeps the unbatched model.generate path of the paper numbers, e.g. 16 fills every forward pass across the queued tasks
+batch_size=1
+socket=data/scoring.sock
+rm -f $socket # left behind by a killed server, it would look like a running one
+python scripts/scoring_server.py serve --socket $socket --modelurl $modelurl --device_number $device_number --hfpath $huggingface_path --batch_size $batch_size &
+server_pid=$!
+# Wait until the server has loaded the model, and stop if it died on the way (e.g. a wrong model name or out of memory)
+while [ ! -S $socket ]
+do
+	if ! kill -0 $server_pid 2>/dev/null; then
+		echo "The scoring server exited before it was ready."
+		exit 1
+	fi
+	sleep 5
+done
+
 # PDTB
 for version in v1 v2 v3 v4
 do
-	python scripts/question_answering.py --dataset pdtb --modelurl $modelurl --version $version --device_number $device_number --hfpath $huggingface_path
+	python scripts/scoring_server.py submit --socket $socket --dataset pdtb --version $version
 done
 
 # TED
 for version in v1 v2 v3 v4
 do
-	python scripts/question_answering.py --dataset ted --modelurl $modelurl --version $version --device_number $device_number --hfpath $huggingface_path
+	python scripts/scoring_server.py submit --socket $socket --dataset ted --version $version
 done
 
+python scripts/scoring_server.py wait --socket $socket
+python scripts/scoring_server.py stats --socket $socket
+python scripts/scoring_server.py shutdown --socket $socket
+wait
+
 
 for version in v1 v2 v3 v4
 do
@@ -0,0 +1,116 @@
+import argparse
+import os
+import json
+
+import numpy as np
+
+from disq_config import DiSQ_Config
+from eval import Eval
+from result_store import ResultStore
+
+
+class ParityReport:
+    # Compares the DiSQ scores of reduced-precision QA runs (bf16, int8) with a full-precision run of the same model.
+    # Only the discourse instances answered by every run are scored, so a QA --subset run can be compared directly.
+    def __init__(self, config_args, reference, candidates):
+        self.reference = reference
+        self.candidates = candidates
+        self.evals = {}
+        for precision in [reference] + candidates:
+            config = DiSQ_Config(*config_args, precision=None if precision in ['fp32', 'fp16'] else precision)
+            self.evals[precision] = Eval(config, verbalize=0)
+        self.config = self.evals[reference].config
+
+    def is_answered(self, evaluator, instance_key, instance_value):
+        for pair_idx, questions in instance_value.items():
+            for qtype, field in [('TQ', 'targeted_question'), ('CQ', 'counterfactual_question'), ('CTQ', 'converse_targeted_question'), ('CCQ', 'converse_counterfactual_question')]:
+                for qidx in range(len(questions[field])):
+                    filename = 'D-{}-e-{}-{}-{}'.format(instance_key, pair_idx, qtype, qidx)
+                    if evaluator.result_store is not None:
+                        if filename not in evaluator.result_store:
+                            return False
+                    elif not os.path.exists(os.path.join(evaluator.result_dir, f'{filename}.pk')):
+                        return False
+        return True
+
+    def score(self, evaluator):
+        # Overall, Targeted, Counterfactual, Consistency and the DiSQ score of every level-2 DR, as in Eval
+        evaluator.collect_answers()
+        groups = {qtype: np.zeros_like(DR_of_question) for qtype, DR_of_question in evaluator.answer_DR.items()}
+        overall = evaluator.compute_scores(groups, 1)
+        scores = {
+            'Overall': float(overall['disq_score'][0]),
+            'Targeted': float(overall['targeted_score'][0]),
+            'Counterfactual': float(overall['counterfactual_score'][0]),
+            'Consistency': float(overall['overall_consistency'][0]),
+        }
+        per_DR = evaluator.compute_scores(evaluator.answer_DR, len(evaluator.DR_names))
+        for level2_relation in evaluator.level2_relation:
+            if level2_relation in evaluator.DR_names and per_DR['num_TQ'][evaluator.DR_names.index(level2_relation)] > 0:
+                scores[level2_relation] = float(per_DR['disq_score'][evaluator.DR_names.index(level2_relation)])
+        return scores
+
+    def run(self):
+        question_dict = self.evals[self.reference].question_dict
+        common_keys = [key for key, value in question_dict.items() if all(self.is_answered(evaluator, key, value) for evaluator in self.evals.values())]
+        print('Discourse instances answered by every run: {} of {}'.format(len(common_keys), len(question_dict)))
+        if len(common_keys) == 0:
+            raise ValueError('No discourse instance has been answered by all of: {}'.format(', '.join(self.evals)))
+
+        scores = {}
+        answers = {}
+        for precision, evaluator in self.evals.items():
+            evaluator.question_dict = {key: question_dict[key] for key in common_keys}
+            scores[precision] = self.score(evaluator)
+            answers[precision] = evaluator.results_consolidated
+
+        report = {
+            'model': self.config.modelname,
+            'taskname': self.config.taskname,
+            'reference': self.reference,
+            'num_instances': len(common_keys),
+            'num_questions': len(answers[self.reference]),
+            'scores': {precision: {key: round(value, 3) for key, value in precision_scores.items()} for precision, precision_scores in scores.items()},
+            'delta': {},
+            'answer_agreement': {},
+        }
+        for precision in self.candidates:
+            report['delta'][precision] = {key: round(scores[precision][key] - scores[self.reference][key], 3) for key in scores[self.reference] if key in scores[precision]}
+            # The fraction of questions that get the same yes/no answer as in the reference run
+            same = [answers[precision][filename] == answer for filename, answer in answers[self.reference].items()]
+            report['answer_agreement'][precision] = round(float(np.mean(same)), 4)
+        return report
+
+    def print_report(self, report):
+        columns = [self.reference] + self.candidates
+        print('{:<28}'.format('Score') + ''.join('{:>10}'.format(precision) for precision in columns) + ''.join('{:>12}'.format('d_' + precision) for precision in self.candidates))
+        for key in report['scores'][self.reference]:
+            line = '{:<28}'.format(key)
+            line += ''.join('{:>10}'.format(report['scores'][precision].get(key, '-')) for precision in columns)
+            line += ''.join('{:>12}'.format(report['delta'][precision].get(key, '-')) for precision in self.candidates)
+            print(line)
+        for precision in self.candidates:
+            print('Answer agreement of {} with {}: {}'.format(precision, self.reference, report['answer_agreement'][precision]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the DiSQ scores of bf16 / int8 QA runs with a full-precision run on the same questions.')
+    parser.add_argument('--dataset', type=str, default='pdtb', help='Dataset: pdtb, ted, or the path of a dataset file, e.g. a synthetic one from dataset_scaler.py')
+    parser.add_argument('--modelname', type=str, default='13bchat', help='Model name: 13bchat, 13b, 7bchat, 7b, vicuna-13b')
+    parser.add_argument('--modelurl', type=str, default=None, help='The model path in the hugging face model hub, overwrites modelname.')
+    parser.add_argument('--version', type=str, default='v1', help='Version of the dataset')
+    parser.add_argument('--paraphrase', type=str, default=None, help='Paraphrase: p1, p2')
+    parser.add_argument('--feature', type=str, default=None, help='Feature: None, or any feature')
+    parser.add_argument('--reference', type=str, default='fp32', help='The precision of the reference run: fp32 (default) or fp16, both read the usual result directory.')
+    parser.add_argument('--candidates', type=str, nargs='+', default=['bf16', 'int8'], help='The precisions to compare with the reference. Default: bf16 int8')
+    args = parser.parse_args()
+
+    config_args = (args.dataset, args.modelname, args.modelurl, args.version, args.paraphrase, args.feature, None, None)
+    parity = ParityReport(config_args, args.reference, args.candidates)
+    report = parity.run()
+    parity.print_report(report)
+
+    fp = os.path.join(parity.config.make_dir('data/results'), 'parity_{}_{}.json'.format(report['model'], report['taskname']))
+    with open(fp, 'w') as f:
+        json.dump(report, f, indent=4)
+    print('Report saved to:', fp)
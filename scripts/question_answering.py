@@ -1,19 +1,45 @@
 import argparse
+import contextlib
+import copy
+import io
+import importlib.util
+import inspect
+import multiprocessing
 import os
 import pickle
 import json
+import queue
+import threading
+import resource
+import time
 from datetime import datetime
 
+import numpy as np
 import torch
 import torch.nn.functional as F
 from transformers import AutoTokenizer, AutoModelForCausalLM
 
 from disq_config import DiSQ_Config
+from answer_tokens import AnswerTokenIndex
+from result_store import ResultStore, ProgressManifest, write_pickle_atomic, merge_worker_results
+from answer_cache import AnswerCache
+from token_cache import TokenCache
+from run_metrics import RunMetrics
+from eval import Eval
+from scoring import token_answer, answer_counts, scores_from_counts, bootstrap_counts
 
 
 class QA:
-    def __init__(self, config):
+    # The dtype the weights are loaded in, int8 is loaded in float32 and then quantized
+    PRECISIONS = {'fp32': torch.float32, 'fp16': torch.float16, 'bf16': torch.bfloat16, 'int8': torch.float32}
+
+    def __init__(self, config, batch_size=1, max_batch_tokens=None, prefix_cache=False, result_format='pickle', resume=False, answer_scoring='topk', scoring_path='generate', fast_load=False, snapshot_dir=None, device='auto', precision='auto', subset=None, answer_cache=None, answer_cache_max_mb=None, token_cache=False, pipeline=False, pipeline_depth=4, verbose=False, profile=False):
         self.config = config
+        # Stage timers, prompt lengths and per-DR timing, written to metrics_fp at the end of loop_through
+        self.metrics = RunMetrics('QA')
+        self.metrics_fp = self.config.metrics_fp('qa')
+        self.verbose = verbose # print every question, instead of one progress line every 30 seconds
+        self.profile = profile
         
         # Load the questions
         self.taskname = self.config.taskname
@@ -21,100 +47,968 @@ class QA:
         self.question_fp = os.path.join(self.question_dir, f'{self.taskname}.json')
         with open(self.question_fp, 'r') as f:
             self.question_dict = json.load(f)
+        if subset is not None:
+            # Only answer `subset` discourse instances, evenly spaced over the dataset so that every DR is represented
+            instance_keys = list(self.question_dict.keys())
+            step = max(1, len(instance_keys) // subset)
+            self.question_dict = {key: self.question_dict[key] for key in instance_keys[::step][:subset]}
+            print('Answering a subset of {} discourse instances.'.format(len(self.question_dict)))
         
+        # Try to use the GPU if available
+        if device == 'auto':
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.device = torch.device('cpu')
+        if device == 'cuda':
+            self.device = torch.device("cuda:{}".format(self.config.device_number))
+
+        # auto: float16 on the GPU (to fit the GPU RAM), the checkpoint dtype on CPU
+        if precision == 'auto':
+            precision = 'fp16' if self.device.type == 'cuda' else 'fp32'
+        if precision not in self.PRECISIONS:
+            raise ValueError('Unknown precision {}, options: auto, {}'.format(precision, ', '.join(self.PRECISIONS)))
+        if precision == 'fp16' and self.device.type == 'cpu':
+            raise ValueError('fp16 is not supported on CPU, many kernels have no float16 version there. Use bf16 or int8.')
+        if precision == 'int8' and self.device.type != 'cpu':
+            raise ValueError('int8 uses dynamic quantization, which only runs on CPU.')
+        self.precision = precision
+
         # Load the model
         print('Loading the model...')
         print(self.config.model)
-        print('Load the tokenizer')
-        self.tokenizer = AutoTokenizer.from_pretrained(self.config.model, cache_dir=self.config.hfpath)
-        print('Load the model')
-        self.model = AutoModelForCausalLM.from_pretrained(self.config.model, cache_dir=self.config.hfpath)
-        print('Model loaded, convert.')
-        self.model = self.model.to(dtype=torch.float16) # Make it compatible with the GPU RAM
-
-        # Try to use the GPU if available
-        self.device =  torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.device = torch.device("cuda:{}".format(self.config.device_number))
+        load_start = time.time()
+        if fast_load:
+            self.load_model_fast(snapshot_dir)
+        else:
+            print('Load the tokenizer')
+            self.tokenizer = AutoTokenizer.from_pretrained(self.config.model, cache_dir=self.config.hfpath)
+            print('Load the model')
+            self.model = AutoModelForCausalLM.from_pretrained(self.config.model, cache_dir=self.config.hfpath)
+            if self.PRECISIONS[self.precision] != torch.float32:
+                print('Model loaded, convert.')
+                self.model = self.model.to(dtype=self.PRECISIONS[self.precision])
         self.model.to(self.device)
+        if self.precision == 'int8':
+            # Dynamic quantization: the nn.Linear weights (attention, MLP and LM head) are stored in int8,
+            # the activations are quantized on the fly, everything else stays in float32
+            print('Quantize the linear layers to int8.')
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        load_seconds = time.time() - load_start
+        self.metrics.add_time('load', load_seconds)
+        self.report_load_stats(load_seconds, fast_load, snapshot_dir)
         # Print the model config and device being used
         print('Model config: ', self.model.config)
         print('Device being used: ', self.device)
         print('QA class is initialized.')
+
+        # Batched inference, batch_size == 1 keeps the original one-prompt-at-a-time path
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.prefix_cache = prefix_cache
+
+        # Where the answers go: one pickle file per question, or a single ResultStore per run
+        self.config.make_dir(self.config.result_dir)
+        self.resume = resume
+        self.result_store = None
+        if result_format == 'store':
+            self.result_store = ResultStore(self.config.result_dir, mode='a', durable=self.resume)
+
+        # In resume mode we skip every question that a previous run has already finished.
+        # The result store's index already plays this role, pickle runs keep a progress manifest.
+        self.progress = None
+        if self.resume and self.result_store is None:
+            self.progress = ProgressManifest(self.config.result_dir)
+        # Keys that are known to be done from elsewhere, e.g. the parent's store or manifest in a --workers run
+        self.skip_keys = set()
+        # filename -> 0/1 answer of every question written, kept by loop_through_adaptive to score each round as it finishes
+        self.written_answers = None
+
+        # instance key -> level-2 DR, for the per-DR timing
+        self.instance_DR = {key: self.config.level2_DR(self.config.data_dict[key]['DR']) for key in self.question_dict if key in self.config.data_dict}
+
+        # 'generate' calls model.generate for one new token, 'forward' applies the LM head only at the last position
+        self.scoring_path = scoring_path
+        self.base_model_takes_position_ids = 'position_ids' in inspect.signature(self.model.base_model.forward).parameters
+
+        # With answer_scoring 'yesno' we keep p(yes) and p(no) computed from token ids instead of the top 30 decoded tokens
+        self.decoded_tokens = {}
+        self.answer_index = None
+        if answer_scoring == 'yesno':
+            self.answer_index = AnswerTokenIndex(self.tokenizer, self.config.positive_tokens, self.config.negative_tokens, self.config.answer_token_index_dir)
+            self.positive_ids = torch.tensor(self.answer_index.positive_ids, dtype=torch.long, device=self.device)
+            self.negative_ids = torch.tensor(self.answer_index.negative_ids, dtype=torch.long, device=self.device)
+            self.answer_labels = [self.config.positive_tokens[0], self.config.negative_tokens[0]]
+
+        # Token ids of the whole question file, encoded once per tokenizer and memory-mapped
+        self.token_cache = None
+        if token_cache:
+            self.token_cache = TokenCache(self.tokenizer, self.question_fp, self.config.token_cache_dir)
+
+        # Answers of byte-identical prompts are shared across runs (answer_cache is the SQLite file) and within a run
+        self.answer_cache = None
+        if answer_cache is not None:
+            self.answer_cache = AnswerCache(answer_cache, self.answer_cache_model_key(answer_scoring), max_size_mb=answer_cache_max_mb)
+        self.pending_prompts = {} # filename -> prompt of the questions being computed
+        self.duplicates = {} # prompt -> the other filenames with the same prompt, they get the same answer
+
+        # With pipeline, the next batches are tokenized in a background thread and the answers are decoded and written
+        # in another one, both at most pipeline_depth batches ahead of or behind the model
+        self.pipeline = pipeline
+        self.pipeline_depth = pipeline_depth
+        self.write_queue = None
+        self.writer_errors = []
+        self.tokenizer_lock = threading.Lock() # the fast tokenizer must not be used by two threads at once
+        self.output_lock = threading.Lock() # result writes, the answer cache and its bookkeeping are shared by the main and writer threads
+
+        if self.batch_size > 1:
+            # Causal LMs predict the next token from the last position, so we must pad on the left
+            self.tokenizer.padding_side = 'left'
+            if self.tokenizer.pad_token is None:
+                # LLaMA tokenizers do not define a pad token, the padded positions are masked out anyway
+                self.tokenizer.pad_token = self.tokenizer.unk_token if self.tokenizer.unk_token is not None else self.tokenizer.eos_token
     
+    def load_model_fast(self, snapshot_dir):
+        # Materialize the weights straight into the target dtype, one tensor at a time, instead of fp32 first and converting.
+        # With snapshot_dir, the converted model is also saved there as safetensors, which later runs memory-map.
+        dtype = self.PRECISIONS[self.precision]
+        source = self.config.model
+        snapshot_fp = None
+        if snapshot_dir is not None:
+            snapshot_fp = os.path.join(snapshot_dir, '{}-{}'.format(self.config.model.replace('/', '--'), str(dtype).split('.')[-1]))
+            if os.path.exists(os.path.join(snapshot_fp, 'config.json')):
+                source = snapshot_fp
+                print('Load the local snapshot:', snapshot_fp)
+
+        load_kwargs = {'cache_dir': self.config.hfpath, 'torch_dtype': dtype}
+        if importlib.util.find_spec('accelerate') is not None:
+            load_kwargs['low_cpu_mem_usage'] = True
+            if self.device.type == 'cuda':
+                load_kwargs['device_map'] = {'': self.device.index} # load the weights directly onto the GPU
+        else:
+            print('accelerate is not installed, loading without low_cpu_mem_usage.')
+
+        print('Load the tokenizer')
+        self.tokenizer = AutoTokenizer.from_pretrained(source, cache_dir=self.config.hfpath)
+        print('Load the model in', dtype)
+        self.model = AutoModelForCausalLM.from_pretrained(source, **load_kwargs)
+
+        if snapshot_fp is not None and source != snapshot_fp:
+            self.model.save_pretrained(snapshot_fp, safe_serialization=True)
+            self.tokenizer.save_pretrained(snapshot_fp)
+            print('Snapshot saved to:', snapshot_fp)
+
+    def report_load_stats(self, load_seconds, fast_load, snapshot_dir):
+        # ru_maxrss is in kilobytes on Linux
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print('Model loaded in {:.1f} seconds, peak RSS {:.0f} MB.'.format(load_seconds, peak_rss_mb))
+        load_stats = {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'model': self.config.model,
+            'device': str(self.device),
+            'precision': self.precision,
+            'fast_load': fast_load,
+            'snapshot_dir': snapshot_dir,
+            'load_seconds': round(load_seconds, 2),
+            'peak_rss_mb': round(peak_rss_mb, 1),
+        }
+        self.config.make_dir(os.path.dirname(self.config.load_stats_fp))
+        with open(self.config.load_stats_fp, 'a') as f:
+            f.write(json.dumps(load_stats) + '\n')
+
+    def answer_cache_model_key(self, answer_scoring):
+        # Answers are only shared between runs of the same weights, precision and answer format
+        revision = getattr(self.model.config, '_commit_hash', None) or 'local'
+        return '{}@{}/{}/{}'.format(self.config.model, revision, self.precision, answer_scoring)
+
+    def resolve_cached(self, cases):
+        # Answer the cases whose prompt is in the answer cache right away, and keep one case per distinct prompt.
+        # Returns the cases that still need a forward pass.
+        if self.answer_cache is None:
+            return cases
+        with self.output_lock:
+            return self.resolve_cached_locked(cases)
+
+    def resolve_cached_locked(self, cases):
+        remaining = []
+        for question, filename in cases:
+            if question in self.duplicates:
+                self.duplicates[question].append(filename)
+                self.answer_cache.duplicates += 1
+                continue
+            instance_output = self.answer_cache.get(question)
+            if instance_output is not None:
+                self.write_output(filename, instance_output)
+                self.answer_cache.hits += 1
+                continue
+            self.pending_prompts[filename] = question
+            self.duplicates[question] = []
+            self.answer_cache.misses += 1
+            remaining.append((question, filename))
+        return remaining
+
+    def output_ready(self, filename, instance_output):
+        # Every computed answer goes through here: it is written, cached, and copied to the duplicates of its prompt
+        self.write_output(filename, instance_output)
+        if filename not in self.pending_prompts:
+            return
+        question = self.pending_prompts.pop(filename)
+        self.answer_cache.put(question, instance_output)
+        for duplicate in self.duplicates.pop(question):
+            self.write_output(duplicate, instance_output)
+
+    def encode_cases(self, cases):
+        # The token ids of every (question, filename), from the token cache if there is one
+        if self.token_cache is not None:
+            return [self.token_cache.get(filename).tolist() for _, filename in cases]
+        with self.tokenizer_lock:
+            return self.tokenizer([question for question, _ in cases]).input_ids
+
+    def pad_left(self, all_input_ids):
+        # The same input_ids and attention_mask as the tokenizer with padding_side 'left'
+        max_length = max(len(ids) for ids in all_input_ids)
+        input_ids = [[self.tokenizer.pad_token_id] * (max_length - len(ids)) + ids for ids in all_input_ids]
+        attention_mask = [[0] * (max_length - len(ids)) + [1] * len(ids) for ids in all_input_ids]
+        if self.pipeline and self.device.type == 'cuda':
+            # Copy from pinned memory without blocking, the copy overlaps with the forward pass of the previous batch
+            return torch.tensor(input_ids).pin_memory().to(self.device, non_blocking=True), torch.tensor(attention_mask).pin_memory().to(self.device, non_blocking=True)
+        return torch.tensor(input_ids, device=self.device), torch.tensor(attention_mask, device=self.device)
+
     def decode_one_case(self, question, filename):
-        print('Decoding the question: ', question)
-        print('Filename: ', filename)
+        if self.verbose:
+            print('Decoding the question: ', question)
+            print('Filename: ', filename)
+        start = time.perf_counter()
         
-        input_ids = self.tokenizer(question, return_tensors="pt").input_ids.to(self.device)
+        with self.metrics.stage('tokenize'):
+            if self.token_cache is not None:
+                input_ids = torch.tensor([self.token_cache.get(filename).tolist()], device=self.device)
+            else:
+                input_ids = self.tokenizer(question, return_tensors="pt").input_ids.to(self.device)
+        self.metrics.add_prompt_lengths([input_ids.shape[1]])
+
+        with self.metrics.stage('forward'):
+            if self.scoring_path == 'forward':
+                logits = self.forward_last_logits(input_ids, torch.ones_like(input_ids))
+            else:
+                outputs = self.model.generate(input_ids, 
+                    max_new_tokens=1,
+                    output_scores=True, 
+                    return_dict_in_generate=True,
+                    do_sample=False,
+                    num_return_sequences=1)
+                logits = outputs.scores[0] # Because we only have and care about the first sequence, and the first token in the sequence
+            self.synchronize()
+
+        self.save_outputs(logits, [filename])
+        self.add_DR_time([filename], time.perf_counter() - start)
+
+    def synchronize(self):
+        # CUDA kernels run asynchronously, wait for them so that the forward stage is timed correctly
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+
+    def add_DR_time(self, filenames, seconds):
+        # filenames are D-{instance}-e-{pair}-{type}-{index}
+        self.metrics.add_DR_time([self.instance_DR.get(filename.split('-')[1], 'unknown') for filename in filenames], seconds)
+
+    def decode_batch(self, batch):
+        # batch is a list of (question, filename), all questions are decoded in one forward pass
+        self.decode_prepared(batch, *self.prepare_batch(batch))
+
+    def prepare_batch(self, batch):
+        # The left-padded input_ids and attention_mask of a batch, on the device
+        with self.metrics.stage('tokenize'):
+            if self.token_cache is not None or len(batch) == 1:
+                all_input_ids = self.encode_cases(batch)
+                self.metrics.add_prompt_lengths([len(ids) for ids in all_input_ids])
+                return self.pad_left(all_input_ids)
+            with self.tokenizer_lock:
+                inputs = self.tokenizer([question for question, _ in batch], return_tensors="pt", padding=True)
+            self.metrics.add_prompt_lengths(inputs.attention_mask.sum(dim=1).tolist())
+            inputs = inputs.to(self.device)
+            return inputs.input_ids, inputs.attention_mask
+
+    def decode_prepared(self, batch, input_ids, attention_mask):
+        if self.verbose:
+            print('Decoding a batch of {} questions, first filename: {}'.format(len(batch), batch[0][1]))
+        start = time.perf_counter()
+        filenames = [filename for _, filename in batch]
+        with self.metrics.stage('forward'):
+            if self.scoring_path == 'forward':
+                logits = self.forward_last_logits(input_ids, attention_mask)
+            else:
+                outputs = self.model.generate(input_ids=input_ids,
+                    attention_mask=attention_mask,
+                    max_new_tokens=1,
+                    output_scores=True,
+                    return_dict_in_generate=True,
+                    do_sample=False,
+                    num_return_sequences=1,
+                    pad_token_id=self.tokenizer.pad_token_id)
+                logits = outputs.scores[0] # One row per question, only the first generated token
+            self.synchronize()
+
+        self.save_outputs(logits, filenames)
+        self.add_DR_time(filenames, time.perf_counter() - start)
 
-        outputs = self.model.generate(input_ids, 
-            max_new_tokens=1,
-            output_scores=True, 
-            return_dict_in_generate=True,
-            do_sample=False,
-            num_return_sequences=1)
-        scores = outputs.scores
+    @torch.no_grad()
+    def decode_shared_prefix(self, cases):
+        # cases are all (question, filename) of one discourse instance.
+        # Their prompts share the instruction header and the Sent1/Sent2 (and Context) block, only the question differs.
+        # We prefill the longest common token prefix once and reuse its past_key_values for every question.
+        instance_start = time.perf_counter()
+        with self.metrics.stage('tokenize'):
+            all_input_ids = self.encode_cases(cases)
+            prefix_length = min(len(ids) for ids in all_input_ids) - 1 # keep at least one token per question
+            for ids in all_input_ids[1:]:
+                while prefix_length > 0 and ids[:prefix_length] != all_input_ids[0][:prefix_length]:
+                    prefix_length -= 1
+        self.metrics.add_prompt_lengths([len(ids) for ids in all_input_ids])
+        if self.verbose:
+            print('Decoding {} questions with a shared prefix of {} tokens, first filename: {}'.format(len(cases), prefix_length, cases[0][1]))
 
-        probabilities = F.softmax(scores[0][0], dim=-1).cpu() # Because we only have and care about the first sequence, and the first token in the sequence
+        past_key_values = None
+        if prefix_length > 0:
+            prefix_ids = torch.tensor([all_input_ids[0][:prefix_length]], device=self.device)
+            # The prefill only needs the cache, so we skip the LM head altogether
+            with self.metrics.stage('forward'):
+                past_key_values = self.model.base_model(input_ids=prefix_ids, use_cache=True).past_key_values
+                self.synchronize()
+
+        # The question suffixes are right-padded, so the logits at the last real token of each row are not affected by the padding
+        pad_token_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else 0
+        for start in range(0, len(cases), self.batch_size):
+            chunk = list(range(start, min(start + self.batch_size, len(cases))))
+            suffixes = [all_input_ids[idx][prefix_length:] for idx in chunk]
+            max_length = max(len(suffix) for suffix in suffixes)
+            input_ids = torch.tensor([suffix + [pad_token_id] * (max_length - len(suffix)) for suffix in suffixes], device=self.device)
+            attention_mask = torch.tensor([[1] * (prefix_length + len(suffix)) + [0] * (max_length - len(suffix)) for suffix in suffixes], device=self.device)
+            position_ids = torch.arange(prefix_length, prefix_length + max_length, device=self.device).unsqueeze(0).expand(len(chunk), -1)
+
+            chunk_past = None
+            if past_key_values is not None:
+                chunk_past = self.expand_past_key_values(past_key_values, len(chunk))
+
+            with self.metrics.stage('forward'):
+                last_logits = self.forward_last_logits(input_ids, attention_mask, position_ids=position_ids, past_key_values=chunk_past)
+                self.synchronize()
+            self.save_outputs(last_logits, [cases[idx][1] for idx in chunk])
+        self.add_DR_time([filename for _, filename in cases], time.perf_counter() - instance_start)
+
+    @torch.no_grad()
+    def forward_last_logits(self, input_ids, attention_mask, position_ids=None, past_key_values=None):
+        # Every answer is a single token, so instead of model.generate we run the decoder once and apply the LM head
+        # only at the last real (non-pad) position of each row: 1 x vocab logits per question instead of seq_len x vocab.
+        # attention_mask may also cover the cached prefix, the question tokens are always its last input_ids.shape[1] columns.
+        question_mask = attention_mask[:, -input_ids.shape[1]:]
+        if position_ids is None and self.base_model_takes_position_ids:
+            # The same positions model.generate uses for left-padded inputs
+            position_ids = (question_mask.long().cumsum(-1) - 1).clamp(min=0)
+        inputs = {'input_ids': input_ids, 'attention_mask': attention_mask, 'use_cache': False}
+        if position_ids is not None:
+            inputs['position_ids'] = position_ids
+        if past_key_values is not None:
+            inputs['past_key_values'] = past_key_values
+        hidden_states = self.model.base_model(**inputs)[0]
+
+        # works for both left padding (last column) and right padding (last 1 in the mask)
+        last_positions = question_mask.shape[1] - 1 - question_mask.flip(-1).long().argmax(-1)
+        last_hidden_states = hidden_states[torch.arange(hidden_states.shape[0], device=hidden_states.device), last_positions]
+        return self.model.get_output_embeddings()(last_hidden_states)
+
+    def expand_past_key_values(self, past_key_values, batch_size):
+        # Repeat the cached prefix along the batch dimension.
+        # Newer transformers versions use Cache objects that are updated in place, so we give every chunk its own copy.
+        if hasattr(past_key_values, 'get_seq_length'):
+            past_key_values = copy.deepcopy(past_key_values)
+            past_key_values.batch_repeat_interleave(batch_size)
+            return past_key_values
+        return tuple(tuple(tensor.expand(batch_size, *tensor.shape[1:]) for tensor in layer) for layer in past_key_values)
+
+    def save_outputs(self, logits, filenames):
+        # logits holds the next-token logits of each question, one row per filename, still on the device
+        with self.metrics.stage('postprocess'):
+            scores = self.score_logits(logits)
+        if self.write_queue is not None:
+            self.write_queue.put((scores, filenames)) # blocks while the writer thread is too far behind
+        else:
+            self.write_scores(scores, filenames)
+
+    def score_logits(self, logits):
+        # The device part of save_outputs, only small lists are copied back
+        if self.answer_index is not None:
+            # Sum the probabilities of all answer token ids on the device, only p(yes) and p(no) are copied back.
+            # They are saved under one positive and one negative label, so Eval scores them like the top 30 tokens.
+            probabilities = F.softmax(logits.float(), dim=-1)
+            positive_prob = probabilities[:, self.positive_ids].sum(dim=-1)
+            negative_prob = probabilities[:, self.negative_ids].sum(dim=-1)
+            return torch.stack([positive_prob, negative_prob], dim=-1).cpu().tolist()
+
+        probabilities = F.softmax(logits, dim=-1)
         # convert the probabilities to float
         probabilities = probabilities.float()
 
         prob_top30, idx_top30 = torch.topk(probabilities, 30) # To save space in disk, we only save the token and their probabilities for the top 30 tokens
+        return prob_top30.cpu().tolist(), idx_top30.cpu().tolist()
+
+    def write_scores(self, scores, filenames):
+        # The Python and disk part of save_outputs: decode the tokens and write every answer
+        with self.output_lock:
+            self.write_scores_locked(scores, filenames)
+
+    def write_scores_locked(self, scores, filenames):
+        if self.answer_index is not None:
+            for row, filename in enumerate(filenames):
+                self.output_ready(filename, [self.answer_labels, scores[row]])
+            return
+
+        prob_top30, idx_top30 = scores
+        with self.metrics.stage('postprocess'):
+            # Use self.tokenizer.decode to get the actual token
+            actual_tokens = [[self.decode_token(idx) for idx in row] for row in idx_top30]
+        for row, filename in enumerate(filenames):
+            self.output_ready(filename, [actual_tokens[row], prob_top30[row]])
 
-        # Use self.tokenizer.decode to get the actual token
-        actual_tokens = [self.tokenizer.decode([idx]) for idx in idx_top30]
+    def decode_token(self, idx):
+        # The same few thousand token ids show up in the top 30 again and again, decode each of them once
+        if idx not in self.decoded_tokens:
+            with self.tokenizer_lock: # the fast tokenizer must not be used by two threads at once
+                self.decoded_tokens[idx] = self.tokenizer.decode([idx])
+        return self.decoded_tokens[idx]
 
-        prob_top30 = prob_top30.tolist()
-        instance_output = [actual_tokens, prob_top30]
+    def write_output(self, filename, instance_output):
+        with self.metrics.stage('write'):
+            self.write_result(filename, instance_output)
+            if self.written_answers is not None:
+                self.written_answers[filename] = self.answer_of(instance_output)
+        self.metrics.progress()
+
+    def answer_of(self, instance_output):
+        # The 0/1 answer eval.py reads from a written result, the result store keeps the probabilities in float16
+        probabilities = instance_output[1]
+        if self.result_store is not None:
+            probabilities = np.asarray(probabilities, dtype=np.float16).astype(np.float64)
+        return token_answer(instance_output[0], probabilities, self.config.positive_tokens, self.config.negative_tokens)
+
+    def read_result(self, filename):
+        # A result written by an earlier run, e.g. before --resume
+        if self.result_store is not None:
+            return self.result_store.get(filename)
+        with open(os.path.join(self.config.result_dir, f'{filename}.pk'), 'rb') as f:
+            return pickle.load(f)
+
+    def write_result(self, filename, instance_output):
+        if self.result_store is not None:
+            self.result_store.append(filename, instance_output[0], instance_output[1])
+            return
 
         # Save the top 30 tokens and their probabilities into a pickle file with the filename under self.config.result_dir
         result_fp = os.path.join(self.config.result_dir, f'{filename}.pk')
-        with open(result_fp, 'wb') as f:
-            pickle.dump(instance_output, f)
+        if self.progress is None:
+            with open(result_fp, 'wb') as f:
+                pickle.dump(instance_output, f)
+        else:
+            write_pickle_atomic(result_fp, instance_output, durable=True)
+            self.progress.add(filename)
 
-    def loop_through(self):
+    def is_done(self, filename):
+        if not self.resume:
+            return False
+        if filename in self.skip_keys:
+            return True
+        if self.result_store is not None:
+            return filename in self.result_store
+        return filename in self.progress
+
+    def iterate_cases(self):
+        # Yield (question, filename) for every question in the same order as the original loop
         for instance_key, instance_value in self.question_dict.items():
-            for pair_idx, questions in instance_value.items():
-                targeted_question = questions['targeted_question'] # list of size 1
-                counterfactual_question = questions['counterfactual_question'] # list of size 5
-                converse_targeted_question = questions['converse_targeted_question'] # list of size 1
-                converse_counterfactual_question = questions['converse_counterfactual_question'] # list of size 5
-
-                for qidx, question in enumerate(targeted_question):
-                    filename = 'D-{}-e-{}-TQ-{}'.format(instance_key, pair_idx, qidx)
-                    self.decode_one_case(question, filename)
-                
-                for qidx, question in enumerate(counterfactual_question):
-                    filename = 'D-{}-e-{}-CQ-{}'.format(instance_key, pair_idx, qidx)
-                    self.decode_one_case(question, filename)
-                
-                for qidx, question in enumerate(converse_targeted_question):
-                    filename = 'D-{}-e-{}-CTQ-{}'.format(instance_key, pair_idx, qidx)
-                    self.decode_one_case(question, filename)
-                
-                for qidx, question in enumerate(converse_counterfactual_question):
-                    filename = 'D-{}-e-{}-CCQ-{}'.format(instance_key, pair_idx, qidx)
+            yield from self.iterate_instance_cases(instance_key, instance_value)
+
+    def iterate_instance_cases(self, instance_key, instance_value):
+        # Yield (question, filename) for all event pairs of one discourse instance
+        for pair_idx, questions in instance_value.items():
+            targeted_question = questions['targeted_question'] # list of size 1
+            counterfactual_question = questions['counterfactual_question'] # list of size 5
+            converse_targeted_question = questions['converse_targeted_question'] # list of size 1
+            converse_counterfactual_question = questions['converse_counterfactual_question'] # list of size 5
+
+            for qidx, question in enumerate(targeted_question):
+                filename = 'D-{}-e-{}-TQ-{}'.format(instance_key, pair_idx, qidx)
+                yield question, filename
+            
+            for qidx, question in enumerate(counterfactual_question):
+                filename = 'D-{}-e-{}-CQ-{}'.format(instance_key, pair_idx, qidx)
+                yield question, filename
+            
+            for qidx, question in enumerate(converse_targeted_question):
+                filename = 'D-{}-e-{}-CTQ-{}'.format(instance_key, pair_idx, qidx)
+                yield question, filename
+            
+            for qidx, question in enumerate(converse_counterfactual_question):
+                filename = 'D-{}-e-{}-CCQ-{}'.format(instance_key, pair_idx, qidx)
+                yield question, filename
+
+    def make_batches(self, cases):
+        # Group the questions by token length so that the padding inside a batch is small.
+        # A batch is closed when it reaches batch_size, or when the padded size (longest length * number of questions) exceeds max_batch_tokens.
+        if len(cases) == 0:
+            return [] # e.g. a resumed or fully cached run
+        if self.token_cache is not None:
+            lengths = [self.token_cache.length(filename) for _, filename in cases]
+        else:
+            lengths = [len(ids) for ids in self.tokenizer([question for question, _ in cases]).input_ids]
+        order = sorted(range(len(cases)), key=lambda idx: lengths[idx])
+
+        batches = []
+        current_batch, current_max_length = [], 0
+        for idx in order:
+            max_length = max(current_max_length, lengths[idx])
+            too_many = len(current_batch) >= self.batch_size
+            too_long = self.max_batch_tokens is not None and max_length * (len(current_batch) + 1) > self.max_batch_tokens
+            if current_batch and (too_many or too_long):
+                batches.append(current_batch)
+                current_batch, max_length = [], lengths[idx]
+            current_batch.append(cases[idx])
+            current_max_length = max_length
+        if current_batch:
+            batches.append(current_batch)
+        return batches
+
+    def loop_through(self):
+        num_total = sum(1 for _ in self.iterate_cases())
+        num_done = sum(1 for _, filename in self.iterate_cases() if self.is_done(filename))
+        if self.resume:
+            print('Resuming: {} of {} questions are already done.'.format(num_done, num_total))
+        self.metrics.total = num_total - num_done
+
+        profiler = contextlib.nullcontext()
+        if self.profile:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if self.device.type == 'cuda':
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            profiler = torch.profiler.profile(activities=activities)
+        with profiler:
+            if self.pipeline:
+                self.start_writer()
+            try:
+                self.loop_through_cases()
+            finally:
+                if self.pipeline:
+                    self.stop_writer()
+        if self.profile:
+            # Open it in chrome://tracing or https://ui.perfetto.dev
+            trace_fp = self.config.metrics_fp('qa', 'trace')
+            profiler.export_chrome_trace(trace_fp)
+            print('Profiler trace saved to:', trace_fp)
+        self.close_outputs()
+
+    def close_outputs(self):
+        if self.answer_cache is not None:
+            self.answer_cache.report()
+            self.answer_cache.close()
+        if self.result_store is not None:
+            self.result_store.close()
+        if self.progress is not None:
+            self.progress.close()
+        self.metrics.write(self.metrics_fp)
+
+    def loop_through_cases(self):
+        if self.prefix_cache:
+            # One prefill per discourse instance, shared by all its event pairs and question types
+            for instance_key, instance_value in self.question_dict.items():
+                cases = [case for case in self.iterate_instance_cases(instance_key, instance_value) if not self.is_done(case[1])]
+                cases = self.resolve_cached(cases)
+                if len(cases) > 0:
+                    self.decode_shared_prefix(cases)
+        elif self.pipeline:
+            # The single and batched modes both run as a stream of batches, batch_size 1 gives batches of one question
+            cases = [case for case in self.iterate_cases() if not self.is_done(case[1])]
+            cases = self.resolve_cached(cases)
+            batches = self.make_batches(cases) if self.batch_size > 1 else [[case] for case in cases]
+            print('{} questions grouped into {} batches.'.format(len(cases), len(batches)))
+            self.decode_pipelined(batches)
+        elif self.batch_size == 1:
+            for question, filename in self.iterate_cases():
+                if self.is_done(filename):
+                    continue
+                # A prompt seen earlier in this run is a cache hit by now
+                for question, filename in self.resolve_cached([(question, filename)]):
                     self.decode_one_case(question, filename)
-                
+        else:
+            # Batched mode: bucket all questions by length, every question still gets its own result
+            cases = [case for case in self.iterate_cases() if not self.is_done(case[1])]
+            cases = self.resolve_cached(cases)
+            batches = self.make_batches(cases)
+            print('{} questions grouped into {} batches.'.format(len(cases), len(batches)))
+            for batch in batches:
+                self.decode_batch(batch)
+
+    def decode_pipelined(self, batches):
+        # The prefetch thread prepares the input tensors of the next batches while the model runs the current one.
+        # Both threads only keep up to pipeline_depth batches in their queue, so memory stays bounded.
+        prepared = queue.Queue(maxsize=self.pipeline_depth)
+        stop = threading.Event()
+        errors = []
+
+        def prefetch():
+            try:
+                for batch in batches:
+                    if stop.is_set():
+                        break
+                    prepared.put((batch,) + self.prepare_batch(batch))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                prepared.put(None)
+
+        prefetcher = threading.Thread(target=prefetch, name='qa-prefetch', daemon=True)
+        prefetcher.start()
+        finished = False
+        try:
+            while True:
+                item = prepared.get()
+                if item is None:
+                    finished = True
+                    break
+                self.decode_prepared(*item)
+                if self.writer_errors:
+                    break
+        finally:
+            stop.set()
+            # Let the prefetch thread run into the stop flag instead of blocking on a full queue
+            while not finished:
+                finished = prepared.get() is None
+            prefetcher.join()
+        if errors:
+            raise errors[0]
+
+    def start_writer(self):
+        # The writer thread decodes the top tokens and writes the answers of every batch the model has finished
+        self.write_queue = queue.Queue(maxsize=self.pipeline_depth)
+        self.writer_errors = []
+
+        def write():
+            while True:
+                item = self.write_queue.get()
+                if item is None:
+                    return
+                if self.writer_errors:
+                    continue # keep draining, so the model never blocks on a writer that gave up
+                try:
+                    self.write_scores(*item)
+                except Exception as e:
+                    self.writer_errors.append(e)
+
+        self.writer = threading.Thread(target=write, name='qa-writer', daemon=True)
+        self.writer.start()
+
+    def stop_writer(self):
+        # Wait until every queued answer is written
+        self.write_queue.put(None)
+        self.writer.join()
+        self.write_queue = None
+        if self.writer_errors:
+            raise self.writer_errors[0]
+
+
+    def stratified_order(self, seed=0):
+        # The discourse instances in a random order in which every prefix is a stratified sample by level-2 DR:
+        # the instances of a DR are shuffled and spread evenly over [0, 1) with a random offset, then all are sorted
+        # by that position, so the first m instances hold about m * n_DR / N of each DR
+        rng = np.random.default_rng(seed)
+        DR_keys = {}
+        for key in self.question_dict:
+            DR_keys.setdefault(self.instance_DR.get(key, 'unknown'), []).append(key)
+        positions = []
+        for DR in sorted(DR_keys):
+            keys = DR_keys[DR]
+            offset = rng.random()
+            for rank, idx in enumerate(rng.permutation(len(keys))):
+                positions.append(((rank + offset) / len(keys), keys[idx]))
+        return [key for _, key in sorted(positions)]
+
+    def score_layout(self):
+        # eval.py's view of the question file: the DR names, the level-2 relations it reports, the DR index of every
+        # discourse instance it scores, and the row of each instance key in that list
+        with contextlib.redirect_stdout(io.StringIO()):
+            evaluation = Eval(self.config, verbalize=0)
+        DR_names, filenames, _, instance_of_question, instance_DRs, _ = evaluation.question_layout()
+        instance_row = {}
+        for qtype in filenames:
+            for filename, row in zip(filenames[qtype], instance_of_question[qtype]):
+                instance_row[filename.split('-')[1]] = row
+        return DR_names, evaluation.level2_relation, np.array(instance_DRs, dtype=np.int64), instance_row
+
+    def count_answers(self, instance_keys, instance_row, counts):
+        # Add the answer counts (scoring.answer_counts) of the given instances to counts, which has one row per instance.
+        # The TQ and CTQ (CQ and CCQ) answers of an event pair are appended in the same order, so they stay paired.
+        answers = {qtype: [] for qtype in ['TQ', 'CQ', 'CTQ', 'CCQ']}
+        rows = {qtype: [] for qtype in answers}
+        for key in instance_keys:
+            if key not in instance_row:
+                continue # eval.py does not score it either
+            for _, filename in self.iterate_instance_cases(key, self.question_dict[key]):
+                answer = self.written_answers.get(filename)
+                if answer is None:
+                    answer = self.answer_of(self.read_result(filename))
+                qtype = filename.split('-')[4]
+                answers[qtype].append(answer)
+                rows[qtype].append(instance_row[key])
+        answers = {qtype: np.array(values, dtype=np.int64) for qtype, values in answers.items()}
+        rows = {qtype: np.array(values, dtype=np.int64) for qtype, values in rows.items()}
+        for name, values in answer_counts(answers, rows, len(counts['num_TQ'])).items():
+            counts[name] += values
+
+    def estimate_scores(self, counts, sampled_rows, layout, num_resamples, confidence, seed):
+        # The scores of the sampled instances, overall and per level-2 DR, and their bootstrap intervals (as Eval.bootstrap),
+        # from the per-instance counts, so a round only reads the answers of its own instances
+        DR_names, level2_relation, instance_DRs, _ = layout
+        sampled_counts = {name: values[sampled_rows] for name, values in counts.items()}
+        DRs = instance_DRs[sampled_rows]
+        overall = scores_from_counts({name: values.sum() for name, values in sampled_counts.items()})
+        per_DR = scores_from_counts({name: np.bincount(DRs, weights=values, minlength=len(DR_names)) for name, values in sampled_counts.items()})
+        overall_CI, per_DR_CI = bootstrap_counts(sampled_counts, DRs, len(DR_names), num_resamples, confidence, seed)
+
+        scores, intervals = {}, {}
+        for name, score in [('Overall', 'disq_score'), ('Targeted', 'targeted_score'), ('Counterfactual', 'counterfactual_score'), ('Consistency', 'overall_consistency')]:
+            scores[name] = round(float(overall[score]), 3)
+            intervals[name] = [round(overall_CI[score][0], 3), round(overall_CI[score][1], 3)]
+        for DR_name in level2_relation:
+            if DR_name in DR_names and per_DR['num_TQ'][DR_names.index(DR_name)] > 0:
+                DR = DR_names.index(DR_name)
+                scores[DR_name] = round(float(per_DR['disq_score'][DR]), 3)
+                intervals[DR_name] = [round(float(per_DR_CI['disq_score'][0][DR]), 3), round(float(per_DR_CI['disq_score'][1][DR]), 3)]
+        return scores, intervals
+
+    def loop_through_adaptive(self, target_width, target_DR_width=None, question_budget=None, round_instances=50, min_instances=100, num_resamples=1000, confidence=0.95, seed=0):
+        # Sequential estimation: answer the discourse instances in rounds of a stratified random order (stratified_order)
+        # and re-estimate the scores with bootstrap intervals after every round. Stop once the interval of Overall is at
+        # most target_width wide (and that of every DR at most target_DR_width, if given), or when the next round would go
+        # past question_budget questions. The instances are sampled without replacement, so the bootstrap intervals
+        # are on the conservative side.
+        all_questions = self.question_dict
+        instance_questions = {key: sum(1 for _ in self.iterate_instance_cases(key, value)) for key, value in all_questions.items()}
+        DR_total = {}
+        for key in all_questions:
+            DR = self.instance_DR.get(key, 'unknown')
+            DR_total[DR] = DR_total.get(DR, 0) + 1
+        num_total = sum(instance_questions.values())
+        order = self.stratified_order(seed)
+        layout = self.score_layout()
+        instance_row = layout[3]
+        counts = {name: np.zeros(len(layout[2])) for name in ['num_TQ', 'num_CQ', 'num_CTQ', 'num_CCQ', 'TQ_yes', 'CTQ_yes', 'CQ_no', 'CCQ_no', 'TQ_consistency_count', 'CQ_consistency_count']}
+        self.written_answers = {}
+        print('Adaptive QA over {} discourse instances ({} questions) in rounds of {} instances.'.format(len(order), num_total, round_instances))
+
+        sampled = []
+        num_sampled = 0
+        history = []
+        scores, intervals = {}, {}
+        stop_reason = 'all instances answered'
+        while len(sampled) < len(order):
+            # The next round, cut short where the question budget runs out
+            next_keys = []
+            for key in order[len(sampled):len(sampled) + round_instances]:
+                if question_budget is not None and num_sampled + instance_questions[key] > question_budget:
+                    break
+                next_keys.append(key)
+                num_sampled += instance_questions[key]
+            if len(next_keys) == 0:
+                stop_reason = 'question budget'
+                break
+            sampled.extend(next_keys)
+
+            self.question_dict = {key: all_questions[key] for key in next_keys}
+            if self.pipeline:
+                self.start_writer()
+            try:
+                self.loop_through_cases()
+            finally:
+                if self.pipeline:
+                    self.stop_writer()
+            self.question_dict = all_questions
+
+            self.count_answers(next_keys, instance_row, counts)
+            sampled_rows = np.array([instance_row[key] for key in sampled if key in instance_row], dtype=np.int64)
+            scores, intervals = self.estimate_scores(counts, sampled_rows, layout, num_resamples, confidence, seed)
+            widths = {name: round(high - low, 3) for name, (low, high) in intervals.items()}
+            history.append({'instances': len(sampled), 'questions': num_sampled, 'Overall': scores.get('Overall'), 'CI': intervals.get('Overall'), 'widths': widths})
+            widest = max((DR for DR in widths if DR in DR_total), key=lambda DR: widths[DR], default=None)
+            print('Round {}: {} instances, {} questions, Overall {} {} (width {}){}.'.format(len(history), len(sampled), num_sampled, scores.get('Overall'), intervals.get('Overall'), widths.get('Overall'),
+                ', widest DR {} ({})'.format(widest, widths[widest]) if widest is not None else ''))
+
+            if len(sampled) < len(order) and len(sampled) >= min_instances and self.precise_enough(sampled, DR_total, layout[1], widths, target_width, target_DR_width):
+                stop_reason = 'target width'
+                break
+
+        saved = num_total - num_sampled
+        report = {
+            'stop_reason': stop_reason,
+            'target_width': target_width,
+            'target_DR_width': target_DR_width,
+            'question_budget': question_budget,
+            'confidence': confidence,
+            'resamples': num_resamples,
+            'seed': seed,
+            'instances': len(sampled),
+            'total_instances': len(order),
+            'questions': num_sampled,
+            'total_questions': num_total,
+            # every question not asked is a forward pass a full run would have made
+            'forward_passes_saved': saved,
+            'saved_share': round(saved / num_total, 4) if num_total > 0 else 0.0,
+            'scores': {name: value for name, value in scores.items() if name in intervals},
+            'intervals': intervals,
+            'rounds': history,
+        }
+        print('Stopped after {} rounds ({}): {} of {} instances, {} of {} questions, {} forward passes saved ({:.1%}).'.format(
+            len(history), stop_reason, len(sampled), len(order), num_sampled, num_total, saved, report['saved_share']))
+        if 'Overall' in intervals:
+            print('Overall {} [{}, {}] at {:.0%} confidence.'.format(scores['Overall'], intervals['Overall'][0], intervals['Overall'][1], confidence))
+        report_fp = self.config.metrics_fp('qa', 'adaptive')
+        with open(report_fp, 'w') as f:
+            json.dump(report, f, indent=4)
+        print('Adaptive report saved to:', report_fp)
+
+        self.written_answers = None
+        self.metrics.extra['adaptive'] = {key: report[key] for key in ['stop_reason', 'instances', 'total_instances', 'questions', 'total_questions', 'forward_passes_saved', 'saved_share']}
+        self.close_outputs()
+        return report
+
+    def precise_enough(self, sampled, DR_total, scored_DRs, widths, target_width, target_DR_width):
+        if widths.get('Overall', float('inf')) > target_width:
+            return False
+        if target_DR_width is None:
+            return True
+        # A DR needs two sampled instances (or all it has) before its interval means anything
+        DR_sampled = {}
+        for key in sampled:
+            DR = self.instance_DR.get(key, 'unknown')
+            DR_sampled[DR] = DR_sampled.get(DR, 0) + 1
+        for DR in DR_total:
+            if DR not in scored_DRs:
+                continue # not one of the level-2 relations eval.py scores
+            if DR_sampled.get(DR, 0) < min(2, DR_total[DR]) or widths.get(DR, float('inf')) > target_DR_width:
+                return False
+        return True
+
+    def loop_through_workers(self, num_workers):
+        # Data-parallel QA on one many-core CPU host.
+        # The model is loaded once in this process and the workers are forked from it, so they share the weights copy-on-write.
+        if self.device.type != 'cpu':
+            raise ValueError('--workers is meant for CPU-only hosts, use --batch_size on a GPU instead.')
+
+        # Pick up what the workers of a crashed run had finished
+        merge_worker_results(self.config.result_dir, store=self.result_store, progress=self.progress)
+        if self.resume:
+            self.skip_keys = set(self.result_store.keys()) if self.result_store is not None else set(self.progress.done)
+
+        # Split the instances round-robin, and the torch intra-op threads evenly across the workers
+        instance_keys = list(self.question_dict.keys())
+        shards = [instance_keys[rank::num_workers] for rank in range(num_workers)]
+        num_threads = max(1, torch.get_num_threads() // num_workers)
+        print('Running {} workers with {} threads each.'.format(num_workers, num_threads))
+
+        # The fast tokenizer has already run in this process, forking it with its thread pool live makes the tokenizers
+        # library warn in every worker and turn its parallelism off there anyway, so turn it off before the fork
+        os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+        context = multiprocessing.get_context('fork')
+        workers = []
+        for rank, shard in enumerate(shards):
+            worker = context.Process(target=run_worker, args=(self, rank, shard, num_threads))
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+
+        # Merge the worker results into the normal result layout
+        merged = merge_worker_results(self.config.result_dir, store=self.result_store, progress=self.progress)
+        print('Merged {} results from {} workers.'.format(merged, num_workers))
+        if self.result_store is not None:
+            self.result_store.close()
+        if self.progress is not None:
+            self.progress.close()
+        # The stages of every worker are in its own metrics file, qa_worker{rank}_metrics.json
+        self.metrics.extra['workers'] = num_workers
+        self.metrics.done += merged
+        self.metrics.write(self.metrics_fp)
+
+        failed = [rank for rank, worker in enumerate(workers) if worker.exitcode != 0]
+        if len(failed) > 0:
+            raise RuntimeError('Workers {} failed, rerun with --resume 1 to finish the remaining questions.'.format(failed))
+
+
+def run_worker(qa, rank, instance_keys, num_threads):
+    # Runs in a forked child: answer one shard of the questions with its own result files
+    torch.set_num_threads(num_threads)
+    qa.question_dict = {key: qa.question_dict[key] for key in instance_keys}
+
+    workers_dir = os.path.join(qa.config.result_dir, 'workers')
+    os.makedirs(workers_dir, exist_ok=True)
+    if qa.result_store is not None:
+        qa.result_store = ResultStore(os.path.join(workers_dir, str(rank)), mode='a', durable=qa.resume)
+    if qa.progress is not None:
+        qa.progress = ProgressManifest(workers_dir, name='progress.{}.txt'.format(rank), recover=False)
+    qa.metrics = RunMetrics('QA worker {}'.format(rank))
+    qa.metrics_fp = qa.config.metrics_fp('qa_worker{}'.format(rank))
+    qa.loop_through()
+
 
 if __name__ == '__main__':
     print('Start')
 
     parser = argparse.ArgumentParser()
     # model name
-    parser.add_argument('--dataset', type=str, default='pdtb', help='pdtb or ted?')
+    parser.add_argument('--dataset', type=str, default='pdtb', help='pdtb, ted, or the path of a dataset file, e.g. a synthetic one from dataset_scaler.py.')
     parser.add_argument('--modelname', type=str, default='13bchat', help='None (does not care which modle we deal with), only applicable for using historical QA: 13b, 13bchat, vicuna.')
     parser.add_argument('--modelurl', type=str, default=None, help='modelurl specific the models path in the hugging face model hub (for example, "meta-llama/Meta-Llama-3.1-8B"). modelurl has the right to overwrite modelname. If modelurl is provided, modelname will be ignored. It is used for new models that has not been specified in the config file.')
     parser.add_argument('--version', type=str, default='v1', help='v1, v2, v3, or v4?')
     parser.add_argument('--paraphrase', type=str, default=None, help='Options: None (default), p1, or p2 (paraphrasing to our original questions)')
     parser.add_argument('--feature', type=str, default=None, help='Options: conn, context, or history. Due to dataset characteristics, conn and context are only applicable to PDTB.')
     parser.add_argument('--hfpath', type=str, default='YOUR_PATH', help='The cache_dir for the Hugging Face model.')
+    parser.add_argument('--device', type=str, default='auto', help='Options: auto (default, the GPU if available), cuda, or cpu.')
+    parser.add_argument('--precision', type=str, default='auto', help='Options: auto (default, fp16 on GPU and fp32 on CPU), fp32, fp16 (GPU only), bf16, or int8 (CPU only, dynamic quantization). bf16 and int8 runs write to their own result directory, e.g. data/results/13bchat_dataset_pdtb_prompt_v1_int8.')
+    parser.add_argument('--subset', type=int, default=None, help='Only answer this many discourse instances, evenly spaced over the dataset, e.g. for a parity_report.py run. Default is all.')
     parser.add_argument('--device_number', type=int, default=0, help='Options: 0, 1, 2, 3, 4, 5, 6, 7. Default is 0.')
+    parser.add_argument('--fast_load', type=int, default=0, help='1: load the weights directly in the target dtype with low CPU memory use (needs accelerate). Default is 0.')
+    parser.add_argument('--snapshot_dir', type=str, default=None, help='Only with --fast_load 1: keep a converted safetensors copy of the model here and memory-map it on later runs.')
+    parser.add_argument('--batch_size', type=int, default=1, help='Number of questions decoded in one forward pass. Default is 1 (one question at a time). Questions are grouped by token length to reduce padding.')
+    parser.add_argument('--max_batch_tokens', type=int, default=None, help='Optional token budget per batch (longest prompt length * batch size). Only used when batch_size > 1.')
+    parser.add_argument('--result_format', type=str, default='pickle', help='Options: pickle (default, one .pk file per question) or store (a single append-only result store per run, see result_store.py).')
+    parser.add_argument('--resume', type=int, default=0, help='1: skip the questions that a previous (crashed or killed) run has already answered, and write every result atomically. Default is 0.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes on a CPU-only host. The workers share the loaded model weights and split the torch threads. Default is 1.')
+    parser.add_argument('--answer_scoring', type=str, default='topk', help='Options: topk (default, save the top 30 decoded tokens and their probabilities) or yesno (save p(yes) and p(no), summed over every token id of the positive and negative answer tokens).')
+    parser.add_argument('--scoring_path', type=str, default='generate', help='Options: generate (default, model.generate with one new token) or forward (one forward pass, the LM head is applied only at the last position of each question).')
+    parser.add_argument('--answer_cache', type=str, default=None, help='An SQLite file (e.g. data/answer_cache.sqlite) that keeps the answer of every prompt per model, precision and answer_scoring. Prompts found there, or repeated within the run, are not computed again. Default is None (off).')
+    parser.add_argument('--answer_cache_max_mb', type=float, default=None, help='Only with --answer_cache: evict the least recently used answers when the cache grows past this size in MB.')
+    parser.add_argument('--token_cache', type=int, default=0, help='1: tokenize the question file once and reuse the memory-mapped token ids, also for other models with the same tokenizer (see token_cache.py). Default is 0.')
+    parser.add_argument('--pipeline', type=int, default=0, help='1: tokenize the next batches in a background thread and decode and write the answers in another one, so the model does not wait for either. Default is 0.')
+    parser.add_argument('--pipeline_depth', type=int, default=4, help='Only with --pipeline 1: how many batches each background thread may be ahead of or behind the model. Default is 4.')
+    parser.add_argument('--verbose', type=int, default=0, help='1: print every question (or batch) as it is decoded. Default is 0, one progress line every 30 seconds.')
+    parser.add_argument('--profile', type=int, default=0, help='1: record a torch profiler trace of the whole run next to the result directory (e.g. data/results/13bchat_dataset_pdtb_prompt_v1_qa_trace.json). Meant for short runs, e.g. with --subset. Default is 0.')
+    parser.add_argument('--adaptive', type=int, default=0, help='1: answer the discourse instances in rounds of a random order stratified by level-2 DR, and stop once the bootstrap interval of Overall is at most --target_width wide or --question_budget is reached. The report is saved next to the result directory, e.g. data/results/13bchat_dataset_pdtb_prompt_v1_qa_adaptive.json. Default is 0.')
+    parser.add_argument('--target_width', type=float, default=0.05, help='Only with --adaptive 1: the widest Overall confidence interval to stop at. Default is 0.05.')
+    parser.add_argument('--target_DR_width', type=float, default=None, help='Only with --adaptive 1: also wait until the interval of every level-2 DR is at most this wide. Default is None (Overall only).')
+    parser.add_argument('--question_budget', type=int, default=None, help='Only with --adaptive 1: never ask more than this many questions. Default is None (no budget).')
+    parser.add_argument('--round_instances', type=int, default=50, help='Only with --adaptive 1: discourse instances answered per round. Default is 50.')
+    parser.add_argument('--min_instances', type=int, default=100, help='Only with --adaptive 1: do not stop on the target width before this many instances are answered. Default is 100.')
+    parser.add_argument('--bootstrap', type=int, default=1000, help='Only with --adaptive 1: bootstrap resamples per round. Default is 1000.')
+    parser.add_argument('--confidence', type=float, default=0.95, help='Only with --adaptive 1: the confidence level of the intervals. Default is 0.95.')
+    parser.add_argument('--seed', type=int, default=0, help='Only with --adaptive 1: the seed of the instance order and the bootstrap. Rerun with the same seed and --resume 1 to continue a run. Default is 0.')
+    parser.add_argument('--prefix_cache', type=int, default=0, help='1: prefill the prompt prefix shared by all questions of a discourse instance once and reuse its KV cache. batch_size sets how many questions share one forward pass. Default is 0.')
 
     p = parser.parse_args()
 
     # Create a new config file
-    new_disq_config = DiSQ_Config(dataset=p.dataset, modelname=p.modelname, modelurl=p.modelurl, version=p.version, paraphrase=p.paraphrase, feature=p.feature, hfpath=p.hfpath, device_number=p.device_number)
+    new_disq_config = DiSQ_Config(dataset=p.dataset, modelname=p.modelname, modelurl=p.modelurl, version=p.version, paraphrase=p.paraphrase, feature=p.feature, hfpath=p.hfpath, device_number=p.device_number, precision=p.precision)
 
-    new_qa = QA(new_disq_config)
-    new_qa.loop_through()
+    new_qa = QA(new_disq_config, batch_size=p.batch_size, max_batch_tokens=p.max_batch_tokens, prefix_cache=p.prefix_cache == 1, result_format=p.result_format, resume=p.resume == 1, answer_scoring=p.answer_scoring, scoring_path=p.scoring_path, fast_load=p.fast_load == 1, snapshot_dir=p.snapshot_dir, device=p.device, precision=p.precision, subset=p.subset, answer_cache=p.answer_cache, answer_cache_max_mb=p.answer_cache_max_mb, token_cache=p.token_cache == 1, pipeline=p.pipeline == 1, pipeline_depth=p.pipeline_depth, verbose=p.verbose == 1, profile=p.profile == 1)
+    if p.adaptive == 1:
+        if p.workers > 1:
+            raise ValueError('--adaptive 1 runs in one process, it does not support --workers.')
+        new_qa.loop_through_adaptive(p.target_width, target_DR_width=p.target_DR_width, question_budget=p.question_budget, round_instances=p.round_instances,
+            min_instances=p.min_instances, num_resamples=p.bootstrap, confidence=p.confidence, seed=p.seed)
+    elif p.workers > 1:
+        new_qa.loop_through_workers(p.workers)
+    else:
+        new_qa.loop_through()
@@ -1,25 +1,43 @@
 #!/bin/bash
 
+# Every model is loaded only once: a scoring server (scripts/scoring_server.py) answers all its PDTB/TED x v1-v4 tasks.
+
 # Please define your own path here
 huggingface_path=YOUR_PATH
 
 # Set the device number to 0 as a variable
 device_number=0
 
-# PDTB
+# batch_size 1 keeps the unbatched model.generate path of the paper numbers, e.g. 16 fills every forward pass across the queued tasks
+batch_size=1
+
+socket=data/scoring.sock
+
 for modelname in 7b 7bchat 13b 13bchat vicuna-13b
 do
-	for version in v1 v2 v3 v4
+	rm -f $socket # left behind by a killed server, it would look like a running one
+	python scripts/scoring_server.py serve --socket $socket --modelname $modelname --device_number $device_number --hfpath $huggingface_path --batch_size $batch_size &
+	server_pid=$!
+	# Wait until the server has loaded the model, and stop if it died on the way (e.g. a wrong model name or out of memory)
+	while [ ! -S $socket ]
 	do
-		python scripts/question_answering.py --dataset pdtb --modelname $modelname --version $version --device_number $device_number --hfpath $huggingface_path
+		if ! kill -0 $server_pid 2>/dev/null; then
+			echo "The scoring server exited before it was ready."
+			exit 1
+		fi
+		sleep 5
 	done
-done
 
-# TED
-for modelname in 7b 7bchat 13b 13bchat vicuna-13b
-do
-	for version in v1 v2 v3 v4
+	for dataset in pdtb ted
 	do
-		python scripts/question_answering.py --dataset ted --modelname $modelname --version $version --device_number $device_number --hfpath $huggingface_path
+		for version in v1 v2 v3 v4
+		do
+			python scripts/scoring_server.py submit --socket $socket --dataset $dataset --version $version
+		done
 	done
+
+	python scripts/scoring_server.py wait --socket $socket
+	python scripts/scoring_server.py stats --socket $socket
+	python scripts/scoring_server.py shutdown --socket $socket
+	wait
 done
@@ -2,101 +2,129 @@ import json
 import argparse
 import os
 import json
+import time
 from collections import defaultdict
 
 from disq_config import DiSQ_Config
+from run_metrics import RunMetrics
 
 
 class QG:
   # initialize the class
-  def __init__(self, dataset, modelname, version, paraphrase, feature, config):
+  def __init__(self, dataset, modelname, version, paraphrase, feature, config, paraphrases=None):
     self.dataset = dataset
     self.modelname = modelname
     self.version = version
     self.paraphrase = paraphrase
     self.feature = feature
     self.config = config
+    # The paraphrase sets to generate in one pass over data_dict, by default only config.paraphrase
+    self.paraphrases = paraphrases if paraphrases is not None else [paraphrase]
+    # Stage timers and per-DR timing, written next to the question files at the end of loop_through
+    self.metrics = RunMetrics('QG')
     
-    self.QAUtils = self.config.QAUtils
-    self.data_dict = self.config.data_dict
+    with self.metrics.stage('load'):
+      self.QAUtils = {paraphrase: self.config.paraphrase_registry.get(paraphrase) for paraphrase in self.paraphrases}
+      self.data_dict = self.config.data_dict
     
   def loop_through(self):
     self.output_dict = defaultdict(dict)
     print('length of data_dict:', len(self.data_dict)) 
 
-    self.question_dict = dict()
+    self.question_dict = {paraphrase: dict() for paraphrase in self.paraphrases}
     for instance_key, current_instance in self.data_dict.items():
+      instance_start = time.perf_counter()
+      questions_seconds = 0.0
+      num_questions = 0
       events = current_instance['events']
       DR = current_instance['DR']
       conn = current_instance['Conn']
       arg1 = current_instance['arg1']
       arg2 = current_instance['arg2']
-      if self.dataset == 'pdtb':
-        context = current_instance['context']
+      context = current_instance.get('context') # only PDTB (and datasets scaled from it) have a context
 
       if self.feature == 'conn':
         arg2 = ', {}, {}'.format(conn, arg2)
 
-      self.question_dict[instance_key] = dict()
+      for paraphrase in self.paraphrases:
+        self.question_dict[paraphrase][instance_key] = dict()
       for pair_idx, event_pair in enumerate(events):
         event1 = event_pair[0]
         event2 = event_pair[1]
-        targeted_question, counterfactual_question, converse_targeted_question, converse_counterfactual_question = self.QAUtils.generate_questions(event1, event2, DR)
-
-        questions = {
-            'targeted_question': [targeted_question],
-            'counterfactual_question': counterfactual_question,
-            'converse_targeted_question': [converse_targeted_question],
-            'converse_counterfactual_question': converse_counterfactual_question
-          }
-
-        header = "Respond to a true-or-false question that is derived from a two-sentence discourse. This discourse consists of Sentence 1 (Sent1) and Sentence 2 (Sent2), linked by a specific type of relationship such as causal, temporal, expansion, contrasting, etc. The question will focus on two events mentioned within this discourse. Your task is to determine if these events exhibit the specific relationship highlighted in the question. Please provide a 'True' or 'False' answer based on this analysis.\n\n"
-
-        if self.feature != 'context':  # This is the usual case, where we do not need to add the context.
-          header += 'Sent1: "{}". Sent2: "{}".\nQuestion: '.format(arg1, arg2)
-        else:
-          header += 'Context: "{}"\n\nSent1: "{}". Sent2: "{}".\n\nQuestion: '.format(context, arg1, arg2)
-
-        if self.version == 'v1':
-          for key in questions:
-            for idx_, item in enumerate(questions[key]):
-              if self.feature == 'context':
-                item += ' Please answer the question by referring to the context.'
-              item += ' True or False?'
-              questions[key][idx_] = header + item + '\nAnswer: '
-        if self.version == 'v2':
-          for key in questions:
-            for idx_, item in enumerate(questions[key]):
-              # The purpose is to remove the impact of keywords "True" / "False" in the question.
-              # header = "Respond to a true-or-false question that is derived from a two-sentence discourse. This discourse consists of Sentence 1 (Sent1) and Sentence 2 (Sent2), linked by a specific type of relationship such as causal, temporal, expansion, contrasting, etc. The question will focus on two events mentioned within this discourse. Your task is to determine if these events exhibit the specific relationship highlighted in the question. \n\n"
-              if self.feature == 'context':
-                header = 'Respond to a true-or-false question that is derived from a two-sentence discourse. This discourse consists of Sentence 1 (Sent1) and Sentence 2 (Sent2), linked by a specific type of relationship such as causal, temporal, expansion, contrasting, etc. The question will focus on two events mentioned within this discourse. Your task is to determine if these events exhibit the specific relationship highlighted in the question.\n\nContext: "{}"\n\nSent1: "{}". Sent2: "{}".\n\nQuestion: '.format(context, arg1, arg2)
-                item += ' Please answer the question by referring to the context.'
-              else:
-                header = 'Respond to a true-or-false question that is derived from a two-sentence discourse. This discourse consists of Sentence 1 (Sent1) and Sentence 2 (Sent2), linked by a specific type of relationship such as causal, temporal, expansion, contrasting, etc. The question will focus on two events mentioned within this discourse. Your task is to determine if these events exhibit the specific relationship highlighted in the question. \n\nSent1: "{}". Sent2: "{}".\nQuestion: '.format(arg1, arg2)
-              questions[key][idx_] = header + item + '\nAnswer: '
-        if self.version == 'v3':
-          for key in questions:
-            for idx_, item in enumerate(questions[key]):
-              if self.feature == 'context':
-                item += ' Please answer the question by referring to the context.'
-              item += ' True or False?'
-              questions[key][idx_] = header + item + '\nAnswer:\n'
-        if self.version == 'v4':
-          for key in questions:
-            for idx_, item in enumerate(questions[key]):
-              if self.feature == 'context':
-                item += ' Please answer the question by referring to the context.'
-              item += ' True or False?'
-              questions[key][idx_] = header + item + ' Answer: '
-        
-        self.question_dict[instance_key][pair_idx] = questions
+        for paraphrase in self.paraphrases:
+          start = time.perf_counter()
+          targeted_question, counterfactual_question, converse_targeted_question, converse_counterfactual_question = self.QAUtils[paraphrase].generate_questions(event1, event2, DR)
+          questions_seconds += time.perf_counter() - start
+
+          questions = {
+              'targeted_question': [targeted_question],
+              'counterfactual_question': counterfactual_question,
+              'converse_targeted_question': [converse_targeted_question],
+              'converse_counterfactual_question': converse_counterfactual_question
+            }
+          self.question_dict[paraphrase][instance_key][pair_idx] = self.build_prompts(questions, arg1, arg2, context)
+          num_questions += sum(len(items) for items in questions.values())
+      # Everything but generate_questions is the prompt building
+      instance_seconds = time.perf_counter() - instance_start
+      self.metrics.add_time('questions', questions_seconds, calls=len(events) * len(self.paraphrases))
+      self.metrics.add_time('prompts', instance_seconds - questions_seconds, calls=len(events) * len(self.paraphrases))
+      self.metrics.add_DR_time([self.config.level2_DR(DR)] * num_questions, instance_seconds)
+      self.metrics.done += num_questions
     
-    # Dump the question_dict to a JSON file
-    # fp is the self.config.question_dir and necessary information from self.config.taskname
-    fp = os.path.join(self.config.question_dir, '{}.json'.format(self.config.taskname))
-    with open(fp, 'w') as f:
-        json.dump(self.question_dict, f, indent=4)
+    # Dump every question_dict to a JSON file
+    # fp is the self.config.question_dir and the taskname of the paraphrase
+    self.config.make_dir(self.config.question_dir)
+    for paraphrase in self.paraphrases:
+      fp = os.path.join(self.config.question_dir, '{}.json'.format(self.config.get_taskname(paraphrase)))
+      with self.metrics.stage('write'):
+        with open(fp, 'w') as f:
+            json.dump(self.question_dict[paraphrase], f, indent=4)
+      print('Questions saved to:', fp)
+    self.metrics.extra['paraphrases'] = [str(paraphrase) for paraphrase in self.paraphrases]
+    self.metrics.write(self.config.qg_metrics_fp)
+
+  def build_prompts(self, questions, arg1, arg2, context):
+    # Wrap every question into the prompt of self.version
+    header = "Respond to a true-or-false question that is derived from a two-sentence discourse. This discourse consists of Sentence 1 (Sent1) and Sentence 2 (Sent2), linked by a specific type of relationship such as causal, temporal, expansion, contrasting, etc. The question will focus on two events mentioned within this discourse. Your task is to determine if these events exhibit the specific relationship highlighted in the question. Please provide a 'True' or 'False' answer based on this analysis.\n\n"
+
+    if self.feature != 'context':  # This is the usual case, where we do not need to add the context.
+      header += 'Sent1: "{}". Sent2: "{}".\nQuestion: '.format(arg1, arg2)
+    else:
+      header += 'Context: "{}"\n\nSent1: "{}". Sent2: "{}".\n\nQuestion: '.format(context, arg1, arg2)
+
+    if self.version == 'v1':
+      for key in questions:
+        for idx_, item in enumerate(questions[key]):
+          if self.feature == 'context':
+            item += ' Please answer the question by referring to the context.'
+          item += ' True or False?'
+          questions[key][idx_] = header + item + '\nAnswer: '
+    if self.version == 'v2':
+      for key in questions:
+        for idx_, item in enumerate(questions[key]):
+          # The purpose is to remove the impact of keywords "True" / "False" in the question.
+          # header = "Respond to a true-or-false question that is derived from a two-sentence discourse. This discourse consists of Sentence 1 (Sent1) and Sentence 2 (Sent2), linked by a specific type of relationship such as causal, temporal, expansion, contrasting, etc. The question will focus on two events mentioned within this discourse. Your task is to determine if these events exhibit the specific relationship highlighted in the question. \n\n"
+          if self.feature == 'context':
+            header = 'Respond to a true-or-false question that is derived from a two-sentence discourse. This discourse consists of Sentence 1 (Sent1) and Sentence 2 (Sent2), linked by a specific type of relationship such as causal, temporal, expansion, contrasting, etc. The question will focus on two events mentioned within this discourse. Your task is to determine if these events exhibit the specific relationship highlighted in the question.\n\nContext: "{}"\n\nSent1: "{}". Sent2: "{}".\n\nQuestion: '.format(context, arg1, arg2)
+            item += ' Please answer the question by referring to the context.'
+          else:
+            header = 'Respond to a true-or-false question that is derived from a two-sentence discourse. This discourse consists of Sentence 1 (Sent1) and Sentence 2 (Sent2), linked by a specific type of relationship such as causal, temporal, expansion, contrasting, etc. The question will focus on two events mentioned within this discourse. Your task is to determine if these events exhibit the specific relationship highlighted in the question. \n\nSent1: "{}". Sent2: "{}".\nQuestion: '.format(arg1, arg2)
+          questions[key][idx_] = header + item + '\nAnswer: '
+    if self.version == 'v3':
+      for key in questions:
+        for idx_, item in enumerate(questions[key]):
+          if self.feature == 'context':
+            item += ' Please answer the question by referring to the context.'
+          item += ' True or False?'
+          questions[key][idx_] = header + item + '\nAnswer:\n'
+    if self.version == 'v4':
+      for key in questions:
+        for idx_, item in enumerate(questions[key]):
+          if self.feature == 'context':
+            item += ' Please answer the question by referring to the context.'
+          item += ' True or False?'
+          questions[key][idx_] = header + item + ' Answer: '
+    return questions
 
 
 if __name__ == '__main__':
@@ -104,16 +132,23 @@ if __name__ == '__main__':
 
     parser = argparse.ArgumentParser()
     # model name
-    parser.add_argument('--dataset', type=str, default='pdtb', help='pdtb or ted?')
+    parser.add_argument('--dataset', type=str, default='pdtb', help='pdtb, ted, or the path of a dataset file, e.g. a synthetic one from dataset_scaler.py.')
     parser.add_argument('--modelname', type=str, default=None, help='None (does not care which modle we deal with), only applicable for using historical QA: 13b, 13bchat, vicuna.')
     parser.add_argument('--version', type=str, default='v1', help='v1, v2, v3, or v4?')
-    parser.add_argument('--paraphrase', type=str, default=None, help='Options: None (default), p1, or p2 (paraphrasing to our original questions)')
+    parser.add_argument('--paraphrase', type=str, default=None, help='Options: None (default), p1, p2, or any other set in data/paraphrases (paraphrasing to our original questions). A comma-separated list (e.g. None,p1,p2) or all generates several sets in one pass.')
     parser.add_argument('--feature', type=str, default=None, help='Options: conn, context, or history. Due to dataset characteristics, conn and context are only applicable to PDTB.')
 
     p = parser.parse_args()
 
+    paraphrases = None
+    if p.paraphrase is not None and (p.paraphrase == 'all' or ',' in p.paraphrase):
+      paraphrases = [None if item == 'None' else item for item in p.paraphrase.split(',')] if p.paraphrase != 'all' else 'all'
+      p.paraphrase = None
+
     # Create a new config file    
     new_disq_config = DiSQ_Config(dataset=p.dataset, modelname=p.modelname, modelurl=None, version=p.version, paraphrase=p.paraphrase, feature=p.feature, hfpath=None, device_number=None)
+    if paraphrases == 'all':
+      paraphrases = new_disq_config.paraphrase_registry.names()
 
-    qg = QG(p.dataset, p.modelname, p.version, p.paraphrase, p.feature, new_disq_config)
+    qg = QG(p.dataset, p.modelname, p.version, p.paraphrase, p.feature, new_disq_config, paraphrases=paraphrases)
     qg.loop_through()
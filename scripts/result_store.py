@@ -0,0 +1,268 @@
+import argparse
+import os
+import pickle
+import json
+import shutil
+
+import numpy as np
+
+
+class ResultStore:
+    # A single append-only store per run, replacing one pickle file per question.
+    # Layout under {result_dir}/store:
+    #   tokens.i32   token ids (into vocab.jsonl) of all questions, concatenated
+    #   probs.f16    the matching probabilities in float16
+    #   vocab.jsonl  one decoded token string per line, the line number is the token id
+    #   index.jsonl  one record per question: {"key": filename, "offset": ..., "length": ...}
+    # The index line is written last, so a question only counts once all of its data is on disk.
+    def __init__(self, result_dir, mode='r', durable=False):
+        self.store_dir = os.path.join(result_dir, 'store')
+        self.mode = mode
+        self.durable = durable # fsync the data before writing the index line, so it also survives a node crash
+        self.tokens_fp = os.path.join(self.store_dir, 'tokens.i32')
+        self.probs_fp = os.path.join(self.store_dir, 'probs.f16')
+        self.vocab_fp = os.path.join(self.store_dir, 'vocab.jsonl')
+        self.index_fp = os.path.join(self.store_dir, 'index.jsonl')
+
+        if self.mode == 'a' and not os.path.exists(self.store_dir):
+            os.makedirs(self.store_dir)
+
+        self.load()
+
+        if self.mode == 'a':
+            if self.index_valid_bytes is None:
+                with open(self.index_fp, 'w') as f:
+                    for key, (offset, length) in self.index.items():
+                        f.write(json.dumps({'key': key, 'offset': offset, 'length': length}) + '\n')
+                self.index_valid_bytes = os.path.getsize(self.index_fp)
+            # Drop any trailing data that was written by a crashed run but never indexed
+            for fp, valid_bytes in [(self.tokens_fp, self.num_values * 4), (self.probs_fp, self.num_values * 2), (self.vocab_fp, self.vocab_valid_bytes), (self.index_fp, self.index_valid_bytes)]:
+                if os.path.exists(fp) and os.path.getsize(fp) != valid_bytes:
+                    with open(fp, 'r+b') as f:
+                        f.truncate(valid_bytes)
+            self.tokens_file = open(self.tokens_fp, 'ab')
+            self.probs_file = open(self.probs_fp, 'ab')
+            self.vocab_file = open(self.vocab_fp, 'a')
+            self.index_file = open(self.index_fp, 'a')
+
+    @staticmethod
+    def exists(result_dir):
+        return os.path.exists(os.path.join(result_dir, 'store', 'index.jsonl'))
+
+    def load(self):
+        self.vocab = []
+        self.vocab_valid_bytes = 0
+        if os.path.exists(self.vocab_fp):
+            with open(self.vocab_fp, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break # a half-written line from a crashed run
+                    self.vocab.append(json.loads(line))
+                    self.vocab_valid_bytes += len(line)
+        self.token2id = {token: idx for idx, token in enumerate(self.vocab)}
+
+        self.index = {}
+        self.num_values = 0
+        self.index_valid_bytes = 0
+        if os.path.exists(self.index_fp):
+            with open(self.index_fp, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    record = json.loads(line)
+                    self.index[record['key']] = (record['offset'], record['length'])
+                    self.num_values = max(self.num_values, record['offset'] + record['length'])
+                    self.index_valid_bytes += len(line)
+
+        # If the node went down before the data reached the disk, the index may point past the end of the data files
+        available = min(os.path.getsize(self.tokens_fp) // 4 if os.path.exists(self.tokens_fp) else 0,
+            os.path.getsize(self.probs_fp) // 2 if os.path.exists(self.probs_fp) else 0)
+        if self.num_values > available:
+            print('Dropping index records past the end of the data files in', self.store_dir)
+            self.index = {key: (offset, length) for key, (offset, length) in self.index.items() if offset + length <= available}
+            self.num_values = max([offset + length for offset, length in self.index.values()], default=0)
+            self.index_valid_bytes = None # rewritten from self.index when the store is opened for appending
+
+        # Memory-map the data files, slices of these arrays are views, no copy is made
+        self.tokens = np.zeros(0, dtype=np.int32)
+        self.probs = np.zeros(0, dtype=np.float16)
+        if self.num_values > 0:
+            self.tokens = np.memmap(self.tokens_fp, dtype=np.int32, mode='r', shape=(self.num_values,))
+            self.probs = np.memmap(self.probs_fp, dtype=np.float16, mode='r', shape=(self.num_values,))
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def keys(self):
+        return self.index.keys()
+
+    def append(self, key, tokens, probabilities):
+        token_ids = []
+        for token in tokens:
+            if token not in self.token2id:
+                self.token2id[token] = len(self.vocab)
+                self.vocab.append(token)
+                self.vocab_file.write(json.dumps(token) + '\n')
+            token_ids.append(self.token2id[token])
+
+        self.tokens_file.write(np.asarray(token_ids, dtype=np.int32).tobytes())
+        self.probs_file.write(np.asarray(probabilities, dtype=np.float16).tobytes())
+        for f in [self.tokens_file, self.probs_file, self.vocab_file]:
+            f.flush()
+            if self.durable:
+                os.fsync(f.fileno())
+
+        self.index[key] = (self.num_values, len(token_ids))
+        self.index_file.write(json.dumps({'key': key, 'offset': self.num_values, 'length': len(token_ids)}) + '\n')
+        self.index_file.flush()
+        self.num_values += len(token_ids)
+
+    def get_ids(self, key):
+        # Token ids (into self.vocab) and float16 probabilities, both are views of the memory-mapped files
+        offset, length = self.index[key]
+        return self.tokens[offset:offset + length], self.probs[offset:offset + length]
+
+    def get(self, key):
+        # Same format as the pickle files: [tokens, probabilities]
+        token_ids, probabilities = self.get_ids(key)
+        return [[self.vocab[idx] for idx in token_ids], probabilities.astype(np.float32).tolist()]
+
+    def close(self):
+        if self.mode == 'a':
+            for f in [self.tokens_file, self.probs_file, self.vocab_file, self.index_file]:
+                f.close()
+
+
+class ProgressManifest:
+    # Records which questions of a run are finished, one key (e.g. D-12-e-0-CQ-3) per line in {result_dir}/progress.txt.
+    # A key is only added after its result has been written, so a restarted run can skip it safely.
+    def __init__(self, result_dir, name='progress.txt', recover=True):
+        self.result_dir = result_dir
+        self.fp = os.path.join(result_dir, name)
+
+        self.done = set()
+        if os.path.exists(self.fp):
+            valid_bytes = 0
+            with open(self.fp, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break # a half-written line from a crashed run
+                    self.done.add(line.decode().strip())
+                    valid_bytes += len(line)
+            if os.path.getsize(self.fp) != valid_bytes:
+                with open(self.fp, 'r+b') as f:
+                    f.truncate(valid_bytes)
+        elif recover:
+            self.recover_from_pickles()
+
+        self.file = open(self.fp, 'a')
+
+    def recover_from_pickles(self):
+        # Runs started before the manifest existed: every pickle file that loads completely counts as done
+        if not os.path.exists(self.result_dir):
+            return
+        with open(self.fp, 'w') as manifest:
+            for fn in sorted(os.listdir(self.result_dir)):
+                if not fn.endswith('.pk'):
+                    continue
+                try:
+                    with open(os.path.join(self.result_dir, fn), 'rb') as f:
+                        pickle.load(f)
+                except Exception:
+                    continue
+                self.done.add(fn[:-len('.pk')])
+                manifest.write(fn[:-len('.pk')] + '\n')
+        print('Recovered {} finished questions from the pickle files in {}'.format(len(self.done), self.result_dir))
+
+    def __contains__(self, key):
+        return key in self.done
+
+    def __len__(self):
+        return len(self.done)
+
+    def add(self, key):
+        self.done.add(key)
+        self.file.write(key + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def write_pickle_atomic(result_fp, instance_output, durable=False):
+    # Write to a temporary file first and rename it, so a killed run never leaves a half-written result behind
+    tmp_fp = '{}.tmp{}'.format(result_fp, os.getpid())
+    with open(tmp_fp, 'wb') as f:
+        pickle.dump(instance_output, f)
+        if durable:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_fp, result_fp)
+
+
+def merge_worker_results(result_dir, store=None, progress=None):
+    # QA --workers N writes the results of worker i to {result_dir}/workers/{i} (store runs) and its finished keys to
+    # {result_dir}/workers/progress.{i}.txt (pickle runs, the pickle files themselves go straight into result_dir).
+    # Fold them into the run's own store and manifest, this is also how a crashed multi-worker run is picked up again.
+    workers_dir = os.path.join(result_dir, 'workers')
+    if not os.path.exists(workers_dir):
+        return 0
+    merged = 0
+    for name in sorted(os.listdir(workers_dir)):
+        worker_fp = os.path.join(workers_dir, name)
+        if os.path.isdir(worker_fp):
+            if store is not None and ResultStore.exists(worker_fp):
+                worker_store = ResultStore(worker_fp)
+                for key in worker_store.keys():
+                    tokens, probabilities = worker_store.get(key)
+                    store.append(key, tokens, probabilities)
+                    merged += 1
+            shutil.rmtree(worker_fp)
+        elif name.startswith('progress.'):
+            if progress is not None:
+                worker_progress = ProgressManifest(workers_dir, name=name, recover=False)
+                for key in worker_progress.done:
+                    if key not in progress:
+                        progress.add(key)
+                        merged += 1
+                worker_progress.close()
+            os.remove(worker_fp)
+    os.rmdir(workers_dir)
+    return merged
+
+
+def convert_pickle_dir(result_dir, remove_pickles=False):
+    # One-shot conversion of an existing result directory with one .pk file per question
+    filenames = sorted(fn for fn in os.listdir(result_dir) if fn.endswith('.pk'))
+    store = ResultStore(result_dir, mode='a')
+    converted = 0
+    for fn in filenames:
+        key = fn[:-len('.pk')]
+        if key in store:
+            continue
+        with open(os.path.join(result_dir, fn), 'rb') as f:
+            instance_output = pickle.load(f)
+        store.append(key, instance_output[0], instance_output[1])
+        converted += 1
+    store.close()
+    print('Converted {} of {} pickle files in {}'.format(converted, len(filenames), result_dir))
+
+    if remove_pickles:
+        store = ResultStore(result_dir)
+        for fn in filenames:
+            if fn[:-len('.pk')] in store:
+                os.remove(os.path.join(result_dir, fn))
+        print('Removed the converted pickle files.')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert per-question pickle results into a single result store.')
+    parser.add_argument('result_dirs', type=str, nargs='+', help='One or more result directories, e.g. data/results/13bchat_dataset_pdtb_prompt_v1')
+    parser.add_argument('--remove_pickles', type=int, default=0, help='1: delete the pickle files after they have been converted. Default is 0.')
+    args = parser.parse_args()
+
+    for result_dir in args.result_dirs:
+        convert_pickle_dir(result_dir, remove_pickles=args.remove_pickles == 1)
@@ -0,0 +1,119 @@
+import os
+import json
+import time
+import resource
+import threading
+import contextlib
+from datetime import datetime
+
+import numpy as np
+
+
+class RunMetrics:
+    # Structured timing of one QG, QA or Eval run, written as a JSON summary at the end of the run:
+    #   stages          seconds and calls per stage (e.g. load, tokenize, forward, postprocess, write). With --pipeline 1
+    #                   the stages run on several threads at once, so their sum can be larger than the wall time.
+    #   tokens          prompt tokens, and prompt tokens per second of the forward stage and of the whole run
+    #   prompt_lengths  a histogram and percentiles of the prompt lengths in tokens
+    #   DRs             seconds and questions per discourse relation
+    #   peak_rss_mb     the peak resident memory of the process
+    # Progress is printed as one line every report_every seconds instead of one line per question.
+    def __init__(self, step, report_every=30):
+        self.step = step
+        self.report_every = report_every
+        self.start_time = time.perf_counter()
+        self.started = datetime.now().isoformat(timespec='seconds')
+        self.lock = threading.Lock() # the prefetch and writer threads of --pipeline 1 add to the same counters
+
+        self.seconds = {}
+        self.calls = {}
+        self.prompt_lengths = []
+        self.DR_seconds = {}
+        self.DR_questions = {}
+        self.extra = {}
+
+        self.total = None
+        self.done = 0
+        self.last_report = self.start_time
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds, calls=1):
+        with self.lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + calls
+
+    def add_prompt_lengths(self, lengths):
+        with self.lock:
+            self.prompt_lengths.extend(int(length) for length in lengths)
+
+    def add_DR_time(self, DRs, seconds):
+        # The seconds of one batch, split evenly over its questions and their DRs
+        with self.lock:
+            for DR in DRs:
+                self.DR_seconds[DR] = self.DR_seconds.get(DR, 0.0) + seconds / len(DRs)
+                self.DR_questions[DR] = self.DR_questions.get(DR, 0) + 1
+
+    def progress(self, count=1):
+        with self.lock:
+            self.done += count
+            now = time.perf_counter()
+            if now - self.last_report < self.report_every and self.done != self.total:
+                return
+            self.last_report = now
+        elapsed = now - self.start_time
+        if self.total is not None:
+            print('{}: {} of {} questions done, {:.1f} questions/s, {:.0f} s elapsed.'.format(self.step, self.done, self.total, self.done / elapsed, elapsed))
+        else:
+            print('{}: {} questions done, {:.1f} questions/s, {:.0f} s elapsed.'.format(self.step, self.done, self.done / elapsed, elapsed))
+
+    def summary(self):
+        wall_seconds = time.perf_counter() - self.start_time
+        summary = {
+            'step': self.step,
+            'started': self.started,
+            'wall_seconds': round(wall_seconds, 3),
+            'questions': self.done,
+            'stages': {name: {'seconds': round(self.seconds[name], 3), 'calls': self.calls[name]} for name in self.seconds},
+            # ru_maxrss is in kilobytes on Linux
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+        if len(self.prompt_lengths) > 0:
+            lengths = np.array(self.prompt_lengths)
+            counts, edges = np.histogram(lengths, bins=np.arange(0, lengths.max() + 65, 64))
+            summary['tokens'] = {
+                'prompt_tokens': int(lengths.sum()),
+                'tokens_per_second': round(lengths.sum() / wall_seconds, 1),
+            }
+            if self.seconds.get('forward', 0) > 0:
+                summary['tokens']['forward_tokens_per_second'] = round(lengths.sum() / self.seconds['forward'], 1)
+            summary['prompt_lengths'] = {
+                'min': int(lengths.min()),
+                'p50': int(np.percentile(lengths, 50)),
+                'p90': int(np.percentile(lengths, 90)),
+                'p99': int(np.percentile(lengths, 99)),
+                'max': int(lengths.max()),
+                'histogram': {'{}-{}'.format(int(edges[idx]), int(edges[idx + 1]) - 1): int(count) for idx, count in enumerate(counts) if count > 0},
+            }
+        if len(self.DR_seconds) > 0:
+            summary['DRs'] = {DR: {'seconds': round(self.DR_seconds[DR], 3), 'questions': self.DR_questions[DR],
+                'ms_per_question': round(self.DR_seconds[DR] / self.DR_questions[DR] * 1000, 2)} for DR in sorted(self.DR_seconds)}
+        summary.update(self.extra)
+        return summary
+
+    def write(self, fp):
+        metrics_dir = os.path.dirname(fp)
+        if metrics_dir and not os.path.exists(metrics_dir):
+            os.makedirs(metrics_dir)
+        summary = self.summary()
+        with open(fp, 'w') as f:
+            json.dump(summary, f, indent=4)
+        stages = ', '.join('{} {:.1f} s'.format(name, value['seconds']) for name, value in summary['stages'].items())
+        print('{} took {:.1f} s ({}), peak RSS {:.0f} MB. Metrics saved to: {}'.format(self.step, summary['wall_seconds'], stages, summary['peak_rss_mb'], fp))
+        return summary
@@ -0,0 +1,150 @@
+import warnings
+from collections import defaultdict
+
+import numpy as np
+
+
+# The DiSQ scoring math, shared by Eval, eval_sweep.py and the other scoring tools. It only imports the standard library
+# and NumPy, so scoring a run never pays for torch, transformers or pandas (import_budget.py checks this).
+
+
+def token_answer(tokens, probabilities, positive_tokens, negative_tokens):
+    # The answer of one question from its top tokens: 1 if the positive tokens get more probability than the negative ones
+    token2prob = defaultdict(float)
+    for idx, token in enumerate(tokens):
+        token2prob[token] += probabilities[idx]
+    # Get the positive probability by looping through the positive tokens
+    positive_prob = 0
+    for token in positive_tokens:
+        positive_prob += token2prob[token]
+    # Get the negative probability by looping through the negative tokens
+    negative_prob = 0
+    for token in negative_tokens:
+        negative_prob += token2prob[token]
+    # If the positive probability is greater than the negative probability, then return 1, else return 0
+    if positive_prob > negative_prob:
+        return 1
+    else:
+        return 0
+
+
+def store_answers(result_store, filenames, positive_tokens, negative_tokens):
+    # Vectorized token_answer for a result store: sum the positive and negative token probabilities of every record at once
+    is_positive = np.array([token in positive_tokens for token in result_store.vocab], dtype=bool)
+    is_negative = np.array([token in negative_tokens for token in result_store.vocab], dtype=bool)
+    offsets = np.array([result_store.index[filename][0] for filename in filenames], dtype=np.int64)
+    lengths = np.array([result_store.index[filename][1] for filename in filenames], dtype=np.int64)
+
+    # positions of all values of the requested records, and the record each value belongs to
+    record_of_value = np.repeat(np.arange(len(filenames)), lengths)
+    value_positions = np.repeat(offsets - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    token_ids = np.asarray(result_store.tokens)[value_positions]
+    probabilities = np.asarray(result_store.probs)[value_positions].astype(np.float64)
+
+    positive_prob = np.bincount(record_of_value, weights=probabilities * is_positive[token_ids], minlength=len(filenames))
+    negative_prob = np.bincount(record_of_value, weights=probabilities * is_negative[token_ids], minlength=len(filenames))
+    return (positive_prob > negative_prob).astype(np.int64)
+
+
+def answer_counts(answers, groups, num_groups):
+    # The question and answer counts the scores are made of, one value per group. groups[qtype] gives the group id of
+    # every question of that type, e.g. its DR index, or its discourse instance for bootstrap_scores.
+    def count(qtype, values=None):
+        return np.bincount(groups[qtype], weights=values, minlength=num_groups)
+
+    return {
+        'num_TQ': count('TQ'), 'num_CQ': count('CQ'), 'num_CTQ': count('CTQ'), 'num_CCQ': count('CCQ'),
+        'TQ_yes': count('TQ', answers['TQ'] == 1),
+        'CTQ_yes': count('CTQ', answers['CTQ'] == 1),
+        'CQ_no': count('CQ', answers['CQ'] == 0),
+        'CCQ_no': count('CCQ', answers['CCQ'] == 0),
+        'TQ_consistency_count': count('TQ', answers['TQ'] == answers['CTQ']),
+        'CQ_consistency_count': count('CQ', answers['CQ'] == answers['CCQ']),
+    }
+
+
+def scores_from_counts(counts):
+    # The scores of answer_counts, element-wise, so the counts can have any shape (groups, or resamples x groups)
+    num_TQ, num_CQ, num_CTQ, num_CCQ = counts['num_TQ'], counts['num_CQ'], counts['num_CTQ'], counts['num_CCQ']
+    TQ_yes, CTQ_yes, CQ_no, CCQ_no = counts['TQ_yes'], counts['CTQ_yes'], counts['CQ_no'], counts['CCQ_no']
+    TQ_consistency_count, CQ_consistency_count = counts['TQ_consistency_count'], counts['CQ_consistency_count']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = {}
+        scores['num_TQ'] = num_TQ
+        # targeted score is the accuracy of the targeted questions
+        scores['TQ_accuracy'] = TQ_yes / num_TQ
+        scores['CTQ_accuracy'] = CTQ_yes / num_CTQ
+        scores['targeted_score'] = (TQ_yes + CTQ_yes) / (num_TQ + num_CTQ)
+        # counterfactual score is the accuracy of the counterfactual questions
+        scores['CQ_accuracy'] = CQ_no / num_CQ
+        scores['CCQ_accuracy'] = CCQ_no / num_CCQ
+        scores['counterfactual_score'] = (CQ_no + CCQ_no) / (num_CQ + num_CCQ)
+        # consistency is the portion of TQ_consistency_count over TQ_consistency_total and CQ_consistency_count over CQ_consistency_total
+        TQ_consistency = TQ_consistency_count / num_TQ
+        CQ_consistency = CQ_consistency_count / num_CQ
+        TQ_percent = num_TQ / (num_TQ + num_CQ)
+        CQ_percent = num_CQ / (num_TQ + num_CQ)
+        scores['TQ_consistency'] = TQ_consistency
+        scores['CQ_consistency'] = CQ_consistency
+        scores['overall_consistency'] = TQ_consistency * TQ_percent + CQ_consistency * CQ_percent
+        scores['disq_score'] = scores['targeted_score'] * scores['counterfactual_score'] * scores['overall_consistency']
+    return scores
+
+
+def group_scores(answers, groups, num_groups):
+    # answers[qtype] holds the 0/1 answer of every question of that type, groups[qtype] its group id, e.g. its DR index.
+    # Returns one array per score, with one value per group.
+    return scores_from_counts(answer_counts(answers, groups, num_groups))
+
+
+def bootstrap_scores(answers, instance_of_question, instance_group, num_groups, num_resamples=10000, confidence=0.95, seed=0, chunk_size=500):
+    # Percentile bootstrap intervals of every score, for the whole set and for every group (e.g. DR).
+    # A resample draws discourse instances with replacement within their group, so the questions of an instance stay
+    # together and every resample keeps the group sizes (the DR distribution of the dataset). The draws of a chunk of
+    # resamples form one index matrix (resamples x instances), whose counts weigh the per-instance answer counts,
+    # so all resamples and groups are scored with one matrix product per chunk.
+    # Returns ({score: (low, high)}, {score: (low per group, high per group)}).
+    instance_group = np.asarray(instance_group)
+    counts = answer_counts(answers, instance_of_question, len(instance_group))
+    return bootstrap_counts(counts, instance_group, num_groups, num_resamples, confidence, seed, chunk_size)
+
+
+def bootstrap_counts(counts, instance_group, num_groups, num_resamples=10000, confidence=0.95, seed=0, chunk_size=500):
+    # bootstrap_scores from the answer counts of every instance (answer_counts with one group per instance),
+    # e.g. running counts that are kept up to date while the answers come in
+    instance_group = np.asarray(instance_group)
+    num_instances = len(instance_group)
+    names = list(counts)
+    # instances x (groups * counts): the counts of each instance in the columns of its group
+    group_counts = np.zeros((num_instances, num_groups, len(names)))
+    group_counts[np.arange(num_instances), instance_group] = np.stack([counts[name] for name in names], axis=1)
+    group_counts = group_counts.reshape(num_instances, num_groups * len(names))
+    members = [np.flatnonzero(instance_group == group) for group in range(num_groups)]
+    members = [instances for instances in members if len(instances) > 0]
+
+    rng = np.random.default_rng(seed)
+    overall_samples = []
+    group_samples = []
+    for start in range(0, num_resamples, chunk_size):
+        size = min(chunk_size, num_resamples - start)
+        draws = np.concatenate([instances[rng.integers(0, len(instances), size=(size, len(instances)))] for instances in members], axis=1)
+        weights = np.bincount((draws + np.arange(size)[:, None] * num_instances).ravel(), minlength=size * num_instances)
+        resampled = (weights.reshape(size, num_instances) @ group_counts).reshape(size, num_groups, len(names))
+        group_samples.append(scores_from_counts({name: resampled[:, :, idx] for idx, name in enumerate(names)}))
+        overall_samples.append(scores_from_counts({name: resampled[:, :, idx].sum(axis=1) for idx, name in enumerate(names)}))
+
+    percentiles = [(1 - confidence) / 2 * 100, (1 + confidence) / 2 * 100]
+    overall = {}
+    per_group = {}
+    for score in overall_samples[0]:
+        if score == 'num_TQ':
+            continue
+        with warnings.catch_warnings():
+            # a group without targeted questions has no scores, its interval is NaN
+            warnings.simplefilter('ignore', RuntimeWarning)
+            low, high = np.nanpercentile(np.concatenate([samples[score] for samples in overall_samples]), percentiles)
+            overall[score] = (float(low), float(high))
+            low, high = np.nanpercentile(np.concatenate([samples[score] for samples in group_samples]), percentiles, axis=0)
+            per_group[score] = (low, high)
+    return overall, per_group
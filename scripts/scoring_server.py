@@ -0,0 +1,352 @@
+import argparse
+import os
+import json
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+
+from disq_config import DiSQ_Config
+from result_store import ResultStore, ProgressManifest, write_pickle_atomic
+
+
+class Job:
+    # One question file answered into one result directory, e.g. a (dataset, version) task of one_model.sh.
+    # The results use the same layout as a question_answering.py run (pickle files, or a result store).
+    def __init__(self, job_id, question_fp, result_dir, result_format='pickle', resume=False):
+        self.job_id = job_id
+        self.question_fp = question_fp
+        self.result_dir = result_dir
+        self.resume = resume
+        self.state = 'queued'
+        self.error = None
+        self.submitted = time.time()
+        self.finished = None
+
+        with open(self.question_fp, 'r') as f:
+            self.question_dict = json.load(f)
+        if not os.path.exists(self.result_dir):
+            os.makedirs(self.result_dir)
+
+        self.result_store = None
+        if result_format == 'store':
+            self.result_store = ResultStore(self.result_dir, mode='a', durable=self.resume)
+        self.progress = None
+        if self.resume and self.result_store is None:
+            self.progress = ProgressManifest(self.result_dir)
+
+        self.num_questions = 0
+        self.num_answered = 0
+
+    def is_done(self, filename):
+        if not self.resume:
+            return False
+        if self.result_store is not None:
+            return filename in self.result_store
+        return filename in self.progress
+
+    def write_output(self, filename, instance_output):
+        # Same as QA.write_output, for this job's result directory
+        if self.result_store is not None:
+            self.result_store.append(filename, instance_output[0], instance_output[1])
+        else:
+            result_fp = os.path.join(self.result_dir, f'{filename}.pk')
+            write_pickle_atomic(result_fp, instance_output, durable=self.progress is not None)
+            if self.progress is not None:
+                self.progress.add(filename)
+        self.num_answered += 1
+
+    def close(self):
+        if self.result_store is not None:
+            self.result_store.close()
+        if self.progress is not None:
+            self.progress.close()
+
+    def status(self):
+        return {
+            'job_id': self.job_id,
+            'state': self.state,
+            'question_fp': self.question_fp,
+            'result_dir': self.result_dir,
+            'num_questions': self.num_questions,
+            'num_answered': self.num_answered,
+            'error': self.error,
+            'seconds': round((self.finished or time.time()) - self.submitted, 1),
+        }
+
+
+class ScoringServer:
+    # Keeps one model loaded and answers the questions of every submitted job.
+    # Pending questions of all jobs wait in one queue, a batch is filled from the oldest jobs first,
+    # so the tail of one task shares its forward pass with the head of the next one.
+    def __init__(self, qa, socket_path):
+        self.qa = qa
+        self.socket_path = socket_path
+        # Every result goes through QA.write_output with a '{job_id}/{filename}' key, route it to the job
+        qa.write_output = self.write_output
+
+        self.jobs = {}
+        self.next_job_id = 0
+        self.submitted = deque() # jobs whose questions are not queued yet
+        self.pending = deque() # (question, '{job_id}/{filename}')
+        self.condition = threading.Condition()
+        self.running = True
+
+        self.started = time.time()
+        self.busy_seconds = 0.0
+        self.num_batches = 0
+        self.num_answered = 0
+
+    def write_output(self, key, instance_output):
+        job_id, filename = key.split('/', 1)
+        self.jobs[int(job_id)].write_output(filename, instance_output)
+
+    def submit(self, request):
+        # A job names either a task (dataset, version, paraphrase, feature), whose question file and result
+        # directory for the loaded model come from DiSQ_Config, or an explicit question_fp and result_dir.
+        question_fp, result_dir = request.get('question_fp'), request.get('result_dir')
+        if question_fp is None or result_dir is None:
+            config = DiSQ_Config(dataset=request['dataset'], modelname=self.qa.config.modelname, modelurl=self.qa.config.modelurl, version=request['version'], paraphrase=request.get('paraphrase'), feature=request.get('feature'), hfpath=self.qa.config.hfpath, device_number=self.qa.config.device_number, precision=self.qa.precision)
+            question_fp = question_fp or os.path.join(config.question_dir, '{}.json'.format(config.taskname))
+            result_dir = result_dir or config.result_dir
+        with self.condition:
+            job_id = self.next_job_id
+            self.next_job_id += 1
+        job = Job(job_id, question_fp, result_dir, request.get('result_format', 'pickle'), request.get('resume', 0) == 1)
+        with self.condition:
+            self.jobs[job_id] = job
+            self.submitted.append(job)
+            self.condition.notify_all()
+        print('Job {} submitted: {}'.format(job_id, job.question_fp))
+        return job.status()
+
+    def queue_questions(self, job):
+        # Runs in the scoring loop, the tokenizer must not be used from two threads at once.
+        # Sort each job's questions by token length, like QA.make_batches, to keep the padding small.
+        cases = []
+        for instance_key, instance_value in job.question_dict.items():
+            for question, filename in self.qa.iterate_instance_cases(instance_key, instance_value):
+                if not job.is_done(filename):
+                    cases.append((question, '{}/{}'.format(job.job_id, filename)))
+        lengths = [len(ids) for ids in self.qa.tokenizer([question for question, _ in cases]).input_ids] if cases else []
+        cases = [cases[idx] for idx in sorted(range(len(cases)), key=lambda idx: lengths[idx])]
+
+        with self.condition:
+            job.num_questions = len(cases)
+            self.pending.extend(cases)
+            if len(cases) == 0:
+                self.finish(job)
+        print('Job {}: {} questions queued.'.format(job.job_id, len(cases)))
+
+    def finish(self, job, error=None):
+        # Called with self.condition held
+        if job.state in ['done', 'failed']:
+            return
+        job.close()
+        job.state = 'failed' if error is not None else 'done'
+        job.error = error
+        job.finished = time.time()
+        print('Job {} {}.'.format(job.job_id, job.state))
+        self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            states = [job.state for job in self.jobs.values()]
+            return {
+                'model': self.qa.config.model,
+                'uptime_seconds': round(time.time() - self.started, 1),
+                'busy_seconds': round(self.busy_seconds, 1),
+                'pending_questions': len(self.pending),
+                'jobs': {state: states.count(state) for state in ['queued', 'running', 'done', 'failed']},
+                'answered': self.num_answered,
+                'batches': self.num_batches,
+                'mean_batch_size': round(self.num_answered / self.num_batches, 2) if self.num_batches > 0 else 0,
+                'questions_per_second': round(self.num_answered / self.busy_seconds, 2) if self.busy_seconds > 0 else 0,
+            }
+
+    def wait(self, job_ids):
+        # Block until the given jobs (all jobs if None) are done or failed
+        with self.condition:
+            self.condition.wait_for(lambda: not self.running or all(job.state in ['done', 'failed'] for job_id, job in self.jobs.items() if job_ids is None or job_id in job_ids))
+            return [job.status() for job_id, job in self.jobs.items() if job_ids is None or job_id in job_ids]
+
+    def next_batch(self):
+        with self.condition:
+            self.condition.wait_for(lambda: not self.running or len(self.pending) > 0 or len(self.submitted) > 0)
+            submitted = list(self.submitted)
+            self.submitted.clear()
+        for job in submitted:
+            self.queue_questions(job)
+
+        with self.condition:
+            batch = []
+            while self.pending and len(batch) < self.qa.batch_size:
+                batch.append(self.pending.popleft())
+            for _, key in batch:
+                job = self.jobs[int(key.split('/', 1)[0])]
+                if job.state == 'queued':
+                    job.state = 'running'
+            return batch
+
+    def loop_through(self):
+        # The scoring loop, it runs in the main thread while the socket server answers requests in the background
+        while self.running:
+            batch = self.next_batch()
+            if not batch:
+                continue
+            job_ids = set(int(key.split('/', 1)[0]) for _, key in batch)
+            start = time.time()
+            error = None
+            try:
+                if self.qa.batch_size == 1:
+                    self.qa.decode_one_case(*batch[0])
+                else:
+                    self.qa.decode_batch(batch)
+            except Exception as e:
+                error = '{}: {}'.format(type(e).__name__, e)
+                print('Batch failed:', error)
+            with self.condition:
+                self.busy_seconds += time.time() - start
+                self.num_batches += 1
+                if error is None:
+                    self.num_answered += len(batch)
+                for job_id in job_ids:
+                    job = self.jobs[job_id]
+                    if error is not None:
+                        # Drop the rest of the failed job, its finished questions are kept and a resubmit with resume picks it up
+                        self.pending = deque(case for case in self.pending if int(case[1].split('/', 1)[0]) != job_id)
+                        self.finish(job, error)
+                    elif job.num_answered == job.num_questions:
+                        self.finish(job)
+
+    def handle(self, request):
+        command = request.get('cmd')
+        if command == 'submit':
+            return self.submit(request)
+        if command == 'status':
+            with self.condition:
+                return [job.status() for job in self.jobs.values()]
+        if command == 'stats':
+            return self.stats()
+        if command == 'wait':
+            return self.wait(request.get('job_ids'))
+        if command == 'shutdown':
+            with self.condition:
+                self.running = False
+                self.condition.notify_all()
+            return {'shutdown': True}
+        raise ValueError('Unknown command: {}'.format(command))
+
+    def serve(self):
+        server = self
+
+        class RequestHandler(socketserver.StreamRequestHandler):
+            # One JSON request per line, answered with one JSON line: {"ok": true, "result": ...} or {"ok": false, "error": ...}
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        response = {'ok': True, 'result': server.handle(json.loads(line))}
+                    except Exception as e:
+                        response = {'ok': False, 'error': '{}: {}'.format(type(e).__name__, e)}
+                    self.wfile.write((json.dumps(response) + '\n').encode())
+                    self.wfile.flush()
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path) # left behind by a server that was killed
+        socket_server = socketserver.ThreadingUnixStreamServer(self.socket_path, RequestHandler)
+        socket_server.daemon_threads = True
+        threading.Thread(target=socket_server.serve_forever, daemon=True).start()
+        print('Scoring server listening on', self.socket_path)
+
+        try:
+            self.loop_through()
+        finally:
+            with self.condition:
+                for job in self.jobs.values():
+                    if job.state in ['queued', 'running']:
+                        self.finish(job, 'server shut down')
+            socket_server.shutdown()
+            socket_server.server_close()
+            os.remove(self.socket_path)
+            print('Final stats:', json.dumps(self.stats()))
+
+
+def send_request(socket_path, request, connect_timeout=0):
+    # Send one request to a running server. connect_timeout gives a server that is still loading its model time to come up.
+    deadline = time.time() + connect_timeout
+    while True:
+        try:
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(socket_path)
+            break
+        except (FileNotFoundError, ConnectionRefusedError):
+            client.close()
+            if time.time() >= deadline:
+                raise
+            time.sleep(1)
+    with client, client.makefile('rwb') as f:
+        f.write((json.dumps(request) + '\n').encode())
+        f.flush()
+        response = json.loads(f.readline())
+    if not response['ok']:
+        raise RuntimeError(response['error'])
+    return response['result']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='A long-lived QA scoring server: load a model once and answer the question files of many tasks.')
+    parser.add_argument('command', type=str, help='serve (start the server), submit (add a task), status, stats, wait (until all or the given jobs finish), or shutdown.')
+    parser.add_argument('--socket', type=str, default='data/scoring.sock', help='The Unix socket of the server. Default is data/scoring.sock.')
+    parser.add_argument('--connect_timeout', type=int, default=0, help='Seconds a client command keeps retrying to connect, e.g. while the server loads its model. Default is 0.')
+    # The task of a submit, the same arguments as question_answering.py
+    parser.add_argument('--dataset', type=str, default='pdtb', help='pdtb, ted, or the path of a dataset file, e.g. a synthetic one from dataset_scaler.py.')
+    parser.add_argument('--version', type=str, default='v1', help='v1, v2, v3, or v4?')
+    parser.add_argument('--paraphrase', type=str, default=None, help='Options: None (default), p1, or p2')
+    parser.add_argument('--feature', type=str, default=None, help='Options: conn, context, or history.')
+    parser.add_argument('--question_fp', type=str, default=None, help='submit: answer this question file instead of the one given by dataset/version/paraphrase/feature.')
+    parser.add_argument('--result_dir', type=str, default=None, help='submit: write to this result directory instead of the one given by the model and the task.')
+    parser.add_argument('--result_format', type=str, default='pickle', help='submit: pickle (default) or store.')
+    parser.add_argument('--resume', type=int, default=0, help='submit: 1 to skip the questions that are already answered. Default is 0.')
+    parser.add_argument('--job_ids', type=int, nargs='+', default=None, help='wait: only wait for these jobs. Default is all jobs.')
+    # The model of a serve, the same arguments as question_answering.py
+    parser.add_argument('--modelname', type=str, default='13bchat', help='Model name: 13bchat, 13b, 7bchat, 7b, vicuna-13b')
+    parser.add_argument('--modelurl', type=str, default=None, help='The model path in the hugging face model hub, overwrites modelname.')
+    parser.add_argument('--hfpath', type=str, default='YOUR_PATH', help='The cache_dir for the Hugging Face model.')
+    parser.add_argument('--device_number', type=int, default=0, help='Options: 0, 1, 2, 3, 4, 5, 6, 7. Default is 0.')
+    parser.add_argument('--device', type=str, default='auto', help='Options: auto (default), cuda, or cpu.')
+    parser.add_argument('--precision', type=str, default='auto', help='Options: auto (default), fp32, fp16, bf16, or int8.')
+    parser.add_argument('--fast_load', type=int, default=0, help='1: load the weights directly in the target dtype. Default is 0.')
+    parser.add_argument('--snapshot_dir', type=str, default=None, help='Only with --fast_load 1: keep a converted safetensors copy of the model here.')
+    parser.add_argument('--batch_size', type=int, default=16, help='Number of questions per forward pass, filled across the queued jobs. Default is 16.')
+    parser.add_argument('--answer_scoring', type=str, default='topk', help='Options: topk (default) or yesno.')
+    parser.add_argument('--scoring_path', type=str, default='generate', help='Options: generate (default) or forward.')
+    p = parser.parse_args()
+
+    if p.command == 'serve':
+        from question_answering import QA
+        config = DiSQ_Config(dataset=p.dataset, modelname=p.modelname, modelurl=p.modelurl, version=p.version, paraphrase=p.paraphrase, feature=p.feature, hfpath=p.hfpath, device_number=p.device_number, precision=p.precision)
+        qa = QA(config, batch_size=p.batch_size, answer_scoring=p.answer_scoring, scoring_path=p.scoring_path, fast_load=p.fast_load == 1, snapshot_dir=p.snapshot_dir, device=p.device, precision=p.precision)
+        ScoringServer(qa, p.socket).serve()
+    elif p.command == 'submit':
+        request = {
+            'cmd': 'submit',
+            'dataset': p.dataset,
+            'version': p.version,
+            'paraphrase': p.paraphrase,
+            'feature': p.feature,
+            'question_fp': p.question_fp,
+            'result_dir': p.result_dir,
+            'result_format': p.result_format,
+            'resume': p.resume,
+        }
+        print(json.dumps(send_request(p.socket, request, p.connect_timeout)))
+    elif p.command == 'wait':
+        statuses = send_request(p.socket, {'cmd': 'wait', 'job_ids': p.job_ids}, p.connect_timeout)
+        print(json.dumps(statuses, indent=4))
+        if any(status['state'] != 'done' for status in statuses):
+            raise SystemExit(1)
+    elif p.command in ['status', 'stats', 'shutdown']:
+        print(json.dumps(send_request(p.socket, {'cmd': p.command}, p.connect_timeout), indent=4))
+    else:
+        raise ValueError('Unknown command: {}'.format(p.command))
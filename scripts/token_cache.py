@@ -0,0 +1,106 @@
+import argparse
+import os
+import json
+import hashlib
+
+import numpy as np
+
+from answer_tokens import tokenizer_fingerprint
+
+
+class TokenCache:
+    # The token ids of every question of a question file, encoded once and shared by every model with the same tokenizer
+    # (e.g. all Llama-2 variants and Vicuna). Layout under {cache_dir}/{tokenizer fingerprint}_{question file hash}:
+    #   ids.i32      the token ids of all questions, concatenated
+    #   offsets.i64  num_questions + 1 offsets into ids.i32, question i is ids[offsets[i]:offsets[i + 1]]
+    #   keys.json    the filenames (e.g. D-12-e-0-CQ-3) in the same order
+    # Every file is written to a temporary file and renamed, keys.json last, an entry without it is rebuilt.
+    # Two runs that build the same entry at once write the same bytes, whichever rename comes last wins.
+    def __init__(self, tokenizer, question_fp, cache_dir='data/token_cache', chunk_size=1024):
+        with open(question_fp, 'rb') as f:
+            question_hash = hashlib.sha1(f.read()).hexdigest()[:16]
+        # The special tokens a tokenizer adds are not part of its vocabulary, so a probe encoding is part of the key as well
+        probe = json.dumps(tokenizer('Question: "a (event 1)"?\nAnswer: ').input_ids)
+        tokenizer_key = hashlib.sha1((tokenizer_fingerprint(tokenizer) + probe).encode('utf-8')).hexdigest()[:16]
+        self.cache_dir = os.path.join(cache_dir, '{}_{}'.format(tokenizer_key, question_hash))
+        self.ids_fp = os.path.join(self.cache_dir, 'ids.i32')
+        self.offsets_fp = os.path.join(self.cache_dir, 'offsets.i64')
+        self.keys_fp = os.path.join(self.cache_dir, 'keys.json')
+
+        if not os.path.exists(self.keys_fp) or not self.load():
+            self.build(tokenizer, question_fp, chunk_size)
+            self.load()
+        print('Token cache: {} questions, {} tokens in {}'.format(len(self.key2row), int(self.offsets[-1]), self.cache_dir))
+
+    def load(self):
+        # False if the files of the entry do not fit together, e.g. left behind by an older version that wrote them in place
+        with open(self.keys_fp, 'r') as f:
+            self.key2row = {key: row for row, key in enumerate(json.load(f))}
+        self.offsets = np.fromfile(self.offsets_fp, dtype=np.int64) if os.path.exists(self.offsets_fp) else np.zeros(0, dtype=np.int64)
+        num_ids = os.path.getsize(self.ids_fp) // 4 if os.path.exists(self.ids_fp) else 0
+        if len(self.offsets) != len(self.key2row) + 1 or self.offsets[-1] != num_ids:
+            print('Rebuilding the inconsistent token cache entry in', self.cache_dir)
+            return False
+        self.ids = np.zeros(0, dtype=np.int32)
+        if self.offsets[-1] > 0:
+            self.ids = np.memmap(self.ids_fp, dtype=np.int32, mode='r', shape=(int(self.offsets[-1]),))
+        return True
+
+    def build(self, tokenizer, question_fp, chunk_size):
+        with open(question_fp, 'r') as f:
+            question_dict = json.load(f)
+        keys, questions = [], []
+        for instance_key, instance_value in question_dict.items():
+            for pair_idx, pair_questions in instance_value.items():
+                for qtype, field in [('TQ', 'targeted_question'), ('CQ', 'counterfactual_question'), ('CTQ', 'converse_targeted_question'), ('CCQ', 'converse_counterfactual_question')]:
+                    for qidx, question in enumerate(pair_questions[field]):
+                        keys.append('D-{}-e-{}-{}-{}'.format(instance_key, pair_idx, qtype, qidx))
+                        questions.append(question)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        print('Tokenizing {} questions of {}'.format(len(questions), question_fp))
+        offsets = [0]
+        tmp_fp = '{}.tmp{}'.format(self.ids_fp, os.getpid())
+        with open(tmp_fp, 'wb') as f:
+            # The fast tokenizer encodes a whole chunk in parallel
+            for start in range(0, len(questions), chunk_size):
+                for ids in tokenizer(questions[start:start + chunk_size]).input_ids:
+                    f.write(np.asarray(ids, dtype=np.int32).tobytes())
+                    offsets.append(offsets[-1] + len(ids))
+        os.replace(tmp_fp, self.ids_fp)
+        tmp_fp = '{}.tmp{}'.format(self.offsets_fp, os.getpid())
+        np.asarray(offsets, dtype=np.int64).tofile(tmp_fp)
+        os.replace(tmp_fp, self.offsets_fp)
+        tmp_fp = '{}.tmp{}'.format(self.keys_fp, os.getpid())
+        with open(tmp_fp, 'w') as f:
+            json.dump(keys, f)
+        os.replace(tmp_fp, self.keys_fp)
+
+    def __contains__(self, key):
+        return key in self.key2row
+
+    def get(self, key):
+        # A view of the memory-mapped ids, no copy is made
+        row = self.key2row[key]
+        return self.ids[self.offsets[row]:self.offsets[row + 1]]
+
+    def length(self, key):
+        row = self.key2row[key]
+        return int(self.offsets[row + 1] - self.offsets[row])
+
+
+if __name__ == '__main__':
+    from transformers import AutoTokenizer
+    from disq_config import DiSQ_Config
+
+    parser = argparse.ArgumentParser(description='Pre-tokenize question files once for every model that shares a tokenizer.')
+    parser.add_argument('question_fps', type=str, nargs='+', help='One or more question files, e.g. data/questions/dataset_pdtb_prompt_v1.json')
+    parser.add_argument('--modelname', type=str, default='13bchat', help='Model name: 13bchat, 13b, 7bchat, 7b, vicuna-13b')
+    parser.add_argument('--modelurl', type=str, default=None, help='The model path in the hugging face model hub, overwrites modelname.')
+    parser.add_argument('--hfpath', type=str, default='YOUR_PATH', help='The cache_dir for the Hugging Face model.')
+    args = parser.parse_args()
+
+    config = DiSQ_Config(dataset='pdtb', modelname=args.modelname, modelurl=args.modelurl, version='v1', paraphrase=None, feature=None, hfpath=args.hfpath, device_number=None)
+    tokenizer = AutoTokenizer.from_pretrained(config.model, cache_dir=config.hfpath)
+    for question_fp in args.question_fps:
+        TokenCache(tokenizer, question_fp, config.token_cache_dir)